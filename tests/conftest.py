@@ -0,0 +1,85 @@
+# tests/conftest.py
+import os
+import re
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import viewcpm_cpmfs as cpmfs
+import viewcpm_logic as logic
+import viewcpm_mkfs as mkfs
+from viewcpm_diskdefs import load_diskdef
+
+DISKDEFS = os.path.join(ROOT, "support", "cpmtools", "diskdefs")
+SIDE_ORDERS = ("alt", "outout", "outback")
+
+
+@pytest.fixture(autouse=True)
+def scratch(tmp_path, monkeypatch):
+    """Run every test in its own folder, so tmp/ and the diskdefs cache land there."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def diskdef():
+    """diskdef(name) from the diskdefs bundled with cpmtools."""
+    return lambda name: load_diskdef(DISKDEFS, name)
+
+
+@pytest.fixture
+def blank_raw(scratch):
+    """blank_raw(diskdef) -> path of a freshly formatted RAW image."""
+    def make(dd, name="blank.img"):
+        path = str(scratch / name)
+        with open(path, "wb") as f:
+            f.write(mkfs.blank_raw(dd))
+        return path
+    return make
+
+
+def payload(size, seed=0):
+    """size bytes of non-repeating test data."""
+    return bytes((i * 7 + seed * 13 + i // 251) & 0xFF for i in range(size))
+
+
+@pytest.fixture
+def sided_diskdefs(scratch):
+    """Diskdefs file with p112 (80 cylinders, 2 heads) in each side order, as p112-<order>."""
+    with open(DISKDEFS) as f:
+        p112 = re.search(r"^diskdef p112\n.*?^end\n", f.read(), re.M | re.S).group(0)
+    path = scratch / "sided-diskdefs"
+    path.write_text("".join(p112.replace("diskdef p112", f"diskdef p112-{order}")
+                            .replace("\nend", f"\n  sides {order}\nend") for order in SIDE_ORDERS))
+    return str(path)
+
+
+def write_back(image_path, disk_format, diskdefs_path, files, sides=None):
+    """
+    Open a container natively, write files {name: data} onto it and commit.
+    Returns the working RAW as it was committed.
+    """
+    raw_path = logic.convert_dsk_to_raw(None, image_path, sides=sides)
+    try:
+        image = logic.open_native_image(raw_path, disk_format, writable=True, diskdefs_path=diskdefs_path)
+        with image:
+            for filename, data in files.items():
+                image.write_file(filename, data)
+        logic.record_dirty(raw_path, image.dirty)
+        buffer = logic._buffers[raw_path]
+        if isinstance(buffer, cpmfs.LazyBuffer):
+            buffer.ensure_all()
+        working = bytes(buffer)
+        assert logic.commit_image(None, raw_path, image_path)
+    finally:
+        logic.release_raw(raw_path)
+    return working
+
+
+def placed_by_side_order(raw, dd, tracks):
+    """Whether every RAW track sits at the (cylinder, head) its side order gives; tracks: {(cyl, head): bytes}."""
+    size = dd.sectrk * dd.seclen
+    return all(tracks[address] == raw[t * size:(t + 1) * size]
+               for t, address in enumerate(mkfs.track_addresses(dd)))
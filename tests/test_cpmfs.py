@@ -0,0 +1,65 @@
+# tests/test_cpmfs.py
+import os
+import pytest
+import viewcpm_cpmfs as cpmfs
+import viewcpm_logic as logic
+from conftest import DISKDEFS, payload
+
+FORMATS = ["ibm-3740", "4mb-hd"]     # 8-bit and 16-bit block pointers
+
+
+def padded(data):
+    """What a CP/M file of data reads back as: whole records, ^Z filled."""
+    return data + b"\x1a" * (-len(data) % cpmfs.RECORD_SIZE)
+
+
+@pytest.mark.parametrize("name", FORMATS)
+def test_write_read_delete(name, diskdef, blank_raw):
+    dd = diskdef(name)
+    raw = blank_raw(dd)
+    big = payload(40000, 1)
+    with cpmfs.CpmImage(raw, dd, writable=True) as image:
+        assert image.geom.big_disk == (name == "4mb-hd")
+        free = image.free_blocks()
+        image.write_file("BIG.DAT", big)
+        image.write_file("3:SMALL.TXT", b"hello")
+    with cpmfs.CpmImage(raw, dd) as image:
+        assert image.read_file("BIG.DAT")[:len(big)] == big
+        assert image.read_file("3:SMALL.TXT") == padded(b"hello")
+        assert image.find("SMALL.TXT").user == 3
+    with cpmfs.CpmImage(raw, dd, writable=True) as image:
+        image.delete_file("BIG.DAT")
+        image.delete_file("3:small.txt")
+        assert image.free_blocks() == free
+        assert image.find("BIG.DAT") is None
+
+
+@pytest.mark.parametrize("name", FORMATS)
+def test_logic_round_trip(name, diskdef, blank_raw, scratch):
+    raw = blank_raw(diskdef(name))
+    host = scratch / "host"
+    host.mkdir()
+    files = {"A.TXT": payload(300, 2), "B.BIN": payload(70000, 3)}
+    for filename, data in files.items():
+        (host / filename).write_bytes(data)
+    paths = [str(host / filename) for filename in files]
+    logic.insert_files(None, raw, paths, disk_format=name, diskdefs_path=DISKDEFS)
+    listed = dict(logic.list_image_files(None, raw, name, DISKDEFS))
+    assert sorted(listed) == ["a.txt", "b.bin"]
+
+    out = scratch / "out"
+    out.mkdir()
+    logic.extract_files(None, raw, list(listed), str(out), disk_format=name, diskdefs_path=DISKDEFS)
+    for filename, data in files.items():
+        assert (out / filename.lower()).read_bytes() == padded(data)
+
+    logic.delete_files(None, raw, ["a.txt"], disk_format=name, diskdefs_path=DISKDEFS)
+    assert [n for n, _ in logic.list_image_files(None, raw, name, DISKDEFS)] == ["b.bin"]
+
+
+def test_extract_missing_name_leaves_host_file(diskdef, blank_raw, scratch):
+    raw = blank_raw(diskdef("ibm-3740"))
+    (scratch / "nope.txt").write_bytes(b"keep me")
+    with pytest.raises(RuntimeError):
+        logic.extract_file(None, raw, "NOPE.TXT", str(scratch), "ibm-3740", DISKDEFS)
+    assert (scratch / "nope.txt").read_bytes() == b"keep me"
@@ -0,0 +1,34 @@
+# tests/test_dsk.py
+import pytest
+import viewcpm_dsk as dsk
+import viewcpm_logic as logic
+import viewcpm_mkfs as mkfs
+from viewcpm_diskdefs import load_diskdef
+from conftest import SIDE_ORDERS, payload, placed_by_side_order, write_back
+
+
+def dsk_tracks(path):
+    image = dsk.DskImage(path)
+    return {(t.track, t.side): image.read_track(i) for i, t in enumerate(image.tracks)}
+
+
+@pytest.mark.parametrize("order", SIDE_ORDERS)
+@pytest.mark.parametrize("format_known", [True, False])
+def test_write_back_keeps_side_order(order, format_known, sided_diskdefs, scratch):
+    name = f"p112-{order}"
+    dd = load_diskdef(sided_diskdefs, name)
+    path = str(scratch / "disk.dsk")
+    mkfs.create_image(path, dd)
+    image = dsk.DskImage(path)
+    assert (image.ntracks, image.nsides) == (80, 2)
+    data = payload(90000, 5)     # spans both heads
+    working = write_back(path, name, sided_diskdefs, {"NEW.DAT": data},
+                         sides=order if format_known else None)
+
+    assert placed_by_side_order(working, dd, dsk_tracks(path))
+    raw_path = logic.convert_dsk_to_raw(None, path, sides=order)
+    try:
+        with logic.open_native_image(raw_path, name, diskdefs_path=sided_diskdefs) as image:
+            assert image.read_file("NEW.DAT")[:len(data)] == data
+    finally:
+        logic.release_raw(raw_path)
@@ -0,0 +1,75 @@
+# tests/test_fsck.py
+import pytest
+import viewcpm_cpmfs as cpmfs
+import viewcpm_fsck as fsck
+import viewcpm_logic as logic
+from conftest import DISKDEFS, payload
+
+A = payload(3000, 6)
+B = payload(5000, 7)
+
+
+def entry_of(image, filename):
+    """Index of the first directory entry of filename."""
+    return image.find(filename).entries[0]
+
+
+def set_pointer(image, idx, slot, block):
+    entry = bytearray(image.entry(idx))
+    width = 2 if image.geom.big_disk else 1
+    entry[16 + slot * width:16 + (slot + 1) * width] = block.to_bytes(width, "little")
+    image.set_entry(idx, entry)
+
+
+@pytest.fixture(params=["ibm-3740", "4mb-hd"])
+def damaged(request, diskdef, blank_raw):
+    """An image whose B.DAT has its first block cross-linked into A.DAT's."""
+    dd = diskdef(request.param)
+    raw = blank_raw(dd)
+    with cpmfs.CpmImage(raw, dd, writable=True) as image:
+        image.write_file("A.DAT", A)
+        image.write_file("B.DAT", B)
+        a_blocks, b_blocks = list(image.find("A.DAT").blocks), list(image.find("B.DAT").blocks)
+        set_pointer(image, entry_of(image, "B.DAT"), 0, a_blocks[-1])
+        image.rescan()
+        image.flush()
+    return raw, request.param, b_blocks
+
+
+def test_check_finds_cross_link(damaged):
+    raw, name, _ = damaged
+    report, repaired = logic.check_image(raw, name, DISKDEFS)
+    assert repaired == 0
+    assert "cross-linked" in report.counts()
+    assert not report.ok
+
+
+def test_repair_keeps_later_blocks(damaged, diskdef):
+    raw, name, b_blocks = damaged
+    report, repaired = logic.check_image(raw, name, DISKDEFS, repair=True)
+    assert repaired and report.ok
+    with cpmfs.CpmImage(raw, diskdef(name)) as image:
+        assert image.read_file("A.DAT")[:len(A)] == A
+        b = image.find("B.DAT")
+        # the cross-linked first block is dropped; the rest of B stays readable
+        assert b.blocks == b_blocks[1:]
+        assert image.read_file("B.DAT")[:len(B) - image.geom.blocksize] == B[image.geom.blocksize:]
+        assert all(image.used[block] for block in b.blocks)
+
+
+def test_repair_frees_excess_pointer(diskdef, blank_raw):
+    dd = diskdef("ibm-3740")
+    raw = blank_raw(dd)
+    with cpmfs.CpmImage(raw, dd, writable=True) as image:
+        image.write_file("A.DAT", A)
+        spare = image.geom.total_blocks - 1
+        set_pointer(image, entry_of(image, "A.DAT"), 10, spare)
+        image.rescan()
+        image.flush()
+    report, _ = logic.check_image(raw, "ibm-3740", DISKDEFS)
+    assert report.counts() == {"excess-pointer": 1}
+    report, repaired = logic.check_image(raw, "ibm-3740", DISKDEFS, repair=True)
+    assert repaired == 1 and report.ok
+    with cpmfs.CpmImage(raw, dd) as image:
+        assert not image.used[spare]
+        assert image.read_file("A.DAT")[:len(A)] == A
@@ -0,0 +1,44 @@
+# tests/test_imd.py
+import pytest
+import viewcpm_cpmfs as cpmfs
+import viewcpm_imd as imd
+import viewcpm_logic as logic
+import viewcpm_mkfs as mkfs
+from viewcpm_diskdefs import load_diskdef
+from conftest import DISKDEFS, SIDE_ORDERS, payload, placed_by_side_order, write_back
+
+
+def imd_tracks(path):
+    return {(t.cyl, t.head): b"".join(data for _, data in t.ordered()) for t in imd.read_imd(path).tracks}
+
+
+@pytest.mark.parametrize("order", SIDE_ORDERS)
+@pytest.mark.parametrize("format_known", [True, False])
+def test_write_back_keeps_side_order(order, format_known, sided_diskdefs, scratch):
+    name = f"p112-{order}"
+    dd = load_diskdef(sided_diskdefs, name)
+    path = str(scratch / "disk.imd")
+    mkfs.create_image(path, dd)
+    data = payload(90000, 4)     # spans both heads
+    # without the order up front, opening the image with its format lays the RAW out again
+    working = write_back(path, name, sided_diskdefs, {"NEW.DAT": data},
+                         sides=order if format_known else None)
+
+    assert placed_by_side_order(working, dd, imd_tracks(path))
+    raw_path = logic.convert_dsk_to_raw(None, path, sides=order)
+    try:
+        with logic.open_native_image(raw_path, name, diskdefs_path=sided_diskdefs) as image:
+            assert image.read_file("NEW.DAT")[:len(data)] == data
+    finally:
+        logic.release_raw(raw_path)
+
+
+def test_unchanged_tracks_are_copied(diskdef, scratch):
+    dd = diskdef("ibm-3740")
+    path = str(scratch / "disk.imd")
+    mkfs.create_image(path, dd)
+    before = imd_tracks(path)
+    write_back(path, "ibm-3740", DISKDEFS, {"A.TXT": b"x" * cpmfs.RECORD_SIZE})
+    after = imd_tracks(path)
+    changed = [address for address in before if before[address] != after[address]]
+    assert 0 < len(changed) < len(before)
@@ -0,0 +1,66 @@
+# tests/test_mkfs.py
+import json
+import os
+import stat
+import pytest
+import viewcpm_logic as logic
+import viewcpm_mkfs as mkfs
+from conftest import DISKDEFS, payload
+
+
+@pytest.fixture
+def host(scratch):
+    folder = scratch / "host"
+    (folder / "3").mkdir(parents=True)
+    (folder / "HELLO.TXT").write_bytes(b"hello")
+    (folder / "BIG.BIN").write_bytes(payload(50000, 8))
+    (folder / "3" / "USER3.COM").write_bytes(payload(200, 9))
+    (folder / ".hidden").write_bytes(b"skip")
+    (folder / "much-too-long.name").write_bytes(b"skip")
+    return folder
+
+
+@pytest.mark.parametrize("ext", [".img", ".imd", ".dsk"])
+@pytest.mark.parametrize("name", ["ibm-3740", "p112"])
+def test_created_image_reopens_and_lists(ext, name, diskdef, host, scratch):
+    path = str(scratch / f"new{ext}")
+    result = mkfs.create_image(path, diskdef(name), str(host))
+    assert result["files"] == 3
+    assert sorted(os.path.basename(p) for p in result["skipped"]) == [".hidden", "much-too-long.name"]
+
+    raw_path = path if ext == ".img" else logic.convert_dsk_to_raw(None, path)
+    try:
+        listed = dict(logic.list_image_files(None, raw_path, name, DISKDEFS))
+        assert sorted(listed) == ["3:user3.com", "big.bin", "hello.txt"]
+        report, _ = logic.check_image(raw_path, name, DISKDEFS)
+        assert report.ok
+    finally:
+        logic.release_raw(raw_path)
+
+
+def test_mode_follows_umask_or_replaced_file(diskdef, scratch):
+    path = str(scratch / "new.img")
+    mkfs.create_image(path, diskdef("ibm-3740"))
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o666 & ~mkfs.UMASK
+    os.chmod(path, 0o640)
+    mkfs.create_image(path, diskdef("ibm-3740"), force=True)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+
+
+def test_double_sided_without_sides_line(diskdef):
+    addresses = mkfs.track_addresses(diskdef("p112"))     # 160 tracks, no sides line
+    assert addresses[:3] == [(0, 0), (0, 1), (1, 0)]
+    assert mkfs.track_addresses(diskdef("ibm-3740"))[1] == (1, 0)
+    with pytest.raises(RuntimeError):
+        mkfs.track_addresses(diskdef("ibm-3740"), sides=2)     # 77 tracks
+
+
+def test_batch_manifest(host, scratch):
+    manifest = scratch / "images.json"
+    manifest.write_text(json.dumps({"defaults": {"format": "ibm-3740", "files": "host"},
+                                    "images": [{"output": "out/a.imd"},
+                                               {"output": "out/b.dsk", "format": "p112"},
+                                               {"output": "out/c.img", "format": "no-such-format"}]}))
+    summary = mkfs.create_batch(str(manifest), DISKDEFS, jobs=1)
+    assert (summary["created"], summary["failed"]) == (2, 1)
+    assert sorted(os.listdir(scratch / "out")) == ["a.imd", "b.dsk"]
@@ -0,0 +1,40 @@
+# tests/test_transactions.py
+import pytest
+import viewcpm_cpmfs as cpmfs
+import viewcpm_logic as logic
+from conftest import DISKDEFS, payload
+
+
+@pytest.mark.parametrize("name", ["ibm-3740", "4mb-hd"])
+def test_rollback_leaves_image_identical(name, diskdef, blank_raw):
+    dd = diskdef(name)
+    raw = blank_raw(dd)
+    with cpmfs.CpmImage(raw, dd, writable=True) as image:
+        image.write_file("KEEP.DAT", payload(5000, 1))
+    with open(raw, "rb") as f:
+        before = f.read()
+
+    with cpmfs.CpmImage(raw, dd, writable=True) as image:
+        with pytest.raises(ValueError):
+            with image.transaction():
+                image.write_file("NEW.DAT", payload(20000, 2))
+                image.delete_file("KEEP.DAT")
+                raise ValueError("abandon")
+        assert image.find("KEEP.DAT") is not None
+        assert image.find("NEW.DAT") is None
+    with open(raw, "rb") as f:
+        assert f.read() == before
+
+
+def test_failed_batch_insert_writes_nothing(diskdef, blank_raw, scratch):
+    raw = blank_raw(diskdef("ibm-3740"))
+    with open(raw, "rb") as f:
+        before = f.read()
+    (scratch / "A.TXT").write_bytes(payload(1000))
+    too_big = scratch / "HUGE.DAT"
+    too_big.write_bytes(payload(400000))       # more than an 8" disk holds
+    with pytest.raises(RuntimeError):
+        logic.insert_files(None, raw, [str(scratch / "A.TXT"), str(too_big)],
+                           disk_format="ibm-3740", diskdefs_path=DISKDEFS)
+    with open(raw, "rb") as f:
+        assert f.read() == before
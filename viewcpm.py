@@ -1,14 +1,22 @@
 # viewcpm.py
 import os
+import sys
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import threading
 import viewcpm_logic as logic
+import viewcpm_index as index
+import viewcpm_mkfs as mkfs
 import viewcpm_prefs as prefs
+import viewcpm_preview as preview
 import viewcpm_utils as utils
 from viewcpm_diskops import DiskImageManager
+from viewcpm_jobs import JobScheduler
+from viewcpm_treeview import FileTree
+from viewcpm_watch import FolderWatcher
+from viewcpm_workspace import Workspace
 from viewcpm_diskdefs import DiskDefsManager
 
+JOB_POLL_MS = 50
 
 # ----------------------------
 # Tooltip Helper
@@ -69,8 +77,21 @@ class ViewCPMApp(tk.Tk):
         if self.diskdefs_path and os.path.exists(self.diskdefs_path):
             self.diskdefs_manager = DiskDefsManager(self.diskdefs_path)        
     
+        # Background jobs; results come back to the UI thread via poll_jobs()
+        self.jobs = JobScheduler()
+        self.folder_watcher = None
+
         # Disk manager
-        self.disk_manager = DiskImageManager(self.cpmtools_path, status_callback=self.status_callback)
+        self.disk_manager = DiskImageManager(self.cpmtools_path, scheduler=self.jobs)
+
+        # Open images; pipeline updates come back through poll_jobs() too
+        self.workspace = Workspace(
+            self.samdisk_path,
+            self.list_workspace_image,
+            lambda entry: self.jobs.post("workspace", None, entry),
+            max_processes=prefs.get_pref("max_conversions", 2),
+        )
+        self._activate_when_ready = None
     
         # UI
         self.create_toolbar()
@@ -80,13 +101,14 @@ class ViewCPMApp(tk.Tk):
     
         # Schedule final window setup after idle
         self.after_idle(self.finish_setup)
+        self.after(JOB_POLL_MS, self.poll_jobs)
         
     # -------------------------------------------------------------------------
     # Diskdefs loader
     # -------------------------------------------------------------------------
     def _load_diskdefs(self):
         """Load diskdefs from path in preferences if available."""
-        diskdefs_path = self.prefs.get("diskdefs_path")
+        diskdefs_path = self.prefs.get_pref("diskdefs_path")
         if diskdefs_path and os.path.exists(diskdefs_path):
             self.diskdefs_manager = DiskDefsManager(diskdefs_path)
         else:
@@ -98,17 +120,39 @@ class ViewCPMApp(tk.Tk):
         self._current_image_path = image_path
         self.update_title(image_path)  # show filename in title
         prefs.set_pref("last_disk_image", image_path)  # ShaZam! — remember exact file                
-        threading.Thread(target=self.convert_and_list_image, args=(image_path,), daemon=True).start()
+        self.load_image_job(image_path)
     
             
     def open_folder_from_path(self, folder):
-        for item in self.folder_tree.get_children():
-            self.folder_tree.delete(item)
-        files = utils.list_host_files(folder)
-        for f, size in files:
-            self.folder_tree.insert("", "end", values=(f, f"{size:,}"))
+        # Stream the folder into the tree a chunk at a time; only changed rows are touched
+        self._current_folder = folder
         self.host_folder_var.set(f"Folder: {folder}")
-        self.status_var.set(f"Loaded folder: {folder}")
+        self.status_var.set(f"Loading folder: {folder}")
+        self.folder_view.load(
+            utils.iter_host_files(folder),
+            done=lambda count: self.status_var.set(f"Loaded folder: {folder} ({count:,} files)"),
+        )
+        self.watch_folder(folder)
+
+    def watch_folder(self, folder):
+        """Keep the host pane in step with folder; changes arrive via poll_jobs()."""
+        if self.folder_watcher:
+            self.folder_watcher.stop()
+        self.folder_watcher = FolderWatcher(
+            folder,
+            lambda change: self.jobs.post("folder", None, (folder, change)),
+            interval=prefs.get_pref("watch_poll_interval", 2.0),
+            use_inotify=prefs.get_pref("watch_inotify", True),
+        ).start()
+
+    def apply_folder_change(self, folder, change):
+        if folder != getattr(self, "_current_folder", None):
+            return  # from a watcher that has since been replaced
+        if change is None:
+            self.folder_view.load(utils.iter_host_files(folder))
+        else:
+            rows, removed = change
+            self.folder_view.apply(rows, removed)
     
         
     def finish_setup(self):
@@ -145,9 +189,24 @@ class ViewCPMApp(tk.Tk):
         toolbar = ttk.Frame(self, padding=4)
         ttk.Button(toolbar, text="Open Folder", command=self.open_folder).pack(side=tk.LEFT, padx=2)
         ttk.Button(toolbar, text="Open Image", command=self.open_disk_image).pack(side=tk.LEFT, padx=2)
+        new_btn = ttk.Button(toolbar, text="New Image", command=self.new_disk_image)
+        new_btn.pack(side=tk.LEFT, padx=2)
+        create_tooltip(new_btn, "Create a formatted image in the selected disk format")
         ttk.Button(toolbar, text="Insert", command=self.insert_file).pack(side=tk.LEFT, padx=2)
         ttk.Button(toolbar, text="Extract", command=self.extract_file).pack(side=tk.LEFT, padx=2)
         ttk.Button(toolbar, text="Delete", command=self.delete_file).pack(side=tk.LEFT, padx=2)
+        copy_btn = ttk.Button(toolbar, text="Copy To...", command=self.copy_to_image)
+        copy_btn.pack(side=tk.LEFT, padx=2)
+        create_tooltip(copy_btn, "Copy or move the selected files straight onto another open image")
+        check_btn = ttk.Button(toolbar, text="Check", command=self.check_image)
+        check_btn.pack(side=tk.LEFT, padx=2)
+        create_tooltip(check_btn, "Check the image directory and block allocation, and offer repairs")
+        save_btn = ttk.Button(toolbar, text="Save", command=self.save_image)
+        save_btn.pack(side=tk.LEFT, padx=2)
+        create_tooltip(save_btn, "Write changes back to the original disk image")
+        cancel_btn = ttk.Button(toolbar, text="Cancel", command=self.cancel_jobs)
+        cancel_btn.pack(side=tk.LEFT, padx=2)
+        create_tooltip(cancel_btn, "Cancel running and queued operations (Esc)")
     
         # Get saved disk format from prefs
         saved_format = self.prefs.get_pref("disk_format", "")
@@ -181,9 +240,68 @@ class ViewCPMApp(tk.Tk):
         settings_btn = ttk.Button(toolbar, text="Preferences", command=self.open_prefs_dialog)
         settings_btn.pack(side=tk.RIGHT, padx=2)
         create_tooltip(settings_btn, "Preferences for paths and other things")
+
+        # --- Catalog search ---
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(toolbar, textvariable=self.search_var, width=24)
+        search_entry.pack(side=tk.RIGHT, padx=2)
+        search_entry.bind("<Return>", lambda e: self.search_catalog())
+        create_tooltip(search_entry, "Search the image catalog: filename pattern, hash:<hex> or dupes (Enter)")
+        ttk.Label(toolbar, text="Find:").pack(side=tk.RIGHT)
     
         toolbar.pack(side=tk.TOP, fill=tk.X)
 
+    # ----------------------------
+    # Catalog Search
+    # ----------------------------
+    def search_catalog(self):
+        text = self.search_var.get().strip()
+        if not text:
+            return
+        catalog_path = prefs.get_pref("catalog_path", index.CATALOG_FILE)
+        if not os.path.exists(catalog_path):
+            messagebox.showinfo("Find", "No image catalog yet. Build one with:\n\n"
+                                        "python viewcpm_index.py scan <folder>")
+            return
+
+        def query(job):
+            with index.Catalog(catalog_path) as catalog:
+                return catalog.search(text)
+
+        def show(job):
+            if job.state == "done":
+                rows = job.result
+                job.result = f"Find '{text}': {len(rows)} file(s)"
+                self.show_search_results(text, rows)
+
+        self.jobs.submit("Find", query, key="catalog", on_done=show)
+
+    def show_search_results(self, text, rows):
+        window = tk.Toplevel(self)
+        window.title(f"Find: {text}")
+        window.geometry("800x400")
+        columns = ("image", "name", "size", "hash")
+        tree = ttk.Treeview(window, columns=columns, show="headings")
+        for col, title, width in zip(columns, ("Image", "Filename", "Size", "Hash"), (340, 140, 80, 240)):
+            tree.heading(col, text=title)
+            tree.column(col, width=width, anchor="e" if col == "size" else "w")
+        yscroll = ttk.Scrollbar(window, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=yscroll.set)
+        yscroll.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.pack(fill=tk.BOTH, expand=True)
+        for row in rows:
+            name = f"{row['user']}:{row['name']}" if row["user"] else row["name"]
+            tree.insert("", "end", values=(row["image"], name.lower(), f"{row['size']:,}", row["hash"] or ""))
+        if not rows:
+            tree.insert("", "end", values=("No matches.", "", "", ""))
+
+        def open_selected(event):
+            selection = tree.selection()
+            if selection:
+                self.open_disk_image_from_path(tree.item(selection[0], "values")[0])
+
+        tree.bind("<Double-1>", open_selected)
+
     # ----------------------------
     # Main Panes
     # ----------------------------
@@ -199,6 +317,7 @@ class ViewCPMApp(tk.Tk):
         ttk.Label(left_frame, text="Host Folder", font=("TkDefaultFont", 10, "bold")).pack(anchor="w")
         self.folder_tree = self.create_treeview(left_frame)
         self.folder_tree.pack(fill=tk.BOTH, expand=True)
+        self.folder_view = FileTree(self.folder_tree)
         # Label to show current folder under the treeview
         self.host_folder_var = tk.StringVar(value="Folder: N/A")
         ttk.Label(left_frame, textvariable=self.host_folder_var).pack(anchor="w", pady=(2,0))        
@@ -206,15 +325,49 @@ class ViewCPMApp(tk.Tk):
 
         # Right: Disk Image
         right_frame = ttk.Frame(self.paned, padding=2)
+        ttk.Label(right_frame, text="Open Images", font=("TkDefaultFont", 10, "bold")).pack(anchor="w")
+        workspace_frame = ttk.Frame(right_frame)
+        self.workspace_tree = ttk.Treeview(workspace_frame, columns=("image", "state"), show="headings", height=4,
+                                           selectmode="browse")
+        self.workspace_tree.heading("image", text="Image")
+        self.workspace_tree.heading("state", text="State")
+        self.workspace_tree.column("image", width=160, anchor="w")
+        self.workspace_tree.column("state", width=240, anchor="w")
+        yscroll = ttk.Scrollbar(workspace_frame, orient=tk.VERTICAL, command=self.workspace_tree.yview)
+        self.workspace_tree.configure(yscrollcommand=yscroll.set)
+        yscroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.workspace_tree.pack(fill=tk.X, expand=True)
+        workspace_frame.pack(fill=tk.X)
+        ttk.Button(right_frame, text="Close Image", command=self.close_workspace_image).pack(anchor="e", pady=2)
         ttk.Label(right_frame, text="Disk Image", font=("TkDefaultFont", 10, "bold")).pack(anchor="w")
         self.image_tree = self.create_treeview(right_frame)
         self.image_tree.pack(fill=tk.BOTH, expand=True)
+        self.image_view = FileTree(self.image_tree)
         # Disk info labels
         self.disk_info_var = tk.StringVar(value="Disk Size: N/A   Free Space: N/A")
         ttk.Label(right_frame, textvariable=self.disk_info_var).pack(anchor="w", pady=(2,0))       
         
         self.paned.add(right_frame, weight=1)        
 
+        # Far right: preview of the selected image file
+        preview_frame = ttk.Frame(self.paned, padding=2)
+        header = ttk.Frame(preview_frame)
+        ttk.Label(header, text="Preview", font=("TkDefaultFont", 10, "bold")).pack(side=tk.LEFT)
+        self.preview_mode_btn = ttk.Button(header, text="Hex", width=5, command=self.toggle_preview_mode)
+        self.preview_mode_btn.pack(side=tk.RIGHT)
+        header.pack(fill=tk.X)
+        self.preview_text = tk.Text(preview_frame, wrap=tk.NONE, font="TkFixedFont", width=40, state=tk.DISABLED)
+        yscroll = ttk.Scrollbar(preview_frame, orient=tk.VERTICAL, command=self.preview_text.yview)
+        self.preview_text.configure(yscrollcommand=lambda first, last: self.on_preview_scroll(yscroll, first, last))
+        yscroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.preview_text.pack(fill=tk.BOTH, expand=True)
+        self.preview_info_var = tk.StringVar(value="Select a file in the disk image.")
+        ttk.Label(preview_frame, textvariable=self.preview_info_var).pack(anchor="w", pady=(2,0))
+        self.paned.add(preview_frame, weight=1)
+        self._preview = None
+        self._preview_generation = 0
+        self._preview_loading = False
+
     def create_treeview(self, parent):
         tree = ttk.Treeview(parent, columns=("name", "size"), show="headings")
         tree.heading("name", text="Filename")
@@ -238,12 +391,46 @@ class ViewCPMApp(tk.Tk):
     def status_callback(self, msg):
         self.status_var.set(msg)
 
+    # ----------------------------
+    # Background Jobs
+    # ----------------------------
+    def poll_jobs(self):
+        """Apply queued job events on the UI thread, then poll again."""
+        self.jobs.drain(self.on_job_event)
+        self.after(JOB_POLL_MS, self.poll_jobs)
+
+    def on_job_event(self, kind, job, message):
+        if kind == "folder":
+            self.apply_folder_change(*message)
+        elif kind == "workspace":
+            self.on_workspace_update(message)
+        elif kind == "status":
+            self.status_callback(message)
+        elif kind == "progress":
+            self.status_callback(job.describe())
+        elif kind == "finished":
+            if job.state == "failed":
+                self.status_callback(f"{job.label} failed: {job.error}")
+            elif job.state == "cancelled":
+                self.status_callback(f"{job.label} cancelled.")
+            elif isinstance(job.result, str):
+                self.status_callback(job.result)
+
+    def cancel_jobs(self):
+        if self.jobs.pending() or self.workspace.pending():
+            self.jobs.cancel_all()
+            self.workspace.cancel_all()
+            self.status_callback("Cancelling...")
+
     # ----------------------------
     # Event Bindings
     # ----------------------------
     def bind_events(self):
         # Drag-and-drop can be implemented later
-        pass
+        self.bind("<Escape>", lambda event: self.cancel_jobs())
+        self.image_tree.bind("<<TreeviewSelect>>", lambda event: self.preview_selection())
+        self.workspace_tree.bind("<<TreeviewSelect>>", lambda event: self.on_workspace_select())
+        self.workspace_tree.bind("<Delete>", lambda event: self.close_workspace_image())
     
     # ----------------------------
     # Disk Format Selection
@@ -354,14 +541,7 @@ class ViewCPMApp(tk.Tk):
         folder = filedialog.askdirectory(title="Select Host Folder", initialdir=last_folder)
         if folder:
             prefs.set_pref("last_host_folder", folder)
-            for item in self.folder_tree.get_children():
-                self.folder_tree.delete(item)
-            files = utils.list_host_files(folder)
-            for f, size in files:
-                # ShaZam! — format size with commas
-                self.folder_tree.insert("", "end", values=(f, f"{size:,}"))
-            self.status_var.set(f"Loaded folder: {folder}")
-            self.host_folder_var.set(f"Folder: {folder}")        
+            self.open_folder_from_path(folder)
 
     # ----------------------------
     # Disk Image
@@ -369,61 +549,163 @@ class ViewCPMApp(tk.Tk):
     def open_disk_image(self):
         last_folder = prefs.get_pref("last_image_folder", os.path.expanduser("~"))
         filetypes = [("Disk Images", "*.dsk *.img *.imd"), ("All files", "*.*")]
-        image_path = filedialog.askopenfilename(title="Select Disk Image", filetypes=filetypes, initialdir=last_folder)
-        if image_path:
-            prefs.set_pref("last_image_folder", os.path.dirname(image_path))
-            self._current_image_path = image_path
-            self.update_title(image_path)  # ShaZam! — update title bar with filename
-            prefs.set_pref("last_disk_image", image_path)  # ShaZam! — remember exact file        
-            threading.Thread(target=self.convert_and_list_image, args=(image_path,), daemon=True).start()
-
-    def convert_and_list_image(self, image_path):
-        self.status_var.set(f"Converting {image_path} → tmp RAW")
-        try:
-            # Convert to RAW via SAMdisk
-            raw_path = logic.convert_dsk_to_raw(self.samdisk_path, image_path)
-            self._current_raw_path = raw_path
-            # ShaZam! — update title to show the loaded image
-            self.update_title(image_path)            
-            self.disk_manager.set_current_raw(raw_path)
-    
-            # Determine selected disk format
-            disk_format = "kpii"  # default
-            if self.disk_format_var.get() and self.diskdefs_manager:
-                disk_format = self.disk_format_var.get()
-            self._current_disk_format = disk_format
-    
-            # List files from image
-            files = logic.list_image_files(self.cpmtools_path, raw_path, disk_format=disk_format)
-            # Populate tree AND refresh disk info
-            self.image_tree.after(0, self.refresh_image_tree)
-    
-            # Compute disk size from diskdefs
-            disk_size = 0
-            if self.diskdefs_manager:
-                disk_info = self.diskdefs_manager.get_disk_info(disk_format)
-                if disk_info:
-                    disk_size = disk_info.get("disksize", 0)
-    
-            # Sum file sizes to calculate remaining space
-            used_size = sum(size for _, size in files)
-            free_size = max(disk_size - used_size, 0) if disk_size else 0
-    
-            # Update GUI
-            self.disk_info_var.set(
-                f"Disk Size: {disk_size:,} bytes   Free Space: {free_size:,} bytes"
-                if disk_size else "Disk Size: N/A   Free Space: N/A"
-            )
-            self.status_var.set(f"Loaded disk image: {image_path}")
-    
-        except Exception as e:
-            self.status_var.set(str(e))
+        image_paths = filedialog.askopenfilenames(title="Select Disk Images", filetypes=filetypes,
+                                                  initialdir=last_folder)
+        if image_paths:
+            prefs.set_pref("last_image_folder", os.path.dirname(image_paths[0]))
+            prefs.set_pref("last_disk_image", image_paths[0])  # ShaZam! — remember exact file
+            self.load_images(image_paths)
+
+    def new_disk_image(self):
+        disk_format = self.disk_format_var.get()
+        if not (self.diskdefs_manager and disk_format in self.diskdefs_manager.get_disk_names()):
+            messagebox.showwarning("New Image", "Select the disk format of the new image first.")
+            return
+        last_folder = prefs.get_pref("last_image_folder", os.path.expanduser("~"))
+        filetypes = [("ImageDisk", "*.imd"), ("Extended DSK", "*.dsk"), ("RAW", "*.img *.raw")]
+        out_path = filedialog.asksaveasfilename(title=f"New {disk_format} Image", filetypes=filetypes,
+                                                defaultextension=".imd", initialdir=last_folder)
+        if not out_path:
+            return
+        files = None
+        folder = getattr(self, "_current_folder", None)
+        if folder and messagebox.askyesno("New Image", f"Copy the files in {folder} onto the new image?"):
+            files = folder
+        diskdef = self.diskdefs_manager.get_diskdef(disk_format)
+
+        def create(job):
+            result = mkfs.create_image(out_path, diskdef, files, force=True)
+            skipped = result["skipped"]
+            note = (f"; skipped {len(skipped)} without a CP/M name: "
+                    + ", ".join(os.path.basename(path) for path in skipped[:5])
+                    + (", ..." if len(skipped) > 5 else "")) if skipped else ""
+            return f"Created {os.path.basename(out_path)} ({disk_format}, {result['files']} files{note})"
+
+        def created(job):
+            if job.state == "done":
+                self.load_images([out_path])
+
+        prefs.set_pref("last_image_folder", os.path.dirname(out_path))
+        self.jobs.submit("New Image", create, key=os.path.abspath(out_path), on_done=created)
+
+    def load_image_job(self, image_path):
+        self.load_images([image_path])
+
+    def load_images(self, image_paths):
+        """
+        Open images in the workspace; they convert and list concurrently
+        and each shows up in the list as soon as it is ready. The first
+        one is shown in the image pane once it is loaded.
+        """
+        selected = self.disk_format_var.get()
+        if not (self.diskdefs_manager and selected in self.diskdefs_manager.get_disk_names()):
+            selected = None
+        entries = self.workspace.open(image_paths, disk_format=selected)
+        for entry in entries:
+            self.on_workspace_update(entry)
+        self._activate_when_ready = entries[0].image_path
+        if entries[0].state == "ready":
+            self.workspace_tree.selection_set(entries[0].image_path)
+        elif len(entries) > 1:
+            self.status_callback(f"Opening {len(entries)} images...")
+
+    def list_workspace_image(self, entry):
+        """Pipeline side of load_images: touches no widgets, returns the listing."""
+        raw_path = entry.raw_path
+        # Use the selected disk format, detecting it if none is chosen
+        disk_format = entry.disk_format or "kpii"
+        matches = []
+        if not entry.disk_format:
+            matches = logic.detect_disk_format(raw_path)
+            if matches:
+                disk_format = matches[0][0]
+
+        # One directory scan gives the listing and the disk totals
+        files, info = self.load_listing(raw_path, disk_format)
+        # Quick integrity check; repairs are only made from the Check button
+        report, _ = logic.check_image(raw_path, disk_format)
+        return {"disk_format": disk_format, "matches": matches, "files": files, "info": info, "check": report}
+
+    def on_workspace_update(self, entry):
+        tree = self.workspace_tree
+        if self.workspace.images.get(entry.image_path) is not entry:
+            # Closed while its pipeline was still running
+            if entry.raw_path and not entry.busy:
+                self.jobs.submit("Release", lambda job: logic.release_raw(entry.raw_path),
+                                 key=self.disk_manager.image_key(entry.raw_path))
+            return
+        state = entry.describe()
+        if entry.state == "ready":
+            state = f"{entry.listing['disk_format']}, {len(entry.listing['files'])} files"
+        if tree.exists(entry.image_path):
+            tree.item(entry.image_path, values=(entry.name, state))
+        else:
+            tree.insert("", "end", iid=entry.image_path, values=(entry.name, state))
+        if entry.state == "failed":
+            self.status_callback(f"Open {entry.name} failed: {entry.error}")
+        if entry.state == "ready" and entry.image_path == self._activate_when_ready:
+            tree.selection_set(entry.image_path)
+            tree.see(entry.image_path)
+
+    def on_workspace_select(self):
+        selection = self.workspace_tree.selection()
+        if not selection:
+            return
+        entry = self.workspace.images.get(selection[0])
+        if entry is None or entry.state != "ready":
+            return
+        self._activate_when_ready = None
+        if entry.raw_path != getattr(self, "_current_raw_path", None):
+            self.show_image(entry)
+
+    def show_image(self, entry):
+        """Make a loaded workspace image the one the image pane works on."""
+        self.close_preview()
+        loaded = entry.listing
+        self._current_image_path = entry.image_path
+        self._current_raw_path = entry.raw_path
+        self._current_disk_format = loaded["disk_format"]
+        self.disk_manager.set_current_raw(entry.raw_path, loaded["disk_format"])
+        # ShaZam! — update title to show the loaded image
+        self.update_title(entry.image_path)
+        self.disk_format_combo.set(loaded["disk_format"])
+        message = f"Loaded disk image: {entry.image_path}"
+        if loaded["matches"]:
+            message += "   Detected format: " + ", ".join(
+                f"{name} ({score})" for name, score in loaded["matches"][:3])
+        if loaded["check"] is not None and not loaded["check"].ok:
+            message += f"   Check: {loaded['check'].summary()} (use Check to repair)"
+        self.status_callback(message)
+        if loaded.get("stale"):
+            # Changed since it was listed (insert/delete while shown earlier)
+            self.refresh_image_tree()
+        else:
+            self.populate_image_tree(loaded["files"])
+            self.disk_info_var.set(loaded["info"])
+        loaded["stale"] = True
+
+    def close_workspace_image(self):
+        selection = self.workspace_tree.selection()
+        if not selection:
+            return
+        entry = self.workspace.close(selection[0])
+        self.workspace_tree.delete(selection[0])
+        if entry is None:
+            return
+        if entry.raw_path == getattr(self, "_current_raw_path", None):
+            self.close_preview()
+            self._current_raw_path = None
+            self.disk_manager.set_current_raw(None)
+            self.image_view.clear()
+            self.disk_info_var.set("Disk Size: N/A   Free Space: N/A")
+            self.update_title()
+        if entry.raw_path and not entry.busy:
+            # Once any queued work on the image is done
+            self.jobs.submit("Release", lambda job: logic.release_raw(entry.raw_path),
+                             key=self.disk_manager.image_key(entry.raw_path))
 
     def populate_image_tree(self, files):
-        for item in self.image_tree.get_children():
-            self.image_tree.delete(item)
-        for f, size in files:
-            self.image_tree.insert("", "end", values=(f, size))
+        self.image_view.set_rows(files)
             
     def update_title(self, filename=None):
         base_title = "ViewCPM - CP/M Disk Image Manager"
@@ -434,23 +716,121 @@ class ViewCPMApp(tk.Tk):
             self.title(base_title)
 
     # ----------------------------
-    # Insert / Extract / Delete
+    # Preview
+    # ----------------------------
+    def preview_selection(self):
+        selection = self.image_tree.selection()
+        raw_path = getattr(self, "_current_raw_path", None)
+        if len(selection) != 1 or not raw_path:
+            return
+        filename = selection[0]
+        if self._preview and self._preview.filename == filename:
+            return
+        self.close_preview()
+        generation = self._preview_generation
+        disk_format = getattr(self, "_current_disk_format", None)
+
+        def open_page(job):
+            p = preview.open_preview(raw_path, disk_format, filename)
+            return p, p.next_page() if p else ""
+
+        def show(job):
+            if job.state != "done":
+                return
+            p, page = job.result
+            job.result = None
+            if generation != self._preview_generation:
+                if p:
+                    self.jobs.submit("Release", lambda job: p.close(), key=self.disk_manager.image_key(raw_path))
+                return
+            if p is None:
+                self.preview_info_var.set("Preview needs a disk format the native engine can read.")
+                return
+            self._preview = p
+            self.preview_mode_btn.configure(text="Text" if p.mode == "hex" else "Hex")
+            self.set_preview_text(page)
+
+        self.preview_info_var.set(f"Loading {filename}...")
+        self.jobs.submit("Preview", open_page, key=self.disk_manager.image_key(raw_path), on_done=show)
+
+    def close_preview(self):
+        """Drop the current preview; its image is closed behind any queued work on it."""
+        self._preview_generation += 1
+        self._preview_loading = False
+        p, self._preview = self._preview, None
+        if p:
+            self.jobs.submit("Release", lambda job: p.close(), key=self.disk_manager.image_key(p.image.raw_path))
+        self.set_preview_text("")
+        self.preview_info_var.set("Select a file in the disk image.")
+
+    def set_preview_text(self, text, append=False):
+        self.preview_text.configure(state=tk.NORMAL)
+        if not append:
+            self.preview_text.delete("1.0", tk.END)
+        self.preview_text.insert(tk.END, text)
+        self.preview_text.configure(state=tk.DISABLED)
+        if self._preview:
+            self.preview_info_var.set(self._preview.describe())
+
+    def load_preview_page(self, mode=None):
+        """Render the next page in a job; with mode, switch to it and start over."""
+        p = self._preview
+        if not p or self._preview_loading or (p.done and not mode):
+            return
+        self._preview_loading = True
+        generation = self._preview_generation
+
+        def render(job):
+            if mode:
+                p.set_mode(mode)
+            return p.next_page()
+
+        def show(job):
+            if generation != self._preview_generation:
+                return
+            self._preview_loading = False
+            if job.state == "done":
+                self.set_preview_text(job.result, append=not mode)
+            job.result = None
+
+        self.jobs.submit("Preview", render, key=self.disk_manager.image_key(p.image.raw_path), on_done=show)
+
+    def on_preview_scroll(self, scrollbar, first, last):
+        scrollbar.set(first, last)
+        # Render more of the file as the view nears the end of what is shown
+        if float(last) > 0.9:
+            self.load_preview_page()
+
+    def toggle_preview_mode(self):
+        p = self._preview
+        if not p:
+            return
+        mode = "text" if self.preview_mode_btn.cget("text") == "Text" else "hex"
+        self.preview_mode_btn.configure(text="Hex" if mode == "text" else "Text")
+        self._preview_generation += 1
+        self._preview_loading = False
+        self.load_preview_page(mode)
+
+    # ----------------------------
+    # Insert / Extract / Delete / Copy
     # ----------------------------
     def insert_file(self):
         selection = self.folder_tree.selection()
         if not selection:
             messagebox.showwarning("Insert", "No files selected in folder.")
             return
-        files = [self.folder_tree.item(i)['values'][0] for i in selection]
+        files = list(selection)  # row iids are the file names
         host_folder = prefs.get_pref("last_host_folder", "")
-        self.disk_manager.insert_files(host_folder, files, callback=self.refresh_image_tree)
+        # a failed insert may still have written some of the files
+        self.disk_manager.insert_files(host_folder, files, callback=self.refresh_image_tree,
+                                       on_error=lambda error: self.refresh_image_tree())
 
     def extract_file(self):
         selection = self.image_tree.selection()
         if not selection:
             messagebox.showwarning("Extract", "No files selected in disk image.")
             return
-        files = [self.image_tree.item(i)['values'][0] for i in selection]
+        files = list(selection)
         dest_folder = filedialog.askdirectory(title="Select Destination Folder")
         if not dest_folder:
             return
@@ -461,40 +841,141 @@ class ViewCPMApp(tk.Tk):
         if not selection:
             messagebox.showwarning("Delete", "No files selected in disk image.")
             return
-        files = [self.image_tree.item(i)['values'][0] for i in selection]
+        files = list(selection)
         if messagebox.askyesno("Delete", f"Delete {len(files)} file(s) from image?"):
-            self.disk_manager.delete_files(files, callback=self.refresh_image_tree)
+            self.disk_manager.delete_files(files, callback=self.refresh_image_tree,
+                                           on_error=lambda error: self.refresh_image_tree())
+
+    def copy_to_image(self):
+        selection = self.image_tree.selection()
+        if not selection:
+            messagebox.showwarning("Copy", "No files selected in disk image.")
+            return
+        files = list(selection)
+        current = getattr(self, "_current_raw_path", None)
+        targets = [entry for entry in self.workspace.images.values()
+                   if entry.state == "ready" and entry.raw_path != current]
+        if not targets:
+            messagebox.showwarning("Copy", "Open another disk image to copy to.")
+            return
+
+        dialog = tk.Toplevel(self)
+        dialog.title(f"Copy {len(files)} file(s) to")
+        dialog.transient(self)
+        listbox = tk.Listbox(dialog, width=60, height=min(len(targets), 12), exportselection=False)
+        for entry in targets:
+            listbox.insert(tk.END, f"{entry.name} ({entry.listing['disk_format']})")
+        listbox.selection_set(0)
+        listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=(10, 4))
+        move_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(dialog, text="Move (delete from this image afterwards)",
+                        variable=move_var).pack(anchor="w", padx=10)
+
+        def start():
+            picked = listbox.curselection()
+            if not picked:
+                return
+            target = targets[picked[0]]
+            move = move_var.get()
+            dialog.destroy()
+
+            def copied():
+                target.listing["stale"] = True   # relisted when it is shown again
+                if move:
+                    self.refresh_image_tree()
+
+            # a failed copy may still have written (or moved) some of the files
+            self.disk_manager.copy_files(files, target.raw_path, target.listing["disk_format"],
+                                         move=move, callback=copied, on_error=lambda error: copied())
+
+        buttons = ttk.Frame(dialog)
+        buttons.pack(fill=tk.X, padx=10, pady=10)
+        ttk.Button(buttons, text="Cancel", command=dialog.destroy).pack(side=tk.RIGHT, padx=2)
+        ttk.Button(buttons, text="Copy", command=start).pack(side=tk.RIGHT, padx=2)
+        listbox.bind("<Double-1>", lambda event: start())
+        dialog.grab_set()
+
+    def check_image(self):
+        if not getattr(self, "_current_raw_path", None):
+            messagebox.showwarning("Check", "No disk image loaded.")
+            return
+
+        def checked():
+            report = self.disk_manager.last_check
+            if report is None or report.ok:
+                return
+            details = "\n".join(str(p) for p in report.problems[:20])
+            if len(report.problems) > 20:
+                details += f"\n... and {len(report.problems) - 20} more"
+            if messagebox.askyesno("Check", f"{report.summary()}\n\n{details}\n\nRepair the image?"):
+                self.disk_manager.check(repair=True, callback=self.refresh_image_tree,
+                                        on_error=lambda error: self.refresh_image_tree())
+
+        self.disk_manager.last_check = None
+        self.disk_manager.check(callback=checked)
+
+    def save_image(self):
+        raw_path = getattr(self, "_current_raw_path", None)
+        if not raw_path:
+            messagebox.showwarning("Save", "No disk image loaded.")
+            return
+        if not logic.is_dirty(raw_path):
+            self.status_var.set("No changes to save.")
+            return
+        self.disk_manager.commit(self.samdisk_path)
 
     def refresh_image_tree(self):
-        if getattr(self, "_current_raw_path", None):
-            # Determine selected disk format
-            disk_format = getattr(self, "_current_disk_format", "kpii")
-            if self.disk_format_var.get() and self.diskdefs_manager:
-                disk_format = self.disk_format_var.get()
-                self._current_disk_format = disk_format
-    
-            # List files
-            files = logic.list_image_files(self.cpmtools_path, self._current_raw_path, disk_format=disk_format)
-            self.image_tree.after(0, self.populate_image_tree, files)
-            
-            disk_size = 0
-            if self.diskdefs_manager:
-                disk_info = self.diskdefs_manager.get_disk_info(disk_format)
-                if disk_info:
-                    disk_size = disk_info.get("disksize", 0)
-            
-            # Sum file sizes safely (remove commas)
-            used_size = sum(int(str(size).replace(',', '')) for _, size in files)
-            free_size = max(disk_size - used_size, 0) if disk_size else 0
-            
-            self.disk_info_var.set(
-                f"Disk Size: {disk_size:,} bytes   Free Space: {free_size:,} bytes"
-                if disk_size else "Disk Size: N/A   Free Space: N/A"
-            )
+        raw_path = getattr(self, "_current_raw_path", None)
+        if not raw_path:
+            return
+        self.close_preview()  # the previewed file may have changed
+        # Determine selected disk format
+        disk_format = getattr(self, "_current_disk_format", "kpii")
+        selected = self.disk_format_var.get()
+        if self.diskdefs_manager and selected in self.diskdefs_manager.get_disk_names():
+            disk_format = selected
+            self._current_disk_format = disk_format
+            self.disk_manager.set_current_raw(raw_path, disk_format)
+
+        def show(job):
+            if job.state == "done":
+                files, info = job.result
+                self.populate_image_tree(files)
+                self.disk_info_var.set(info)
+
+        # Queued behind any writer on the same image
+        self.jobs.submit("Refresh", lambda job: self.load_listing(raw_path, disk_format),
+                         key=self.disk_manager.image_key(raw_path), on_done=show)
+
+    def load_listing(self, raw_path, disk_format):
+        """Scan the image directory once. Returns (tree rows, disk info text)."""
+        scan = logic.scan_image(raw_path, disk_format)
+        if scan is not None:
+            files = [(logic.display_name(f), f.size) for f in scan.files]
+            info = (f"Disk Size: {scan.disk_size:,} bytes   Used: {scan.used_bytes:,} bytes   "
+                    f"Free Space: {scan.free_bytes:,} bytes   "
+                    f"Free Entries: {scan.free_entries}/{scan.dir_entries}")
+            return files, info
+
+        # cpmtools fallback
+        files = logic.list_image_files(self.cpmtools_path, raw_path, disk_format=disk_format)
+        disk_size, free_size = logic.get_disk_info(self.cpmtools_path, raw_path, disk_format=disk_format)
+        info = (f"Disk Size: {disk_size:,} bytes   Free Space: {free_size:,} bytes"
+                if disk_size else "Disk Size: N/A   Free Space: N/A")
+        return files, info
 
 # ----------------------------
 # Run App
 # ----------------------------
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # Headless batch mode: python -m viewcpm <command> <images...>
+        import viewcpm_cli
+        sys.exit(viewcpm_cli.main(sys.argv[1:]))
     app = ViewCPMApp()
     app.mainloop()
+    if app.folder_watcher:
+        app.folder_watcher.stop()
+    app.workspace.shutdown()
+    app.jobs.shutdown()
+    prefs.flush()
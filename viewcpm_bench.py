@@ -0,0 +1,314 @@
+# viewcpm_bench.py
+"""Benchmarks for the image open, listing and transfer paths."""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import viewcpm_cpmfs as cpmfs
+import viewcpm_detect as detect
+import viewcpm_imd as imd
+import viewcpm_logic as logic
+import viewcpm_prefs as prefs
+from viewcpm_diskdefs import get_manager
+from viewcpm_diskops import DiskImageManager
+
+REPORT_VERSION = 1
+DEFAULT_FORMATS = ("ibm-3740", "pcw", "4mb-hd", "sdcard", "pc1.2m")
+BUNDLED_DISKDEFS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "support", "cpmtools", "diskdefs")
+PERCENTILES = (50, 90, 99)
+
+# name -> (min, max) file size in bytes, drawn log-uniformly
+SIZE_PROFILES = {
+    "small": (128, 4 * 1024),
+    "mixed": (128, 64 * 1024),
+    "large": (16 * 1024, 256 * 1024),
+}
+FILL_RATIO = 0.8   # use at most this share of free blocks and directory entries
+
+# ----------------------------
+# Synthetic data
+# ----------------------------
+def generate_files(folder, geom, count, profile, seed):
+    """
+    Write up to count host files sized by profile, as many as fit in
+    FILL_RATIO of the disk. Returns [(path, size), ...].
+    """
+    rng = random.Random(seed)
+    low, high = SIZE_PROFILES[profile]
+    block_budget = int((geom.total_blocks - geom.dir_blocks) * FILL_RATIO)
+    entry_budget = int(geom.maxdir * FILL_RATIO)
+    entry_bytes = geom.ptrs_per_entry * geom.blocksize
+    files = []
+    for i in range(count):
+        size = int(low * (high / low) ** rng.random())
+        blocks = -(-size // geom.blocksize)
+        entries = max(1, -(-size // entry_bytes))
+        if blocks > block_budget or entries > entry_budget:
+            break
+        block_budget -= blocks
+        entry_budget -= entries
+        path = os.path.join(folder, f"F{i:05d}.DAT")
+        with open(path, "wb") as f:
+            f.write(rng.randbytes(size))
+        files.append((path, size))
+    return files
+
+
+def blank_image(path, diskdef):
+    geom = cpmfs.Geometry(diskdef)
+    with open(path, "wb") as f:
+        f.write(bytes([cpmfs.DELETED]) * geom.sector_offset(geom.tracks, 0))
+
+
+def raw_to_imd(raw_path, diskdef, imd_path):
+    """
+    Wrap a RAW image in an IMD container (two heads per cylinder) so the
+    convert path can be timed. Returns False if the geometry cannot be
+    expressed in IMD.
+    """
+    geom = cpmfs.Geometry(diskdef)
+    if geom.tracks > 512 or geom.sectrk > 255 or geom.seclen not in imd.SECTOR_SIZES or geom.offset:
+        return False
+    with open(raw_path, "rb") as f:
+        raw = f.read()
+    tracks = []
+    track_size = geom.sectrk * geom.seclen
+    for t in range(geom.tracks):
+        track = imd.ImdTrack(5, t // 2, t % 2, geom.seclen, list(range(1, geom.sectrk + 1)))
+        data = raw[t * track_size:(t + 1) * track_size]
+        for s in range(geom.sectrk):
+            track.sector_types.append(1)
+            track.sectors.append(data[s * geom.seclen:(s + 1) * geom.seclen])
+        tracks.append(track)
+    imd.write_imd(imd.ImdImage("", b"viewcpm benchmark", tracks), imd_path)
+    return True
+
+
+# ----------------------------
+# Timing
+# ----------------------------
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples):
+    values = sorted(samples)
+    stats = {
+        "runs": len(values),
+        "min": values[0],
+        "mean": sum(values) / len(values),
+        "max": values[-1],
+    }
+    for pct in PERCENTILES:
+        stats[f"p{pct}"] = percentile(values, pct)
+    return {key: round(value, 6) if isinstance(value, float) else value for key, value in stats.items()}
+
+
+def measure(fn, setup=None, warmup=1, runs=5):
+    """Time fn() runs times after warmup runs. setup() runs untimed before each call."""
+    samples = []
+    for i in range(warmup + runs):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            samples.append(elapsed)
+    return summarize(samples)
+
+
+def wait_for(scheduler, job):
+    """Run a DiskImageManager job to completion, draining its events."""
+    while job.state not in ("done", "failed", "cancelled"):
+        scheduler.drain(lambda kind, job, message: None)
+        time.sleep(0.0005)
+    if job.state != "done":
+        raise RuntimeError(f"{job.label} {job.state}: {job.error}")
+
+
+# ----------------------------
+# Benchmarks
+# ----------------------------
+def bench_format(name, diskdef, diskdefs_path, work, count, profile, seed, warmup, runs):
+    geom = cpmfs.Geometry(diskdef)
+    host = os.path.join(work, "host")
+    out = os.path.join(work, "out")
+    os.makedirs(host)
+    os.makedirs(out)
+    files = generate_files(host, geom, count, profile, seed)
+    paths = [path for path, _ in files]
+    names = [os.path.basename(path).lower() for path in paths]
+    kwargs = {"disk_format": name, "diskdefs_path": diskdefs_path}
+
+    empty = os.path.join(work, "empty.img")
+    full = os.path.join(work, "full.img")
+    scratch = os.path.join(work, "scratch.img")
+    blank_image(empty, diskdef)
+    shutil.copyfile(empty, full)
+    logic.insert_files("", full, paths, **kwargs)
+    logic.release_raw(full)
+    if logic.scan_image(full, name, diskdefs_path) is None:
+        raise RuntimeError(f"Native engine cannot open {name}.")
+
+    manager = get_manager(diskdefs_path)
+    ops = {}
+
+    def fresh(source):
+        def setup():
+            logic.release_raw(scratch)
+            shutil.copyfile(source, scratch)
+        return setup
+
+    imd_path = os.path.join(work, "full.imd")
+    if raw_to_imd(full, diskdef, imd_path):
+        def convert():
+            logic.release_raw(logic.convert_dsk_to_raw(None, imd_path))
+        ops["convert"] = measure(convert, warmup=warmup, runs=runs)
+
+    ops["open"] = measure(lambda: (detect.detect_formats(full, manager, limit=5),
+                                   logic.scan_image(full, name, diskdefs_path)),
+                          warmup=warmup, runs=runs)
+    ops["list"] = measure(lambda: logic.list_image_files("", full, **kwargs), warmup=warmup, runs=runs)
+    ops["extract_all"] = measure(lambda: logic.extract_files("", full, names, out, **kwargs),
+                                 warmup=warmup, runs=runs)
+    ops["insert_all"] = measure(lambda: logic.insert_files("", scratch, paths, **kwargs),
+                                setup=fresh(empty), warmup=warmup, runs=runs)
+    ops["delete_all"] = measure(lambda: logic.delete_files("", scratch, names, **kwargs),
+                                setup=fresh(full), warmup=warmup, runs=runs)
+
+    disk = DiskImageManager("", diskdefs_path=diskdefs_path)
+    def manager_insert():
+        disk.set_current_raw(scratch, name)
+        wait_for(disk.scheduler, disk.insert_files(host, [os.path.basename(p) for p in paths]))
+    try:
+        ops["manager_insert_all"] = measure(manager_insert, setup=fresh(empty), warmup=warmup, runs=runs)
+    finally:
+        disk.scheduler.shutdown(wait=True)
+    logic.release_raw(scratch)
+
+    return {
+        "files": len(files),
+        "bytes": sum(size for _, size in files),
+        "image_bytes": os.path.getsize(full),
+        "ops": ops,
+    }
+
+
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(formats, diskdefs_path, count, profile, seed, warmup, runs, log=print):
+    manager = get_manager(diskdefs_path)
+    if manager is None:
+        raise FileNotFoundError(f"diskdefs not found: {diskdefs_path}")
+    report = {
+        "version": REPORT_VERSION,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"formats": list(formats), "files": count, "profile": profile, "seed": seed,
+                   "warmup": warmup, "runs": runs},
+        "results": {},
+    }
+    for name in formats:
+        diskdef = manager.get_diskdef(name)
+        if diskdef is None:
+            log(f"{name}: not in diskdefs, skipped")
+            continue
+        work = tempfile.mkdtemp(prefix=f"viewcpm-bench-{name}-")
+        try:
+            result = bench_format(name, diskdef, diskdefs_path, work, count, profile, seed, warmup, runs)
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+        report["results"][name] = result
+        log(f"{name}: {result['files']} files, {result['bytes']:,} bytes  " +
+            "  ".join(f"{op} {stats['p50'] * 1000:.2f}ms" for op, stats in result["ops"].items()))
+    return report
+
+
+def compare(report, baseline, threshold, log=None):
+    """Log p50 ratios against baseline; returns the list of regressions."""
+    regressions = []
+    for name, result in report["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            continue
+        for op, stats in result["ops"].items():
+            before = old["ops"].get(op)
+            if not before or not before["p50"]:
+                continue
+            ratio = stats["p50"] / before["p50"]
+            flag = ""
+            if ratio > threshold:
+                flag = "  REGRESSION"
+                regressions.append((name, op, ratio))
+            if log:
+                log(f"{name:10} {op:20} {before['p50'] * 1000:9.2f}ms -> {stats['p50'] * 1000:9.2f}ms  x{ratio:.2f}{flag}")
+    return regressions
+
+
+# ----------------------------
+# Command line
+# ----------------------------
+def default_diskdefs():
+    """The diskdefs from prefs if it exists, else the copy bundled with cpmtools."""
+    path = prefs.get_pref("diskdefs_path", "")
+    return path if path and os.path.isfile(path) else BUNDLED_DISKDEFS
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python viewcpm_bench.py",
+                                     description="Benchmark image open, listing and transfer paths.")
+    parser.add_argument("-f", "--format", action="append", help="diskdef to benchmark (repeatable)")
+    parser.add_argument("-n", "--files", type=int, default=100, help="files per image (capped to fit)")
+    parser.add_argument("-p", "--profile", choices=sorted(SIZE_PROFILES), default="mixed", help="file size distribution")
+    parser.add_argument("-r", "--runs", type=int, default=5, help="timed runs per operation")
+    parser.add_argument("-w", "--warmup", type=int, default=1, help="untimed warmup runs per operation")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for file sizes and contents")
+    parser.add_argument("--diskdefs", default=default_diskdefs(), help="diskdefs file")
+    parser.add_argument("-o", "--output", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", help="baseline JSON report to compare p50 times against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="p50 ratio above which --compare reports a regression")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.runs < 1:
+        print("--runs must be at least 1", file=sys.stderr)
+        return 2
+    log = lambda text: print(text, file=sys.stderr)
+    report = run(args.format or DEFAULT_FORMATS, args.diskdefs, args.files, args.profile, args.seed,
+                 args.warmup, args.runs, log=log)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold, log=log):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+# viewcpm_cli.py
+import argparse
+import fnmatch
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+import viewcpm_logic as logic
+import viewcpm_metrics as metrics
+import viewcpm_prefs as prefs
+from viewcpm_store import ContentStore, LINK_MODES
+
+COMMANDS = ("ls", "extract", "insert", "rm", "info", "check")
+RAW_EXTENSIONS = (".img", ".raw")
+
+# ----------------------------
+# Per-image worker
+# ----------------------------
+def open_raw(image_path, options, tmp_dir):
+    """Return a RAW path for image_path, converting with SAMdisk if needed."""
+    if os.path.splitext(image_path)[1].lower() in RAW_EXTENSIONS:
+        return image_path
+    sides = logic.diskdef_sides(options["format"], options["diskdefs_path"])
+    return logic.convert_dsk_to_raw(options["samdisk_path"], image_path, tmp_dir=tmp_dir, sides=sides)
+
+
+def name_matches(name, pattern):
+    """
+    Whether a listed name ("pip.com", "3:pip.com") matches a glob. A plain
+    glob matches the 8.3 name in any user area; "N:glob" only in user N.
+    """
+    user, _, bare = logic.cpm_path(name).partition(":")
+    pattern = pattern.lower()
+    if ":" in pattern:
+        want, pattern = pattern.split(":", 1)
+        if not want.isdigit() or int(want) != int(user):
+            return False
+    return fnmatch.fnmatchcase(bare.lower(), pattern)
+
+
+def matching_files(files, patterns):
+    """Names from a listing that match any of the glob patterns (all if none)."""
+    if not patterns:
+        return [name for name, _ in files]
+    return [name for name, _ in files if any(name_matches(name, p) for p in patterns)]
+
+
+def process_image(job):
+    """
+    Run one command against one image. Runs in a worker process, so it only
+    takes and returns plain data. Returns an NDJSON-ready dict.
+    """
+    command, image_path, options, folder = job
+    result = {"image": image_path, "command": command, "ok": False, "bytes": 0}
+    start = time.perf_counter()
+    tmp_dir = tempfile.mkdtemp(prefix="viewcpm-")
+    raw_path = None
+    stages = {}
+
+    def collect(progress):
+        # Per-stage timings of every finished operation on this image
+        if progress.finished:
+            for name, (seconds, nbytes) in progress.stages.items():
+                total = stages.setdefault(name, {"seconds": 0.0, "bytes": 0})
+                total["seconds"] = round(total["seconds"] + seconds, 6)
+                total["bytes"] += nbytes
+
+    metrics.add_listener(collect)
+    try:
+        raw_path = open_raw(image_path, options, tmp_dir)
+        cpmtools_path = options["cpmtools_path"]
+        diskdefs_path = options["diskdefs_path"]
+
+        disk_format = options["format"]
+        if not disk_format:
+            matches = logic.detect_disk_format(raw_path, limit=1, diskdefs_path=diskdefs_path)
+            if not matches:
+                raise RuntimeError("Could not detect disk format.")
+            disk_format = matches[0][0]
+        result["format"] = disk_format
+        kwargs = {"disk_format": disk_format, "diskdefs_path": diskdefs_path}
+
+        if command in ("ls", "info", "extract", "rm"):
+            files = logic.list_image_files(cpmtools_path, raw_path, **kwargs)
+
+        if command == "ls":
+            result["files"] = [{"name": name, "size": int(size.replace(",", ""))} for name, size in files]
+            result["bytes"] = logic.raw_size(raw_path)
+        elif command == "info":
+            disk_size, free_size = logic.get_disk_info(cpmtools_path, raw_path, **kwargs)
+            result.update(disk_size=disk_size, free=free_size, file_count=len(files))
+            result["bytes"] = logic.raw_size(raw_path)
+        elif command == "extract":
+            dest = os.path.join(options["dest"], folder)
+            os.makedirs(dest, exist_ok=True)
+            names = matching_files(files, options["files"])
+            store = ContentStore(options["store"], options["link"]) if options["store"] else None
+            logic.extract_files(cpmtools_path, raw_path, names, dest, store=store, **kwargs)
+            if store is not None:
+                result["store"] = dict(store.stats)
+            for name in names:
+                result["bytes"] += os.path.getsize(os.path.join(dest, logic.host_name(name)))
+            result.update(dest=dest, files=names)
+        elif command == "insert":
+            logic.insert_files(cpmtools_path, raw_path, options["files"], **kwargs)
+            result["bytes"] = sum(os.path.getsize(f) for f in options["files"])
+            result["files"] = [os.path.basename(f) for f in options["files"]]
+        elif command == "rm":
+            names = matching_files(files, options["files"])
+            logic.delete_files(cpmtools_path, raw_path, names, **kwargs)
+            result["files"] = names
+        elif command == "check":
+            report, repaired = logic.check_image(raw_path, disk_format, diskdefs_path, repair=options["repair"])
+            if report is None:
+                raise RuntimeError("The native engine cannot read this image.")
+            checked = report.as_dict()
+            result.update(file_count=report.files, repaired=repaired, problems=checked["problems"],
+                          counts=checked["counts"], lost_blocks=checked["lost_blocks"])
+            result["bytes"] = logic.raw_size(raw_path)
+        if (command in ("insert", "rm") or result.get("repaired")) and raw_path != image_path:
+            # Working copy was converted from a container: write it back
+            result["saved_sectors"] = logic.commit_image(options["samdisk_path"], raw_path, image_path)
+        if command == "check" and not report.ok:
+            raise RuntimeError(report.summary())
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        metrics.remove_listener(collect)
+        if raw_path:
+            logic.release_raw(raw_path)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    result["stages"] = stages
+    result["seconds"] = round(time.perf_counter() - start, 6)
+    return result
+
+
+# ----------------------------
+# Command line
+# ----------------------------
+def glob_root(pattern):
+    """Folder a glob starts from: its leading components without wildcards."""
+    parts = os.path.normpath(pattern).split(os.sep)
+    fixed = 0
+    while fixed < len(parts) - 1 and not glob.has_magic(parts[fixed]):
+        fixed += 1
+    return os.sep.join(parts[:fixed]) or ("." if parts[0] else os.sep)
+
+
+def expand_images(patterns):
+    """
+    Expand image globs (recursive ** allowed), keeping order, without
+    duplicates. Returns [(path, path relative to its glob's root)].
+    """
+    seen = set()
+    images = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) or ([pattern] if os.path.isfile(pattern) else [])
+        root = glob_root(pattern)
+        for path in matches:
+            if os.path.isfile(path) and path not in seen:
+                seen.add(path)
+                images.append((path, os.path.relpath(path, root)))
+    return images
+
+
+def output_folders(images):
+    """
+    Extract folder of every image: its path below the glob root, extension
+    kept, so a.img and a.dsk (or two DISK1.DSK in different folders) never
+    share one. Raises RuntimeError if two images still map to one folder.
+    """
+    folders = {}
+    for path, relative in images:
+        key = os.path.normcase(relative)
+        if key in folders:
+            raise RuntimeError(f"{folders[key]} and {path} would both extract to {relative}; "
+                               "extract them separately or with different --dest folders.")
+        folders[key] = path
+    return [relative for _, relative in images]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m viewcpm",
+        description="Headless batch operations on CP/M disk images. Writes one JSON line per image.",
+    )
+    parser.add_argument("command", choices=COMMANDS)
+    parser.add_argument("images", nargs="+", help="image files or globs (*.dsk, **/*.imd, ...)")
+    parser.add_argument("-f", "--format", help="diskdef name (default: detect per image)")
+    parser.add_argument("-F", "--files", action="append", default=[],
+                        help="for extract/rm: CP/M name pattern, any user or N:pattern for user N; "
+                             "for insert: host file (repeatable)")
+    parser.add_argument("-d", "--dest", default=".", help="extract destination (one subfolder per image, named after its path)")
+    parser.add_argument("--store", default=prefs.get_pref("extract_store", ""),
+                        help="for extract: content-addressed store; extracted files are links into it")
+    parser.add_argument("--link", choices=LINK_MODES, default=prefs.get_pref("extract_link", "auto"),
+                        help="for extract: how files are linked from the store")
+    parser.add_argument("--repair", action="store_true", help="for check: fix the problems found")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--diskdefs", default=prefs.get_pref("diskdefs_path", ""), help="diskdefs file")
+    parser.add_argument("--cpmtools", default=prefs.get_pref("cpmtools_path", ""), help="cpmtools directory")
+    parser.add_argument("--samdisk", default=prefs.get_pref("samdisk_path", ""), help="SAMdisk executable")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "insert" and not args.files:
+        print("insert needs at least one --files host file", file=sys.stderr)
+        return 2
+    images = expand_images(args.images)
+    if not images:
+        print("No images matched.", file=sys.stderr)
+        return 2
+
+    options = {
+        "format": args.format,
+        "files": [os.path.abspath(f) for f in args.files] if args.command == "insert" else args.files,
+        "dest": os.path.abspath(args.dest),
+        "repair": args.repair,
+        "store": os.path.abspath(args.store) if args.store else "",
+        "link": args.link,
+        "diskdefs_path": args.diskdefs,
+        "cpmtools_path": args.cpmtools,
+        "samdisk_path": args.samdisk,
+    }
+    try:
+        folders = output_folders(images) if args.command == "extract" else [None] * len(images)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 2
+    jobs = [(args.command, path, options, folder) for (path, _), folder in zip(images, folders)]
+    workers = max(1, min(args.jobs, len(jobs)))
+
+    start = time.perf_counter()
+    ok = failed = total_bytes = 0
+
+    def emit(result):
+        nonlocal ok, failed, total_bytes
+        sys.stdout.write(json.dumps(result) + "\n")
+        sys.stdout.flush()
+        total_bytes += result["bytes"]
+        if result["ok"]:
+            ok += 1
+        else:
+            failed += 1
+
+    try:
+        if workers == 1:
+            for job in jobs:
+                emit(process_image(job))
+        else:
+            with Pool(workers) as pool:
+                for result in pool.imap_unordered(process_image, jobs, chunksize=4):
+                    emit(result)
+    except BrokenPipeError:
+        # Reader went away (e.g. piped into head); stop quietly
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return 1
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "summary": True,
+        "images": len(jobs),
+        "ok": ok,
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "images_per_sec": round(len(jobs) / elapsed, 2) if elapsed else None,
+        "bytes": total_bytes,
+        "bytes_per_sec": round(total_bytes / elapsed) if elapsed else None,
+    }
+    print(json.dumps(summary), file=sys.stderr)
+    return 1 if failed else 0
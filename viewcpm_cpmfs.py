@@ -0,0 +1,844 @@
+# viewcpm_cpmfs.py
+import mmap
+from contextlib import contextmanager
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+RECORD_SIZE = 128
+DIRENT_SIZE = 32
+EXTENT_SIZE = 16384
+DELETED = 0xE5
+MAX_USER = 15
+INVALID_NAME_CHARS = set('<>.,;:=?*[]|/\\"')
+READER_CACHE_BLOCKS = 16   # blocks kept by each FileReader
+
+class CpmFsError(Exception):
+    """Raised when a RAW image cannot be handled by the native engine."""
+
+
+# ----------------------------
+# Geometry
+# ----------------------------
+def build_skewtab(sectrk, skew):
+    """Physical sector order for a logical sector index (cpmtools algorithm)."""
+    if skew in (0, 1):
+        return list(range(sectrk))
+    table = []
+    used = set()
+    j = 0
+    for i in range(sectrk):
+        while j in used:
+            j = (j + 1) % sectrk
+        table.append(j)
+        used.add(j)
+        j = (j + skew) % sectrk
+    return table
+
+
+class Geometry:
+    """Derived CP/M parameters for one DiskDef."""
+
+    def __init__(self, diskdef):
+        self.diskdef = diskdef
+        self.seclen = diskdef.seclen
+        self.sectrk = diskdef.sectrk
+        self.tracks = diskdef.tracks
+        self.blocksize = diskdef.blocksize
+        self.maxdir = diskdef.maxdir
+        self.boottrk = diskdef.boottrk
+        self.offset = diskdef.offset
+        self.os = str(diskdef.os).lower()
+        if diskdef.skewtab:
+            self.skewtab = list(diskdef.skewtab)
+        else:
+            self.skewtab = build_skewtab(self.sectrk, diskdef.skew)
+        if len(self.skewtab) != self.sectrk or self.blocksize % self.seclen:
+            raise CpmFsError(f"Inconsistent geometry in diskdef {diskdef.name}")
+
+        self.sectors_per_block = self.blocksize // self.seclen
+        data_bytes = (self.tracks - self.boottrk) * self.sectrk * self.seclen
+        self.total_blocks = data_bytes // self.blocksize
+        self.big_disk = self.total_blocks > 255
+        self.ptrs_per_entry = 8 if self.big_disk else 16
+        self.extents_per_entry = max(1, self.ptrs_per_entry * self.blocksize // EXTENT_SIZE)
+        self.exm = self.extents_per_entry - 1
+        self.dir_blocks = diskdef.dirblks or -(-self.maxdir * DIRENT_SIZE // self.blocksize)
+        if self.dir_blocks >= self.total_blocks:
+            raise CpmFsError(f"Directory does not fit on disk for diskdef {diskdef.name}")
+
+    def sector_offset(self, track, sector):
+        """Byte offset of a physical (track, sector) in the image file."""
+        return (track * self.sectrk + sector) * self.seclen + self.offset
+
+    def block_sectors(self, block):
+        """Byte offsets of every sector in a data block, in order."""
+        spb = self.sectors_per_block
+        return self.sector_map[block * spb:(block + 1) * spb]
+
+    @property
+    def sector_map(self):
+        return _sector_map(self)[0]
+
+    @property
+    def block_starts(self):
+        """Per-block start offset when the block is contiguous in the image, else -1."""
+        return _sector_map(self)[1]
+
+    def map_key(self):
+        return (self.seclen, self.sectrk, self.tracks, self.blocksize,
+                self.boottrk, self.offset, tuple(self.skewtab))
+
+
+# Precomputed logical-sector -> byte-offset tables, shared by every image
+# opened with the same geometry.
+_sector_maps = {}
+
+def _sector_map(geom):
+    key = geom.map_key()
+    cached = _sector_maps.get(key)
+    if cached is not None:
+        return cached
+
+    seclen = geom.seclen
+    track_bytes = geom.sectrk * seclen
+    skew_offsets = [s * seclen for s in geom.skewtab]
+    nsectors = geom.total_blocks * geom.sectors_per_block
+    first = geom.sectrk * geom.boottrk
+    offsets = array("q")
+    track, sect = divmod(first, geom.sectrk)
+    while len(offsets) < nsectors:
+        base = track * track_bytes + geom.offset
+        offsets.extend(base + skew_offsets[i] for i in range(sect, geom.sectrk))
+        track += 1
+        sect = 0
+    del offsets[nsectors:]
+
+    spb = geom.sectors_per_block
+    starts = array("q", [-1]) * geom.total_blocks
+    for block in range(geom.total_blocks):
+        base = block * spb
+        first_sec = offsets[base]
+        if all(offsets[base + i] == first_sec + i * seclen for i in range(1, spb)):
+            starts[block] = first_sec
+    _sector_maps[key] = (offsets, starts)
+    return offsets, starts
+
+
+# ----------------------------
+# Directory entries
+# ----------------------------
+class CpmFile:
+    """One file on the image, merged from all of its directory extents."""
+
+    def __init__(self, user, name, ext):
+        self.user = user
+        self.name = name
+        self.ext = ext
+        self.records = 0
+        self.last_bytes = 0
+        self.blocks = []
+        self.entries = []
+        self.read_only = False
+        self.system = False
+        self.archived = False
+
+    @property
+    def filename(self):
+        return f"{self.name}.{self.ext}" if self.ext else self.name
+
+    @property
+    def size(self):
+        size = self.records * RECORD_SIZE
+        if self.last_bytes and size:
+            size -= RECORD_SIZE - self.last_bytes
+        return size
+
+    @property
+    def attributes(self):
+        """cpmls-style attribute string: R/O, SYS, archived."""
+        return ("r" if self.read_only else "-") + ("s" if self.system else "-") + ("a" if self.archived else "-")
+
+    def as_dict(self, blocksize):
+        return {
+            "user": self.user,
+            "name": self.name,
+            "ext": self.ext,
+            "filename": self.filename,
+            "attributes": self.attributes,
+            "records": self.records,
+            "blocks": len(self.blocks),
+            "size": self.size,
+            "allocated": len(self.blocks) * blocksize,
+            "extents": len(self.entries),
+        }
+
+
+class DirectoryScan:
+    """Everything one directory pass yields: files plus allocation totals."""
+
+    def __init__(self, files, allocation, geom, free_entries):
+        self.files = files
+        self.allocation = allocation   # one byte per block, 1 = in use
+        self.blocksize = geom.blocksize
+        self.total_blocks = geom.total_blocks
+        self.dir_blocks = geom.dir_blocks
+        self.dir_entries = geom.maxdir
+        self.free_entries = free_entries
+        self.free_blocks = allocation.count(0)
+
+    @property
+    def disk_size(self):
+        return self.total_blocks * self.blocksize
+
+    @property
+    def free_bytes(self):
+        return self.free_blocks * self.blocksize
+
+    @property
+    def used_bytes(self):
+        """Allocated data, including directory blocks and block rounding."""
+        return self.disk_size - self.free_bytes
+
+    def entries(self):
+        return [f.as_dict(self.blocksize) for f in self.files]
+
+
+def split_filename(filename):
+    """
+    Turn "[user:]name.ext" into (user|None, NAME, EXT).
+    Raises CpmFsError for names that are not valid CP/M 8.3 names.
+    """
+    user = None
+    if ":" in filename:
+        prefix, filename = filename.split(":", 1)
+        if not prefix.isdigit() or int(prefix) > MAX_USER:
+            raise CpmFsError(f"Invalid user number: {prefix}")
+        user = int(prefix)
+    name, _, ext = filename.upper().partition(".")
+    if not name or len(name) > 8 or len(ext) > 3:
+        raise CpmFsError(f"Not a valid CP/M filename: {filename}")
+    for ch in name + ext:
+        if ch in INVALID_NAME_CHARS or ord(ch) <= 32 or ord(ch) > 126:
+            raise CpmFsError(f"Not a valid CP/M filename: {filename}")
+    return user, name, ext
+
+
+# ----------------------------
+# Dirty sector tracking
+# ----------------------------
+class DirtySectors:
+    """
+    One flag per physical sector of the image geometry, set when the
+    sector is written. Used to write back only what changed.
+    """
+
+    def __init__(self, seclen, sectrk, tracks, offset=0):
+        self.seclen = seclen
+        self.sectrk = sectrk
+        self.offset = offset
+        self.flags = bytearray(tracks * sectrk)
+
+    @classmethod
+    def whole_file(cls, size):
+        """Everything dirty, for changes made outside the engine (cpmtools)."""
+        dirty = cls(max(size, 1), 1, 1)
+        dirty.flags[0] = 1
+        return dirty
+
+    def mark(self, pos, length):
+        first = (pos - self.offset) // self.seclen
+        last = (pos + length - 1 - self.offset) // self.seclen
+        for i in range(max(first, 0), min(last + 1, len(self.flags))):
+            self.flags[i] = 1
+
+    def merge(self, other):
+        for i in range(min(len(self.flags), len(other.flags))):
+            if other.flags[i]:
+                self.flags[i] = 1
+
+    def count(self):
+        return self.flags.count(1)
+
+    def clear(self):
+        self.flags = bytearray(len(self.flags))
+
+    def tracks(self):
+        """Sorted physical track numbers that contain a dirty sector."""
+        return sorted({i // self.sectrk for i, flag in enumerate(self.flags) if flag})
+
+    def sectors(self):
+        """Yield (track, sector) of every dirty sector."""
+        for i, flag in enumerate(self.flags):
+            if flag:
+                yield divmod(i, self.sectrk)
+
+    def byte_ranges(self):
+        """Yield (offset, length) runs of dirty bytes in the RAW file."""
+        i = 0
+        n = len(self.flags)
+        while i < n:
+            if not self.flags[i]:
+                i += 1
+                continue
+            start = i
+            while i < n and self.flags[i]:
+                i += 1
+            yield self.offset + start * self.seclen, (i - start) * self.seclen
+
+
+# ----------------------------
+# Lazily decoded RAW buffers
+# ----------------------------
+class LazyBuffer(bytearray):
+    """
+    RAW buffer whose spans (e.g. container tracks) are only decoded when
+    first touched. spans is [(raw_offset, length), ...]; loader(i) returns
+    the RAW bytes of span i.
+    """
+
+    def __init__(self, size, spans, loader):
+        super().__init__(size)
+        self.spans = spans
+        self.starts = [start for start, _ in spans]
+        self.loader = loader
+        self.loaded = bytearray(len(spans))
+
+    def ensure(self, pos, length):
+        """Decode every span overlapping [pos, pos + length)."""
+        end = pos + length
+        i = max(bisect_right(self.starts, pos) - 1, 0)
+        while i < len(self.spans) and self.spans[i][0] < end:
+            start, size = self.spans[i]
+            if not self.loaded[i] and start + size > pos:
+                self[start:start + size] = self.loader(i)
+                self.loaded[i] = 1
+            i += 1
+
+    def ensure_all(self):
+        self.ensure(0, len(self))
+
+
+# ----------------------------
+# Image
+# ----------------------------
+class CpmImage:
+    """
+    In-process CP/M 2.2/3 filesystem on a RAW image.
+    Directory and allocation map are loaded once on open.
+    """
+
+    def __init__(self, raw_path, diskdef, writable=False, buffer=None):
+        """
+        buffer: optional in-memory RAW (bytearray) to use instead of
+        mapping raw_path, e.g. an image decoded by a native container reader.
+        """
+        self.raw_path = raw_path
+        self.geom = Geometry(diskdef)
+        self.writable = writable
+        self._fh = None
+        self._mm = None
+        self._ensure = None
+        self._staged = None       # {block: data} while a transaction is open
+        self.dirty = DirtySectors(self.geom.seclen, self.geom.sectrk, self.geom.tracks, self.geom.offset)
+        if buffer is not None:
+            self._use_buffer(buffer)
+        else:
+            self._fh = open(raw_path, "r+b" if writable else "rb")
+            self._map_image()
+        self._load_directory()
+
+    def _use_buffer(self, buffer):
+        geom = self.geom
+        if self.writable:
+            needed = geom.sector_offset(geom.tracks, 0)
+            if len(buffer) < needed:
+                buffer.extend(bytes([DELETED]) * (needed - len(buffer)))
+        self._mm = buffer
+        self._size = len(buffer)
+        self._ensure = getattr(buffer, "ensure", None)
+
+    def _map_image(self):
+        """Map the image, padding short images with 0xE5 when opened writable."""
+        geom = self.geom
+        size = self._fh.seek(0, 2)
+        if self.writable:
+            needed = geom.sector_offset(geom.tracks, 0)
+            if size < needed:
+                self._fh.write(bytes([DELETED]) * (needed - size))
+                self._fh.flush()
+                size = needed
+        if size:
+            access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+            self._mm = mmap.mmap(self._fh.fileno(), 0, access=access)
+        self._size = size
+
+    def close(self):
+        if self._fh:
+            if self._mm is not None:
+                if self.writable:
+                    self._mm.flush()
+                self._mm.close()
+            self._fh.close()
+            self._fh = None
+        self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- Raw block I/O ---
+    def _read_at(self, pos, length):
+        if self._ensure:
+            self._ensure(pos, length)
+        if pos + length <= self._size:
+            return self._mm[pos:pos + length]
+        data = self._mm[pos:self._size] if self._mm is not None and pos < self._size else b""
+        return data + bytes([DELETED]) * (length - len(data))
+
+    def block_view(self, block):
+        """
+        Zero-copy memoryview of a contiguous block, or bytes when the block
+        is interleaved or runs past the end of the image. Release views
+        before closing the image.
+        """
+        if self._staged and block in self._staged:
+            return self._staged[block]
+        geom = self.geom
+        start = geom.block_starts[block]
+        if start >= 0 and start + geom.blocksize <= self._size:
+            if self._ensure:
+                self._ensure(start, geom.blocksize)
+            return memoryview(self._mm)[start:start + geom.blocksize]
+        return self.read_block(block)
+
+    def read_block(self, block):
+        if self._staged and block in self._staged:
+            return self._staged[block]
+        geom = self.geom
+        start = geom.block_starts[block]
+        if start >= 0:
+            return self._read_at(start, geom.blocksize)
+        return b"".join(self._read_at(pos, geom.seclen) for pos in geom.block_sectors(block))
+
+    def write_block(self, block, data):
+        if not self.writable:
+            raise CpmFsError("Image opened read-only.")
+        geom = self.geom
+        data = bytes(data).ljust(geom.blocksize, b"\x1a")
+        if self._staged is not None:
+            self._staged[block] = data
+            return
+        start = geom.block_starts[block]
+        if start >= 0:
+            if self._ensure:
+                self._ensure(start, geom.blocksize)
+            self._mm[start:start + geom.blocksize] = data
+            self.dirty.mark(start, geom.blocksize)
+            return
+        for i, pos in enumerate(geom.block_sectors(block)):
+            if self._ensure:
+                self._ensure(pos, geom.seclen)
+            self._mm[pos:pos + geom.seclen] = data[i * geom.seclen:(i + 1) * geom.seclen]
+            self.dirty.mark(pos, geom.seclen)
+
+    # --- Directory ---
+    def _load_directory(self):
+        geom = self.geom
+        raw = b"".join(self.read_block(b) for b in range(geom.dir_blocks))
+        self._dir = bytearray(raw[:geom.maxdir * DIRENT_SIZE])
+        self._dirty_dir = False
+        self._scan_directory()
+
+    def _entry_blocks(self, entry):
+        ptrs = entry[16:32]
+        if self.geom.big_disk:
+            blocks = [ptrs[i] | (ptrs[i + 1] << 8) for i in range(0, 16, 2)]
+        else:
+            blocks = list(ptrs)
+        return [b for b in blocks if b]
+
+    def _scan_directory(self):
+        geom = self.geom
+        self.files = {}
+        self.used = bytearray(geom.total_blocks)
+        self._crosslinked = False
+        for b in range(geom.dir_blocks):
+            self.used[b] = 1
+        self._scan_entries(range(geom.maxdir))
+
+    def _scan_entries(self, indices):
+        """Merge the given directory entries into files and the allocation map."""
+        geom = self.geom
+        extents = {}
+        for idx in indices:
+            entry = self._dir[idx * DIRENT_SIZE:(idx + 1) * DIRENT_SIZE]
+            user = entry[0]
+            if user > MAX_USER:
+                continue
+            name = bytes(c & 0x7F for c in entry[1:9]).decode("ascii", "replace").rstrip()
+            ext = bytes(c & 0x7F for c in entry[9:12]).decode("ascii", "replace").rstrip()
+            key = (user, name, ext)
+            f = self.files.get(key)
+            if f is None:
+                f = self.files[key] = CpmFile(user, name, ext)
+                f.read_only = bool(entry[9] & 0x80)
+                f.system = bool(entry[10] & 0x80)
+                f.archived = bool(entry[11] & 0x80)
+            extent = (entry[14] & 0x3F) * 32 + (entry[12] & 0x1F)
+            rc = min(entry[15], 0x80)
+            records = extent * 128 + rc
+            if records >= f.records:
+                f.records = records
+                f.last_bytes = entry[13] if geom.os == "3" else 0
+            f.entries.append(idx)
+            pairs = extents.setdefault(key, [])
+            for b in self._entry_blocks(entry):
+                if b < geom.total_blocks:
+                    if self.used[b]:
+                        self._crosslinked = True
+                    self.used[b] = 1
+                    pairs.append((extent, b))
+        for key, pairs in extents.items():
+            f = self.files[key]
+            f.blocks = [b for _, b in sorted(pairs, key=lambda item: item[0])]
+
+    def flush(self):
+        """Write the in-memory directory back to its blocks (deferred inside a transaction)."""
+        if not self._dirty_dir or self._staged is not None:
+            return
+        geom = self.geom
+        dir_bytes = bytes(self._dir).ljust(geom.dir_blocks * geom.blocksize, bytes([DELETED]))
+        for b in range(geom.dir_blocks):
+            self.write_block(b, dir_bytes[b * geom.blocksize:(b + 1) * geom.blocksize])
+        if self._fh:
+            self._mm.flush()
+        self._dirty_dir = False
+
+    def entry(self, idx):
+        """Raw 32-byte directory entry idx."""
+        return bytes(self._dir[idx * DIRENT_SIZE:(idx + 1) * DIRENT_SIZE])
+
+    def set_entry(self, idx, data):
+        """
+        Overwrite directory entry idx. Call rescan() after a batch of
+        edits; the directory is written by flush() or commit().
+        """
+        if not self.writable:
+            raise CpmFsError("Image opened read-only.")
+        self._dir[idx * DIRENT_SIZE:(idx + 1) * DIRENT_SIZE] = bytes(data)
+        self._dirty_dir = True
+
+    def rescan(self):
+        """Rebuild files and the allocation map from the in-memory directory."""
+        self._scan_directory()
+
+    # --- Queries ---
+    def list_files(self):
+        """Return CpmFile objects sorted by user then filename."""
+        return sorted(self.files.values(), key=lambda f: (f.user, f.filename))
+
+    def find(self, filename):
+        """Look up "[user:]name.ext"; without a user, the lowest user number wins."""
+        user, name, ext = split_filename(filename)
+        if user is not None:
+            return self.files.get((user, name, ext))
+        for u in range(MAX_USER + 1):
+            f = self.files.get((u, name, ext))
+            if f is not None:
+                return f
+        return None
+
+    def free_blocks(self):
+        return self.used.count(0)
+
+    def free_entries(self):
+        return sum(1 for i in range(self.geom.maxdir) if self._dir[i * DIRENT_SIZE] == DELETED)
+
+    def disk_size(self):
+        return self.geom.total_blocks * self.geom.blocksize
+
+    def scan(self):
+        """Snapshot of the directory pass done on open, as a DirectoryScan."""
+        return DirectoryScan(self.list_files(), bytes(self.used), self.geom, self.free_entries())
+
+    def free_bytes(self):
+        return self.free_blocks() * self.geom.blocksize
+
+    # --- File I/O ---
+    def read_file(self, filename):
+        data = bytearray()
+        for chunk in self.iter_file(filename):
+            data += chunk
+        return bytes(data)
+
+    def iter_file(self, filename):
+        """
+        Yield the contents of filename block by block, as memoryview
+        slices of the mapped image wherever the layout allows.
+        """
+        f = self.find(filename)
+        if f is None:
+            raise CpmFsError(f"File not found on image: {filename}")
+        return self._iter_blocks(f)
+
+    def open_file(self, filename, cache_blocks=READER_CACHE_BLOCKS):
+        """Random-access FileReader for filename."""
+        f = self.find(filename)
+        if f is None:
+            raise CpmFsError(f"File not found on image: {filename}")
+        return FileReader(self, f, cache_blocks)
+
+    def _iter_blocks(self, f):
+        remaining = f.size
+        bs = self.geom.blocksize
+        for b in f.blocks:
+            if remaining <= 0:
+                break
+            chunk = self.block_view(b)
+            if remaining < bs:
+                part = chunk[:remaining]
+                yield part
+                if isinstance(part, memoryview):
+                    part.release()
+            else:
+                yield chunk
+            if isinstance(chunk, memoryview):
+                chunk.release()
+            remaining -= bs
+
+    def delete_file(self, filename):
+        f = self.find(filename)
+        if f is None:
+            raise CpmFsError(f"File not found on image: {filename}")
+        for idx in f.entries:
+            self._dir[idx * DIRENT_SIZE] = DELETED
+        self._dirty_dir = True
+        if self._crosslinked:
+            # Blocks may be shared with another file; rebuild the map
+            self._scan_directory()
+        else:
+            del self.files[(f.user, f.name, f.ext)]
+            for b in f.blocks:
+                self.used[b] = 0
+        self.flush()
+
+    def space_needed(self, size):
+        """(blocks, directory entries) a file of size bytes takes on this image."""
+        geom = self.geom
+        entry_bytes = geom.ptrs_per_entry * geom.blocksize
+        return -(-size // geom.blocksize), max(1, -(-size // entry_bytes))
+
+    def plan_files(self, files, user=0):
+        """
+        Check up front that files [(filename, size), ...] all fit, counting
+        the space of files they replace. Raises CpmFsError naming the
+        shortfall; returns (blocks, entries) needed.
+        """
+        blocks = entries = 0
+        free_blocks, free_entries = self.free_blocks(), self.free_entries()
+        seen = set()
+        for filename, size in files:
+            req_user, name, ext = split_filename(filename)
+            key = (user if req_user is None else req_user, name, ext)
+            existing = self.files.get(key)
+            if existing and key not in seen:
+                free_blocks += len(existing.blocks)
+                free_entries += len(existing.entries)
+            seen.add(key)
+            nblocks, nentries = self.space_needed(size)
+            blocks += nblocks
+            entries += nentries
+        if blocks > free_blocks:
+            raise CpmFsError(f"Disk full: {blocks} blocks needed, {free_blocks} free.")
+        if entries > free_entries:
+            raise CpmFsError(f"Directory full: {entries} entries needed, {free_entries} free.")
+        return blocks, entries
+
+    def write_file(self, filename, data, user=0):
+        """Create (or replace) filename with data, allocating blocks and extents."""
+        bs = self.geom.blocksize
+        self.write_stream(filename, len(data), (data[i:i + bs] for i in range(0, len(data), bs)), user)
+
+    def write_stream(self, filename, size, chunks, user=0):
+        """
+        write_file for size bytes arriving as an iterable of chunks of any
+        length (e.g. another image's iter_file), without holding the file.
+        """
+        if not self.writable:
+            raise CpmFsError("Image opened read-only.")
+        geom = self.geom
+        req_user, name, ext = split_filename(filename)
+        if req_user is not None:
+            user = req_user
+
+        existing = self.find(f"{user}:{name}.{ext}")
+        reclaimed_blocks = len(existing.blocks) if existing else 0
+        reclaimed_entries = len(existing.entries) if existing else 0
+
+        records = -(-size // RECORD_SIZE)
+        nblocks, nentries = self.space_needed(size)
+        entry_bytes = geom.ptrs_per_entry * geom.blocksize
+        if nblocks > self.free_blocks() + reclaimed_blocks:
+            raise CpmFsError("Disk full.")
+        if nentries > self.free_entries() + reclaimed_entries:
+            raise CpmFsError("Directory full.")
+
+        if existing:
+            self.delete_file(f"{user}:{name}.{ext}")
+
+        free = []
+        b = self.used.find(0)
+        while b >= 0 and len(free) < nblocks:
+            free.append(b)
+            b = self.used.find(0, b + 1)
+        pieces = reblock(chunks, geom.blocksize)
+        for b in free:
+            self.write_block(b, next(pieces, b""))
+            self.used[b] = 1
+
+        slots = [i for i in range(geom.maxdir) if self._dir[i * DIRENT_SIZE] == DELETED][:nentries]
+        for n, idx in enumerate(slots):
+            entry = bytearray(DIRENT_SIZE)
+            entry[0] = user
+            entry[1:9] = name.ljust(8).encode("ascii")
+            entry[9:12] = ext.ljust(3).encode("ascii")
+            recs = min(records - n * (entry_bytes // RECORD_SIZE), entry_bytes // RECORD_SIZE)
+            logical = n * geom.extents_per_entry + max(0, (recs - 1) // 128)
+            entry[12] = logical & 0x1F
+            entry[14] = (logical >> 5) & 0x3F
+            entry[15] = recs - ((recs - 1) // 128) * 128 if recs else 0
+            if geom.os == "3":
+                entry[13] = size % RECORD_SIZE if n == nentries - 1 else 0
+            blocks = free[n * geom.ptrs_per_entry:(n + 1) * geom.ptrs_per_entry]
+            for i, b in enumerate(blocks):
+                if geom.big_disk:
+                    entry[16 + 2 * i] = b & 0xFF
+                    entry[17 + 2 * i] = b >> 8
+                else:
+                    entry[16 + i] = b
+            self._dir[idx * DIRENT_SIZE:(idx + 1) * DIRENT_SIZE] = entry
+        self._dirty_dir = True
+        self._scan_entries(slots)
+        self.flush()
+
+    # --- Transactions ---
+    def begin(self):
+        """
+        Start a transaction: block writes are staged in memory and the
+        directory is only written on commit(), so a batch of operations
+        costs one pass over the image.
+        """
+        if not self.writable:
+            raise CpmFsError("Image opened read-only.")
+        if self._staged is not None:
+            raise CpmFsError("Transaction already open.")
+        self._staged = {}
+        self._saved_dir = bytearray(self._dir)
+
+    def commit(self):
+        """Write staged blocks in block order, then the directory."""
+        staged, self._staged = self._staged, None
+        if staged is None:
+            return
+        for block in sorted(staged):
+            self.write_block(block, staged[block])
+        dir_changed = self._dirty_dir
+        self.flush()
+        if staged and self._fh and not dir_changed:
+            self._mm.flush()
+
+    def rollback(self):
+        """Discard everything since begin(); the image is left untouched."""
+        if self._staged is None:
+            return
+        self._staged = None
+        self._dir = self._saved_dir
+        self._dirty_dir = False
+        self._scan_directory()
+
+    @contextmanager
+    def transaction(self):
+        """with image.transaction(): ... commits on success, rolls back on any error."""
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+
+def reblock(chunks, size):
+    """Regroup an iterable of byte chunks into bytes pieces of size (the last may be short)."""
+    pending = bytearray()
+    for chunk in chunks:
+        if not pending and len(chunk) == size:
+            yield bytes(chunk)
+            continue
+        pending += chunk
+        while len(pending) >= size:
+            yield bytes(pending[:size])
+            del pending[:size]
+    if pending:
+        yield bytes(pending)
+
+
+# ----------------------------
+# Random-access file reads
+# ----------------------------
+class FileReader:
+    """
+    Byte-range reads of one file: only the blocks covering a request are
+    read from the image, and the last cache_blocks of them are kept
+    (least recently used first out). Valid while its image is open and
+    unchanged.
+    """
+
+    def __init__(self, image, cpm_file, cache_blocks=READER_CACHE_BLOCKS):
+        self.image = image
+        self.file = cpm_file
+        self.size = cpm_file.size
+        self.blocksize = image.geom.blocksize
+        self.cache_blocks = cache_blocks
+        self.blocks_read = 0
+        self._cache = OrderedDict()    # index in file -> bytes
+
+    def _block(self, index):
+        data = self._cache.get(index)
+        if data is not None:
+            self._cache.move_to_end(index)
+            return data
+        if index >= len(self.file.blocks):
+            return b""    # record count runs past the allocation
+        data = bytes(self.image.read_block(self.file.blocks[index]))
+        self.blocks_read += 1
+        self._cache[index] = data
+        if len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+        return data
+
+    def read_at(self, offset, length):
+        """Up to length bytes from offset; short or empty at end of file."""
+        end = min(self.size, offset + length)
+        if offset >= end:
+            return b""
+        bs = self.blocksize
+        out = bytearray()
+        for index in range(offset // bs, (end - 1) // bs + 1):
+            data = self._block(index)
+            base = index * bs
+            out += data[max(offset, base) - base:min(end, base + bs) - base]
+        return bytes(out)
+
+    def pages(self, page_size, start=0):
+        """Yield (offset, data) pages from start to end of file."""
+        offset = start
+        while offset < self.size:
+            data = self.read_at(offset, page_size)
+            if not data:
+                return
+            yield offset, data
+            offset += len(data)
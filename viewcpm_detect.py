@@ -0,0 +1,163 @@
+# viewcpm_detect.py
+import mmap
+import os
+from collections import OrderedDict
+import viewcpm_cpmfs as cpmfs
+
+DIRENT_SIZE = cpmfs.DIRENT_SIZE
+DELETED = cpmfs.DELETED
+VALID_NAME_BYTES = frozenset(
+    c for c in range(33, 127) if chr(c) not in cpmfs.INVALID_NAME_CHARS
+) | {32}
+MAX_CACHE = 256
+
+# (image hash, diskdefs key, limit) -> ranked results
+_results = OrderedDict()
+
+# ----------------------------
+# Scoring
+# ----------------------------
+def size_score(geom, image_size):
+    """
+    Score 0..40 for how well the image size matches the geometry.
+    Returns None when the image cannot even hold the directory.
+    """
+    dir_end = geom.sector_offset(geom.boottrk, 0) + geom.dir_blocks * geom.blocksize
+    if image_size < dir_end:
+        return None
+    expected = geom.sector_offset(geom.tracks, 0)
+    if image_size == expected:
+        return 40
+    if image_size == expected - geom.offset:
+        return 30
+    if image_size > expected:
+        return 15
+    # Truncated image: partial credit by how much of the disk is present
+    return int(20 * image_size / expected)
+
+
+def directory_offsets(geom):
+    """Byte offsets of the directory sectors, without building the full sector map."""
+    logical = geom.sectrk * geom.boottrk
+    for _ in range(geom.dir_blocks * geom.sectors_per_block):
+        track, sect = divmod(logical, geom.sectrk)
+        yield geom.sector_offset(track, geom.skewtab[sect])
+        logical += 1
+
+
+def directory_score(geom, mm, image_size):
+    """
+    Score 0..60 for directory plausibility, or None once too many entries
+    are invalid for this geometry (early exit).
+    """
+    ensure = getattr(mm, "ensure", None)
+    raw = bytearray()
+    for pos in directory_offsets(geom):
+        if ensure:
+            ensure(pos, geom.seclen)
+        raw += mm[pos:pos + geom.seclen] if pos + geom.seclen <= image_size else bytes([DELETED]) * geom.seclen
+    raw = raw[:geom.maxdir * DIRENT_SIZE]
+
+    max_invalid = max(2, geom.maxdir // 16)
+    valid = invalid = empty = consistent = 0
+    seen_blocks = set()
+    for idx in range(geom.maxdir):
+        entry = raw[idx * DIRENT_SIZE:(idx + 1) * DIRENT_SIZE]
+        user = entry[0]
+        if user == DELETED:
+            empty += 1
+            continue
+        if user in (0x20, 0x21) and geom.os == "3":
+            valid += 1
+            continue
+        ok = user <= cpmfs.MAX_USER
+        ok = ok and all((c & 0x7F) in VALID_NAME_BYTES for c in entry[1:12]) and (entry[1] & 0x7F) != 32
+        ok = ok and entry[12] <= 0x1F and entry[14] <= 0x3F and entry[15] <= 0x80
+        nblocks = 0
+        if ok:
+            ptrs = entry[16:32]
+            if geom.big_disk:
+                blocks = [ptrs[i] | (ptrs[i + 1] << 8) for i in range(0, 16, 2)]
+            else:
+                blocks = list(ptrs)
+            for b in blocks:
+                if not b:
+                    continue
+                if b < geom.dir_blocks or b >= geom.total_blocks or b in seen_blocks:
+                    ok = False
+                    break
+                seen_blocks.add(b)
+                nblocks += 1
+        if not ok:
+            invalid += 1
+            if invalid > max_invalid:
+                return None
+            continue
+        valid += 1
+        records = (entry[12] & geom.exm) * 128 + entry[15]
+        if nblocks == -(-records * cpmfs.RECORD_SIZE // geom.blocksize):
+            consistent += 1
+
+    if not valid:
+        # Freshly formatted disk: plausible, but says little about the format
+        return 10 if empty == geom.maxdir else None
+    ratio = valid / (valid + invalid)
+    return int(30 * ratio + 30 * consistent / valid)
+
+
+# ----------------------------
+# Detection
+# ----------------------------
+def rank_candidates(candidates, mm, image_size, limit):
+    """Directory-score (size, name, geom) candidates, best size first, with pruning."""
+    ranked = []
+    for size, name, geom in candidates:
+        # Stop once no remaining candidate can beat the current top results
+        if len(ranked) >= limit and ranked[limit - 1][1] >= size + 60:
+            break
+        directory = directory_score(geom, mm, image_size)
+        if directory is not None:
+            ranked.append((name, size + directory))
+            ranked.sort(key=lambda item: -item[1])
+    return ranked
+
+
+def detect_formats(raw_path, manager, limit=5, image_hash=None, buffer=None):
+    """
+    Score every diskdef in manager against raw_path (or an in-memory
+    RAW buffer, when given).
+    Returns [(name, score), ...] best first, at most limit entries.
+    Results are cached per image hash when one is given.
+    """
+    cache_key = (image_hash, manager.diskdefs_path, manager.key, limit) if image_hash else None
+    if cache_key in _results:
+        _results.move_to_end(cache_key)
+        return _results[cache_key]
+
+    image_size = len(buffer) if buffer is not None else os.path.getsize(raw_path)
+    ranked = []
+    if image_size:
+        # Cheap size check first; candidates are then scored best-size first
+        candidates = []
+        for name in manager.get_disk_names():
+            try:
+                geom = cpmfs.Geometry(manager.get_diskdef(name))
+            except (cpmfs.CpmFsError, ZeroDivisionError):
+                continue
+            size = size_score(geom, image_size)
+            if size is not None:
+                candidates.append((size, name, geom))
+        candidates.sort(key=lambda item: -item[0])
+
+        if buffer is not None:
+            ranked = rank_candidates(candidates, buffer, image_size, limit)
+        else:
+            with open(raw_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                ranked = rank_candidates(candidates, mm, image_size, limit)
+
+    ranked = ranked[:limit]
+    if cache_key:
+        _results[cache_key] = ranked
+        if len(_results) > MAX_CACHE:
+            _results.popitem(last=False)
+    return ranked
@@ -0,0 +1,219 @@
+# viewcpm_diskdefs.py
+import os
+import pickle
+
+CACHE_FILE = "viewcpm_diskdefs.cache"
+CACHE_VERSION = 1
+DIRENT_SIZE = 32
+
+# ----------------------------
+# Disk definition records
+# ----------------------------
+class DiskDef:
+    """Geometry of one `diskdef` block from a cpmtools diskdefs file."""
+
+    __slots__ = ("name", "seclen", "tracks", "sectrk", "blocksize", "maxdir",
+                 "skew", "skewtab", "boottrk", "offset", "os", "libdsk_format",
+                 "sides", "dirblks", "datarate",
+                 "disksize", "dsm", "dir_blocks")
+
+    def __init__(self, name, seclen=128, tracks=77, sectrk=26, blocksize=1024,
+                 maxdir=64, skew=0, skewtab=None, boottrk=0, offset=0, os="2.2",
+                 libdsk_format=None, sides=None, dirblks=0, datarate=None):
+        self.name = name
+        self.seclen = seclen
+        self.tracks = tracks
+        self.sectrk = sectrk
+        self.blocksize = blocksize
+        self.maxdir = maxdir
+        self.skew = skew
+        self.skewtab = skewtab
+        self.boottrk = boottrk
+        self.offset = offset
+        self.os = os
+        self.libdsk_format = libdsk_format
+        self.sides = sides
+        self.dirblks = dirblks
+        self.datarate = datarate
+
+        # Derived values
+        self.disksize = tracks * sectrk * seclen
+        data_bytes = (tracks - boottrk) * sectrk * seclen
+        self.dsm = data_bytes // blocksize - 1 if blocksize else -1
+        self.dir_blocks = dirblks or (-(-maxdir * DIRENT_SIZE // blocksize) if blocksize else 0)
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+def parse_offset(value, seclen, sectrk):
+    """
+    Convert a diskdefs offset ("11520", "1000trk", "8M", "256KB", "16sec")
+    to a byte count. Track/sector units need the geometry, so pass it in.
+    """
+    text = value.strip().lower()
+    digits = ""
+    for ch in text:
+        if not ch.isdigit():
+            break
+        digits += ch
+    if not digits:
+        raise ValueError(f"Invalid offset: {value}")
+    number = int(digits)
+    unit = text[len(digits):].strip()
+    if unit in ("", "b"):
+        return number
+    if unit in ("k", "kb"):
+        return number * 1024
+    if unit in ("m", "mb"):
+        return number * 1024 * 1024
+    if unit in ("t", "trk"):
+        return number * sectrk * seclen
+    if unit in ("s", "sec"):
+        return number * seclen
+    raise ValueError(f"Invalid offset unit: {value}")
+
+
+def parse_diskdefs(diskdefs_path):
+    """
+    Parse a cpmtools diskdefs file.
+    Returns {name: {key: value_string}} in file order.
+    """
+    defs = {}
+    current = None
+    with open(diskdefs_path, "r", errors="replace") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split(None, 1)
+            key = parts[0].lower()
+            value = parts[1].strip() if len(parts) > 1 else ""
+            if key == "diskdef":
+                current = {}
+                defs[value] = current
+            elif key == "end":
+                current = None
+            elif current is not None:
+                current[key] = value
+    return defs
+
+
+def make_diskdef(name, fields):
+    """Build a DiskDef from the raw {key: value} strings of parse_diskdefs."""
+    seclen = int(fields.get("seclen", 128))
+    sectrk = int(fields.get("sectrk", 26))
+    skewtab = None
+    if fields.get("skewtab"):
+        skewtab = [int(s) for s in fields["skewtab"].split(",") if s.strip()]
+    offset = 0
+    if fields.get("offset"):
+        offset = parse_offset(fields["offset"], seclen, sectrk)
+    return DiskDef(
+        name,
+        seclen=seclen,
+        tracks=int(fields.get("tracks", 77)),
+        sectrk=sectrk,
+        blocksize=int(fields.get("blocksize", 1024)),
+        maxdir=int(fields.get("maxdir", 64)),
+        skew=int(fields.get("skew", 0)),
+        skewtab=skewtab,
+        boottrk=int(fields.get("boottrk", 0)),
+        offset=offset,
+        os=fields.get("os", "2.2"),
+        libdsk_format=fields.get("libdsk:format"),
+        sides=fields.get("sides"),
+        dirblks=int(fields.get("dirblks", 0)),
+        datarate=fields.get("datarate"),
+    )
+
+
+def build_index(diskdefs_path):
+    """Parse diskdefs_path into {name: DiskDef}, skipping malformed entries."""
+    index = {}
+    for name, fields in parse_diskdefs(diskdefs_path).items():
+        try:
+            index[name] = make_diskdef(name, fields)
+        except ValueError as e:
+            print(f"Skipping diskdef {name}: {e}")
+    return index
+
+
+# ----------------------------
+# Manager
+# ----------------------------
+class DiskDefsManager:
+    """
+    Parsed diskdefs index. The parsed records are pickled to CACHE_FILE,
+    keyed by the diskdefs path, mtime and size, so the text is only
+    reparsed when the file changes.
+    """
+
+    def __init__(self, diskdefs_path, cache_path=CACHE_FILE):
+        self.diskdefs_path = os.path.abspath(diskdefs_path)
+        self.cache_path = cache_path
+        self.key = self._cache_key()
+        self.defs = self._load()
+        self._names = list(self.defs)
+
+    def _cache_key(self):
+        st = os.stat(self.diskdefs_path)
+        return (CACHE_VERSION, self.diskdefs_path, st.st_mtime_ns, st.st_size)
+
+    def is_stale(self):
+        """True if the diskdefs file changed since it was loaded."""
+        try:
+            return self._cache_key() != self.key
+        except OSError:
+            return True
+
+    def _load(self):
+        key = self.key
+        try:
+            with open(self.cache_path, "rb") as f:
+                cached_key, index = pickle.load(f)
+            if cached_key == key:
+                return index
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError, AttributeError):
+            pass
+
+        index = build_index(self.diskdefs_path)
+        tmp_path = self.cache_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((key, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Could not write diskdefs cache: {e}")
+        return index
+
+    def get_disk_names(self):
+        return list(self._names)
+
+    def get_diskdef(self, name):
+        return self.defs.get(name)
+
+    def get_disk_info(self, name):
+        """Return the diskdef as a dict (including derived disksize/dsm), or None."""
+        diskdef = self.defs.get(name)
+        return diskdef.as_dict() if diskdef else None
+
+
+_managers = {}
+
+def get_manager(diskdefs_path):
+    """Shared DiskDefsManager for diskdefs_path, reloaded if the file changed."""
+    if not diskdefs_path or not os.path.isfile(diskdefs_path):
+        return None
+    manager = _managers.get(diskdefs_path)
+    if manager is None or manager.is_stale():
+        manager = _managers[diskdefs_path] = DiskDefsManager(diskdefs_path)
+    return manager
+
+
+def load_diskdef(diskdefs_path, name):
+    """Return the DiskDef called name, or None if the file or entry is missing."""
+    manager = get_manager(diskdefs_path)
+    if manager is None:
+        return None
+    return manager.get_diskdef(name)
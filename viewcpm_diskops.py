@@ -1,63 +1,121 @@
 # viewcpm_diskops.py
 import os
-import threading
 import viewcpm_logic as logic
+import viewcpm_prefs as prefs
+from viewcpm_jobs import JobScheduler
+from viewcpm_store import ContentStore
 
 class DiskImageManager:
-    def __init__(self, cpmtools_path, status_callback=None):
+    def __init__(self, cpmtools_path, scheduler=None, diskdefs_path=None):
         """
         cpmtools_path: Path to CP/M tools directory
-        status_callback: function(str) to update status bar
+        scheduler: JobScheduler the operations run on (one is created if omitted)
+        diskdefs_path: diskdefs file (default: prefs['diskdefs_path'])
         """
         self.cpmtools_path = cpmtools_path
+        self.diskdefs_path = diskdefs_path
         self._current_raw_path = None
-        self.status_callback = status_callback or (lambda msg: None)
+        self._current_disk_format = None
+        self.last_check = None      # fsck.CheckReport from the latest check()
+        self.scheduler = scheduler or JobScheduler()
 
-    def set_current_raw(self, raw_path):
+    def set_current_raw(self, raw_path, disk_format=None):
         self._current_raw_path = raw_path
+        self._current_disk_format = disk_format
 
-    # --- Insert ---
-    def insert_files(self, host_folder, files, callback=None):
+    def image_key(self, raw_path=None):
+        """Serialization key for an image: its source file, else the RAW itself."""
+        raw_path = raw_path or self._current_raw_path
+        return os.path.abspath(logic.source_image(raw_path) or raw_path)
+
+    def _submit(self, label, fn, callback=None, other_raw=None, on_error=None):
+        """
+        Queue fn(job, raw_path, disk_format) on the scheduler. Jobs on the
+        same image run one at a time; a job that also touches other_raw
+        waits for both images. fn returns the status message shown when
+        it completes; callback() runs on the UI thread afterwards if it
+        succeeded, on_error(error) if it failed or was cancelled (error is
+        None then).
+        """
         if not self._current_raw_path:
             raise RuntimeError("No disk image loaded.")
-        def task():
-            try:
-                for f in files:
-                    host_file = os.path.join(host_folder, f)
-                    logic.insert_file(self.cpmtools_path, self._current_raw_path, host_file)
-                self.status_callback("Insert complete.")
-            except Exception as e:
-                self.status_callback(f"Insert failed: {e}")
-            if callback:
-                callback()
-        threading.Thread(target=task, daemon=True).start()
+        raw_path, disk_format = self._current_raw_path, self._current_disk_format
+        key = self.image_key(raw_path)
+        if other_raw:
+            key = (key, self.image_key(other_raw))
+
+        def on_done(job):
+            if job.state == "done":
+                if callback:
+                    callback()
+            elif on_error:
+                on_error(job.error)
+
+        return self.scheduler.submit(label, lambda job: fn(job, raw_path, disk_format),
+                                     key=key, on_done=on_done)
+
+    # --- Insert ---
+    def insert_files(self, host_folder, files, callback=None, on_error=None):
+        host_files = [os.path.join(host_folder, f) for f in files]
+        def task(job, raw_path, disk_format):
+            logic.insert_files(self.cpmtools_path, raw_path, host_files,
+                               disk_format=disk_format, diskdefs_path=self.diskdefs_path,
+                               progress=job.report)
+            return job.describe()
+        return self._submit("Insert", task, callback, on_error=on_error)
 
     # --- Extract ---
-    def extract_files(self, files, dest_folder, callback=None):
-        if not self._current_raw_path:
-            raise RuntimeError("No disk image loaded.")
-        def task():
-            try:
-                for f in files:
-                    logic.extract_file(self.cpmtools_path, self._current_raw_path, f, dest_folder)
-                self.status_callback("Extract complete.")
-            except Exception as e:
-                self.status_callback(f"Extract failed: {e}")
-            if callback:
-                callback()
-        threading.Thread(target=task, daemon=True).start()
+    def extract_files(self, files, dest_folder, callback=None, on_error=None):
+        """Extract files; with prefs['extract_store'] set, through that content store."""
+        store_root = prefs.get_pref("extract_store", "")
+        def task(job, raw_path, disk_format):
+            store = ContentStore(store_root, prefs.get_pref("extract_link", "auto")) if store_root else None
+            logic.extract_files(self.cpmtools_path, raw_path, files, dest_folder,
+                                disk_format=disk_format, diskdefs_path=self.diskdefs_path,
+                                progress=job.report, store=store)
+            if store is not None:
+                return f"{job.describe()} ({store.describe()})"
+            return job.describe()
+        return self._submit("Extract", task, callback, on_error=on_error)
 
     # --- Delete ---
-    def delete_files(self, files, callback=None):
-        if not self._current_raw_path:
-            raise RuntimeError("No disk image loaded.")
-        def task():
-            try:
-                for f in files:
-                    logic.delete_file(self.cpmtools_path, self._current_raw_path, f)
-                self.status_callback("Delete complete.")
-            except Exception as e:
-                self.status_callback(f"Delete failed: {e}")
-            if callback:
-                callback()
-        threading.Thread(target=task, daemon=True).start()
+    def delete_files(self, files, callback=None, on_error=None):
+        def task(job, raw_path, disk_format):
+            logic.delete_files(self.cpmtools_path, raw_path, files,
+                               disk_format=disk_format, diskdefs_path=self.diskdefs_path,
+                               progress=job.report)
+            return job.describe()
+        return self._submit("Delete", task, callback, on_error=on_error)
+
+    # --- Copy ---
+    def copy_files(self, files, dest_raw, dest_format, move=False, callback=None, on_error=None):
+        """Copy (or move) files from the current image straight onto another open image."""
+        def task(job, raw_path, disk_format):
+            logic.copy_files(self.cpmtools_path, raw_path, disk_format, dest_raw, dest_format, files,
+                             move=move, diskdefs_path=self.diskdefs_path, progress=job.report)
+            return job.describe()
+        return self._submit("Move" if move else "Copy", task, callback, other_raw=dest_raw, on_error=on_error)
+
+    # --- Check ---
+    def check(self, repair=False, callback=None, on_error=None):
+        """Check (and optionally repair) the current image; the report is left in last_check."""
+        def task(job, raw_path, disk_format):
+            report, repaired = logic.check_image(raw_path, disk_format, diskdefs_path=self.diskdefs_path,
+                                                 repair=repair, progress=job.report)
+            if report is None:
+                raise RuntimeError("The image cannot be checked with this disk format.")
+            self.last_check = report
+            if repaired:
+                return f"Repaired {repaired} problem(s). {report.summary()}"
+            return report.summary()
+        return self._submit("Repair" if repair else "Check", task, callback, on_error=on_error)
+
+    # --- Save ---
+    def commit(self, samdisk_path, callback=None, on_error=None):
+        """Write changes in the working RAW back to the original image."""
+        def task(job, raw_path, disk_format):
+            count = logic.commit_image(samdisk_path, raw_path, progress=job.report)
+            if count:
+                return f"Saved {count} changed sector(s) to {logic.source_image(raw_path)}."
+            return "No changes to save."
+        return self._submit("Save", task, callback, on_error=on_error)
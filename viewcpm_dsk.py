@@ -0,0 +1,180 @@
+# viewcpm_dsk.py
+import shutil
+import struct
+from viewcpm_cpmfs import LazyBuffer
+
+STANDARD_SIG = b"MV - CPC"
+EXTENDED_SIG = b"EXTENDED CPC DSK"
+TRACK_SIG = b"Track-Info"
+INFO_SIZE = 0x100
+
+class DskError(Exception):
+    """Raised for malformed CPCEMU/extended DSK files."""
+
+
+# ----------------------------
+# Records
+# ----------------------------
+class DskSector:
+    __slots__ = ("c", "h", "r", "n", "st1", "st2", "length", "file_offset")
+
+    def __init__(self, c, h, r, n, st1, st2, length, file_offset):
+        self.c = c
+        self.h = h
+        self.r = r
+        self.n = n
+        self.st1 = st1
+        self.st2 = st2
+        self.length = length
+        self.file_offset = file_offset
+
+
+class DskTrack:
+    """Track header only; sector data stays in the file until decoded."""
+
+    __slots__ = ("track", "side", "sector_size", "filler", "sectors", "raw_offset")
+
+    def __init__(self, track, side, sector_size, filler, sectors):
+        self.track = track
+        self.side = side
+        self.sector_size = sector_size
+        self.filler = filler
+        self.sectors = sectors     # sorted by sector ID (R)
+        self.raw_offset = 0
+
+    @property
+    def raw_size(self):
+        return len(self.sectors) * self.sector_size
+
+
+# ----------------------------
+# Container
+# ----------------------------
+class DskImage:
+    """
+    Standard or extended DSK container. Opening parses the disk info block,
+    the track offset table and each 256-byte track header; sector data is
+    read per track on demand.
+    """
+
+    def __init__(self, path, sides="alt"):
+        self.path = path
+        with open(path, "rb") as f:
+            info = f.read(INFO_SIZE)
+            if info.startswith(EXTENDED_SIG):
+                self.extended = True
+            elif info.startswith(STANDARD_SIG):
+                self.extended = False
+            else:
+                raise DskError("Not a CPCEMU DSK file.")
+            if len(info) < INFO_SIZE:
+                raise DskError("Truncated disk info block.")
+            self.creator = info[0x22:0x30].rstrip(b"\0 ").decode("ascii", "replace")
+            self.ntracks = info[0x30]
+            self.nsides = info[0x31]
+            self.tracks = []
+            for index, file_offset in self._track_offsets(info):
+                if file_offset is None:
+                    continue
+                f.seek(file_offset)
+                header = f.read(INFO_SIZE)
+                if not header.startswith(TRACK_SIG):
+                    raise DskError(f"Bad track header for track {index}.")
+                self.tracks.append(self._parse_track(header, file_offset))
+        self._order(sides)
+
+    def _track_offsets(self, info):
+        """Yield (track index, file offset or None if unformatted)."""
+        offset = INFO_SIZE
+        count = self.ntracks * self.nsides
+        if self.extended:
+            for i in range(count):
+                size = info[0x34 + i] * 256
+                yield i, offset if size else None
+                offset += size
+        else:
+            size = struct.unpack_from("<H", info, 0x32)[0]
+            for i in range(count):
+                yield i, offset
+                offset += size
+
+    def _parse_track(self, header, file_offset):
+        track, side = header[0x10], header[0x11]
+        size_code, count, filler = header[0x14], header[0x15], header[0x17]
+        sectors = []
+        data_offset = file_offset + INFO_SIZE
+        for i in range(count):
+            c, h, r, n, st1, st2, length = struct.unpack_from("<6BH", header, 0x18 + i * 8)
+            if not self.extended or not length:
+                length = 128 << min(n, 6)
+            sectors.append(DskSector(c, h, r, n, st1, st2, length, data_offset))
+            data_offset += length
+        sectors.sort(key=lambda s: s.r)
+        return DskTrack(track, side, 128 << min(size_code, 6), filler, sectors)
+
+    def _order(self, sides):
+        """Assign RAW offsets, with the same side orders as the IMD reader."""
+        if sides == "outout":
+            key = lambda t: (t.side, t.track)
+        elif sides == "outback":
+            key = lambda t: (t.side, t.track if t.side == 0 else -t.track)
+        else:
+            key = lambda t: (t.track, t.side)
+        self.tracks.sort(key=key)
+        offset = 0
+        for t in self.tracks:
+            t.raw_offset = offset
+            offset += t.raw_size
+        self.raw_size = offset
+
+    def read_track(self, index, f=None):
+        """Decode one track into RAW sector order (padded with the filler byte)."""
+        track = self.tracks[index]
+        own = f is None
+        if own:
+            f = open(self.path, "rb")
+        try:
+            out = bytearray()
+            for s in track.sectors:
+                f.seek(s.file_offset)
+                data = f.read(min(s.length, track.sector_size))
+                out += data.ljust(track.sector_size, bytes([track.filler]))
+            return bytes(out)
+        finally:
+            if own:
+                f.close()
+
+    def lazy_raw(self):
+        """LazyBuffer that decodes each track the first time the CP/M layer touches it."""
+        spans = [(t.raw_offset, t.raw_size) for t in self.tracks]
+        return LazyBuffer(self.raw_size, spans, self.read_track)
+
+    def to_raw(self):
+        buffer = bytearray(self.raw_size)
+        with open(self.path, "rb") as f:
+            for i, t in enumerate(self.tracks):
+                buffer[t.raw_offset:t.raw_offset + t.raw_size] = self.read_track(i, f)
+        return buffer
+
+
+# ----------------------------
+# Writing
+# ----------------------------
+def patch_dsk(image, raw, ranges, out_path):
+    """
+    Copy image's file to out_path and rewrite, in place, the sector data of
+    every track overlapping the dirty (offset, length) RAW ranges. DSK
+    tracks have fixed positions, so untouched tracks are never re-encoded.
+    """
+    ranges = list(ranges)
+    shutil.copyfile(image.path, out_path)
+    with open(out_path, "r+b") as out:
+        for t in image.tracks:
+            end = t.raw_offset + t.raw_size
+            if not any(start < end and start + length > t.raw_offset for start, length in ranges):
+                continue
+            offset = t.raw_offset
+            for s in t.sectors:
+                out.seek(s.file_offset)
+                out.write(bytes(raw[offset:offset + min(s.length, t.sector_size)]))
+                offset += t.sector_size
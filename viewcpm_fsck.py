@@ -0,0 +1,227 @@
+# viewcpm_fsck.py
+from array import array
+import viewcpm_cpmfs as cpmfs
+
+RECORD_SIZE = cpmfs.RECORD_SIZE
+DELETED = cpmfs.DELETED
+CPM3_SPECIAL_USERS = range(16, 0x22)   # passwords (16-31), disc label (0x20), timestamps (0x21)
+
+# Problems fixed by deleting the whole entry
+DELETE_KINDS = ("bad-user", "bad-name", "bad-extent", "duplicate-extent")
+
+class Problem:
+    """One inconsistency found by check()."""
+
+    __slots__ = ("kind", "entry", "filename", "block", "slot", "message")
+
+    def __init__(self, kind, entry, filename, message, block=None, slot=None):
+        self.kind = kind
+        self.entry = entry          # directory entry index
+        self.filename = filename
+        self.block = block
+        self.slot = slot            # block pointer index within the entry
+        self.message = message
+
+    @property
+    def repairable(self):
+        return self.kind != "missing-extent"
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __str__(self):
+        return f"{self.filename or '?'} (entry {self.entry}): {self.message}"
+
+
+class CheckReport:
+    def __init__(self, problems, files, lost_blocks):
+        self.problems = problems
+        self.files = files
+        self.lost_blocks = lost_blocks   # blocks only claimed by entries that are not valid
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    def counts(self):
+        counts = {}
+        for p in self.problems:
+            counts[p.kind] = counts.get(p.kind, 0) + 1
+        return counts
+
+    def summary(self):
+        if self.ok:
+            return f"Image OK ({self.files} files)."
+        kinds = ", ".join(f"{n} {kind}" for kind, n in sorted(self.counts().items()))
+        lost = f", {len(self.lost_blocks)} lost block(s)" if self.lost_blocks else ""
+        return f"{len(self.problems)} problem(s): {kinds}{lost}"
+
+    def as_dict(self):
+        return {
+            "ok": self.ok,
+            "files": self.files,
+            "counts": self.counts(),
+            "lost_blocks": sorted(self.lost_blocks),
+            "problems": [p.as_dict() for p in self.problems],
+        }
+
+
+def _pointers(geom, entry):
+    """(slot, block) for every non-zero block pointer of an entry."""
+    ptrs = entry[16:32]
+    if geom.big_disk:
+        blocks = [ptrs[i] | (ptrs[i + 1] << 8) for i in range(0, 16, 2)]
+    else:
+        blocks = list(ptrs)
+    return [(slot, b) for slot, b in enumerate(blocks) if b]
+
+
+def _entry_name(entry):
+    name = bytes(c & 0x7F for c in entry[1:9]).decode("ascii", "replace").rstrip()
+    ext = bytes(c & 0x7F for c in entry[9:12]).decode("ascii", "replace").rstrip()
+    return name, ext
+
+
+# ----------------------------
+# Check
+# ----------------------------
+def check(image):
+    """
+    One pass over the directory of a cpmfs.CpmImage, with a block owner
+    table, looking for bad entries, out-of-range and cross-linked block
+    pointers, pointers past the extent's records, duplicate or missing
+    extents and record counts that do not match the allocation. Returns
+    a CheckReport.
+    """
+    geom = image.geom
+    problems = []
+    owner = array("i", [-1]) * geom.total_blocks
+    extents = {}          # (user, name, ext, entry number) -> entry index
+    numbers = {}          # (user, name, ext) -> set of entry numbers
+    lost = set()
+
+    for idx in range(geom.maxdir):
+        entry = image.entry(idx)
+        user = entry[0]
+        if user == DELETED or (geom.os == "3" and user in CPM3_SPECIAL_USERS):
+            continue
+        name, ext = _entry_name(entry)
+        filename = f"{user}:{name}.{ext}" if user <= 0x1F else f"{name}.{ext}"
+        pointers = _pointers(geom, entry)
+
+        def discard(kind, message):
+            problems.append(Problem(kind, idx, filename, message))
+            lost.update(b for _, b in pointers if geom.dir_blocks <= b < geom.total_blocks)
+
+        if user > cpmfs.MAX_USER:
+            discard("bad-user", f"invalid user number {user}")
+            continue
+        raw_name = bytes(c & 0x7F for c in entry[1:12])
+        if any(c < 32 or c > 126 or chr(c) in cpmfs.INVALID_NAME_CHARS for c in raw_name) or raw_name[0] == 32:
+            discard("bad-name", "invalid characters in filename")
+            continue
+        if entry[12] > 0x1F or entry[14] > 0x3F:
+            discard("bad-extent", f"extent bytes out of range (EX={entry[12]}, S2={entry[14]})")
+            continue
+        logical = (entry[14] & 0x3F) * 32 + entry[12]
+        number = logical // (geom.exm + 1)
+        key = (user, name, ext)
+        if (key + (number,)) in extents:
+            discard("duplicate-extent", f"extent {number} also in entry {extents[key + (number,)]}")
+            continue
+        extents[key + (number,)] = idx
+        numbers.setdefault(key, set()).add(number)
+
+        rc = entry[15]
+        if rc > 0x80:
+            problems.append(Problem("bad-record-count", idx, filename, f"record count {rc} > 128"))
+            rc = 0x80
+        records = (logical & geom.exm) * 128 + rc
+        needed = -(-records * RECORD_SIZE // geom.blocksize)
+        valid = 0             # the engine reads the valid pointers in order, skipping zero slots
+        for slot, b in pointers:
+            if b < geom.dir_blocks or b >= geom.total_blocks:
+                problems.append(Problem("bad-pointer", idx, filename,
+                                        f"block {b} outside data area", block=b, slot=slot))
+            elif owner[b] >= 0:
+                problems.append(Problem("cross-linked", idx, filename,
+                                        f"block {b} also used by entry {owner[b]}", block=b, slot=slot))
+            elif valid >= needed:
+                problems.append(Problem("excess-pointer", idx, filename,
+                                        f"block {b} past the {records} records of the extent", block=b, slot=slot))
+                lost.add(b)
+            else:
+                owner[b] = idx
+                valid += 1
+        if needed > valid:
+            problems.append(Problem("short-allocation", idx, filename,
+                                    f"{records} records need {needed} blocks, {valid} allocated"))
+
+    for key, seen in numbers.items():
+        missing = sorted(set(range(max(seen) + 1)) - seen)
+        if missing:
+            user, name, ext = key
+            problems.append(Problem("missing-extent", extents[key + (max(seen),)], f"{user}:{name}.{ext}",
+                                    f"extent(s) {', '.join(map(str, missing))} missing"))
+
+    lost = {b for b in lost if owner[b] < 0}
+    return CheckReport(problems, len(numbers), lost)
+
+
+# ----------------------------
+# Repair
+# ----------------------------
+def _clamp_records(geom, entry):
+    """
+    Move the remaining block pointers down over cleared slots, then cut
+    RC/EX back so the entry claims no records past its last block.
+    """
+    per_block = geom.blocksize // RECORD_SIZE
+    width = 2 if geom.big_disk else 1
+    slots = [bytes(entry[16 + slot * width:16 + (slot + 1) * width]) for slot in range(geom.ptrs_per_entry)]
+    kept = [ptr for ptr in slots if any(ptr)]
+    entry[16:32] = b"".join(kept).ljust(16, b"\0")
+    allocated = len(kept)
+    logical = (entry[14] & 0x3F) * 32 + entry[12]
+    records = (logical & geom.exm) * 128 + min(entry[15], 0x80)
+    records = min(records, allocated * per_block)
+    base = logical & ~geom.exm
+    logical = base + max(0, (records - 1) // 128)
+    entry[12] = logical & 0x1F
+    entry[14] = (logical >> 5) & 0x3F
+    entry[15] = records - ((records - 1) // 128) * 128 if records else 0
+
+
+def repair(image, report):
+    """
+    Fix what report found on a writable image, in one transaction:
+    invalid and duplicate entries are deleted (freeing their lost
+    blocks), bad, cross-linked and excess pointers are cleared (the first
+    owner keeps a shared block) and the rest moved down over them, and
+    record counts are cut back to the remaining allocation. Returns the
+    number of problems repaired.
+    """
+    geom = image.geom
+    width = 2 if geom.big_disk else 1
+    by_entry = {}
+    for p in report.problems:
+        if p.repairable:
+            by_entry.setdefault(p.entry, []).append(p)
+    if not by_entry:
+        return 0
+
+    fixed = 0
+    with image.transaction():
+        for idx, found in by_entry.items():
+            entry = bytearray(image.entry(idx))
+            if any(p.kind in DELETE_KINDS for p in found):
+                entry[0] = DELETED
+            else:
+                for p in found:
+                    if p.slot is not None:
+                        entry[16 + p.slot * width:16 + (p.slot + 1) * width] = bytes(width)
+                _clamp_records(geom, entry)
+            image.set_entry(idx, entry)
+            fixed += len(found)
+        image.rescan()
+    return fixed
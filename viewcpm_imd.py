@@ -0,0 +1,227 @@
+# viewcpm_imd.py
+import time
+
+SECTOR_SIZES = [128, 256, 512, 1024, 2048, 4096, 8192]
+FILL = 0xE5
+
+class ImdError(Exception):
+    """Raised for malformed ImageDisk files."""
+
+
+# ----------------------------
+# Records
+# ----------------------------
+class ImdTrack:
+    """One track record: header, sector maps and per-sector data."""
+
+    __slots__ = ("mode", "cyl", "head", "sector_size", "sector_ids",
+                 "cyl_map", "head_map", "sector_types", "sectors", "span")
+
+    def __init__(self, mode, cyl, head, sector_size, sector_ids, cyl_map=None, head_map=None):
+        self.mode = mode
+        self.cyl = cyl
+        self.head = head
+        self.sector_size = sector_size
+        self.sector_ids = sector_ids
+        self.cyl_map = cyl_map
+        self.head_map = head_map
+        self.sector_types = []
+        self.sectors = []    # bytes, or None when the sector is unavailable
+        self.span = None     # (start, end) of this record in the source file
+
+    def ordered(self):
+        """Yield (sector index, data) in ascending sector-ID order."""
+        for i in sorted(range(len(self.sector_ids)), key=lambda i: self.sector_ids[i]):
+            yield i, self.sectors[i]
+
+    @property
+    def size(self):
+        return len(self.sector_ids) * self.sector_size
+
+
+class ImdImage:
+    def __init__(self, header, comment, tracks):
+        self.header = header
+        self.comment = comment
+        self.tracks = tracks
+
+    def track_order(self, sides="alt"):
+        """
+        Tracks in RAW order. "alt" interleaves heads per cylinder (the
+        cpmtools default); "outout" is all of head 0 then head 1;
+        "outback" runs head 1 from the last cylinder back to the first.
+        """
+        if sides == "outout":
+            return sorted(self.tracks, key=lambda t: (t.head, t.cyl))
+        if sides == "outback":
+            return sorted(self.tracks, key=lambda t: (t.head, t.cyl if t.head == 0 else -t.cyl))
+        return sorted(self.tracks, key=lambda t: (t.cyl, t.head))
+
+    def layout(self, sides="alt"):
+        """Yield (track, raw offset) for every track in RAW order."""
+        offset = 0
+        for track in self.track_order(sides):
+            yield track, offset
+            offset += track.size
+
+    def raw_size(self):
+        return sum(t.size for t in self.tracks)
+
+    def to_raw(self, sides="alt", buffer=None):
+        """
+        Decode into a RAW buffer (a new bytearray, or any writable buffer
+        such as an mmap). Unavailable sectors are filled with 0xE5.
+        """
+        if buffer is None:
+            buffer = bytearray(self.raw_size())
+        for track, offset in self.layout(sides):
+            size = track.sector_size
+            for _, data in track.ordered():
+                buffer[offset:offset + size] = data if data is not None else bytes([FILL]) * size
+                offset += size
+        return buffer
+
+    def tracks_in_ranges(self, ranges, sides="alt"):
+        """RAW track indices overlapping any (offset, length) byte range."""
+        ranges = list(ranges)
+        hit = set()
+        for index, (track, offset) in enumerate(self.layout(sides)):
+            end = offset + track.size
+            if any(start < end and start + length > offset for start, length in ranges):
+                hit.add(index)
+        return hit
+
+    def update_from_raw(self, raw, tracks=None, sides="alt"):
+        """
+        Copy sector data back from a RAW buffer. If tracks is given, only
+        those RAW track indices are updated. Returns the changed ImdTracks.
+        """
+        changed = []
+        for index, (track, offset) in enumerate(self.layout(sides)):
+            if tracks is not None and index not in tracks:
+                continue
+            size = track.sector_size
+            for i, _ in track.ordered():
+                data = bytes(raw[offset:offset + size])
+                unavailable = track.sectors[i] is None and data.count(FILL) == size
+                if data != track.sectors[i] and not unavailable:
+                    kind = track.sector_types[i]
+                    track.sectors[i] = data
+                    track.sector_types[i] = (kind if kind % 2 else kind - 1) if kind else 1
+                    if track not in changed:
+                        changed.append(track)
+                offset += size
+        return changed
+
+
+# ----------------------------
+# Reading
+# ----------------------------
+def _read_exact(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise ImdError("Unexpected end of IMD file.")
+    return data
+
+
+def read_imd(path):
+    """Stream-decode an IMD file into an ImdImage."""
+    with open(path, "rb") as f:
+        head = bytearray()
+        while True:
+            ch = f.read(1)
+            if not ch:
+                raise ImdError("Missing IMD comment terminator.")
+            if ch == b"\x1a":
+                break
+            head += ch
+        if not head.startswith(b"IMD "):
+            raise ImdError("Not an ImageDisk file.")
+        header, _, comment = bytes(head).partition(b"\r\n")
+
+        tracks = []
+        while True:
+            start = f.tell()
+            hdr = f.read(5)
+            if not hdr:
+                break
+            if len(hdr) != 5:
+                raise ImdError("Truncated track header.")
+            mode, cyl, head_byte, nsec, size_code = hdr
+            if size_code == 0xFF:
+                raise ImdError("Variable sector-size tracks are not supported.")
+            if size_code >= len(SECTOR_SIZES):
+                raise ImdError(f"Bad sector size code {size_code}.")
+            ids = list(_read_exact(f, nsec))
+            cyl_map = list(_read_exact(f, nsec)) if head_byte & 0x80 else None
+            head_map = list(_read_exact(f, nsec)) if head_byte & 0x40 else None
+            track = ImdTrack(mode, cyl, head_byte & 0x01, SECTOR_SIZES[size_code],
+                             ids, cyl_map, head_map)
+            for _ in range(nsec):
+                kind = _read_exact(f, 1)[0]
+                if kind == 0:
+                    data = None
+                elif kind > 8:
+                    raise ImdError(f"Bad sector record type {kind}.")
+                elif kind % 2:
+                    data = _read_exact(f, track.sector_size)
+                else:
+                    data = _read_exact(f, 1) * track.sector_size
+                track.sector_types.append(kind)
+                track.sectors.append(data)
+            track.span = (start, f.tell())
+            tracks.append(track)
+    return ImdImage(header.decode("ascii", "replace"), comment, tracks)
+
+
+# ----------------------------
+# Writing
+# ----------------------------
+def encode_track(track):
+    """Encode one track record, compressing sectors filled with a single byte."""
+    out = bytearray()
+    head_byte = track.head | (0x80 if track.cyl_map else 0) | (0x40 if track.head_map else 0)
+    out += bytes([track.mode, track.cyl, head_byte, len(track.sector_ids),
+                  SECTOR_SIZES.index(track.sector_size)])
+    out += bytes(track.sector_ids)
+    if track.cyl_map:
+        out += bytes(track.cyl_map)
+    if track.head_map:
+        out += bytes(track.head_map)
+    for kind, data in zip(track.sector_types, track.sectors):
+        if data is None:
+            out.append(0)
+            continue
+        # Keep the deleted/error flavour, switch between normal and compressed
+        base = kind if kind % 2 else kind - 1
+        if data.count(data[0]) == len(data):
+            out.append(base + 1)
+            out.append(data[0])
+        else:
+            out.append(base)
+            out += data
+    return bytes(out)
+
+
+def write_imd(image, out_path, source_path=None, changed=None):
+    """
+    Write image to out_path. When source_path is the file image was read
+    from, tracks not in changed are copied from it byte for byte and only
+    the changed tracks are re-encoded.
+    """
+    changed_ids = {id(t) for t in changed} if changed is not None else None
+    src = open(source_path, "rb") if source_path else None
+    try:
+        with open(out_path, "wb") as out:
+            header = image.header or time.strftime("IMD 1.18: %d/%m/%Y %H:%M:%S")
+            out.write(header.encode("ascii") + b"\r\n" + image.comment + b"\x1a")
+            for track in image.tracks:
+                if src and changed_ids is not None and id(track) not in changed_ids and track.span:
+                    start, end = track.span
+                    src.seek(start)
+                    out.write(src.read(end - start))
+                else:
+                    out.write(encode_track(track))
+    finally:
+        if src:
+            src.close()
@@ -0,0 +1,329 @@
+# viewcpm_index.py
+"""Catalog of a tree of CP/M disk images in a local SQLite database."""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+import viewcpm_logic as logic
+import viewcpm_prefs as prefs
+
+CATALOG_FILE = "viewcpm_catalog.db"
+IMAGE_EXTENSIONS = (".dsk", ".imd", ".img", ".raw")
+RAW_EXTENSIONS = (".img", ".raw")
+MAX_RESULTS = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    format TEXT,
+    seclen INTEGER, sectrk INTEGER, tracks INTEGER,
+    blocksize INTEGER, maxdir INTEGER, boottrk INTEGER,
+    disk_size INTEGER, free_bytes INTEGER,
+    error TEXT,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+    user INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT
+);
+CREATE INDEX IF NOT EXISTS files_name ON files(name);
+CREATE INDEX IF NOT EXISTS files_hash ON files(hash);
+CREATE INDEX IF NOT EXISTS files_image ON files(image_id);
+"""
+
+# ----------------------------
+# Per-image worker
+# ----------------------------
+def file_hash(chunks):
+    """Same BLAKE2b-128 hex digest as logic.image_hash, over file contents."""
+    h = hashlib.blake2b(digest_size=16)
+    for chunk in chunks:
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def index_image(task):
+    """
+    Read one image in a worker process: detect its format and list and
+    hash every file. Takes and returns plain data only.
+    """
+    path, stamp, options = task
+    result = {"path": path, "mtime_ns": stamp[0], "size": stamp[1], "format": None,
+              "geometry": None, "disk_size": None, "free_bytes": None, "files": [], "error": None}
+    tmp_dir = tempfile.mkdtemp(prefix="viewcpm-index-")
+    raw_path = None
+    try:
+        if os.path.splitext(path)[1].lower() in RAW_EXTENSIONS:
+            raw_path = path
+        else:
+            sides = logic.diskdef_sides(options["format"], options["diskdefs_path"])
+            raw_path = logic.convert_dsk_to_raw(options["samdisk_path"], path, tmp_dir=tmp_dir, sides=sides)
+        disk_format = options["format"]
+        if not disk_format:
+            matches = logic.detect_disk_format(raw_path, limit=1, diskdefs_path=options["diskdefs_path"])
+            if not matches:
+                raise RuntimeError("Could not detect disk format.")
+            disk_format = matches[0][0]
+        result["format"] = disk_format
+
+        image = logic.open_native_image(raw_path, disk_format, diskdefs_path=options["diskdefs_path"])
+        if image is None:
+            # cpmtools fallback: names and sizes only
+            for name, size in logic.list_image_files(options["cpmtools_path"], raw_path, disk_format,
+                                                     options["diskdefs_path"]):
+                user, _, filename = name.rpartition(":")
+                result["files"].append((int(user or 0), filename.upper(), int(size.replace(",", "")), None))
+            return result
+        with image:
+            geom = image.geom
+            result["geometry"] = (geom.seclen, geom.sectrk, geom.tracks, geom.blocksize, geom.maxdir, geom.boottrk)
+            result["disk_size"] = image.disk_size()
+            result["free_bytes"] = image.free_bytes()
+            for f in image.list_files():
+                digest = file_hash(image.iter_file(f"{f.user}:{f.filename}"))
+                result["files"].append((f.user, f.filename, f.size, digest))
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        if raw_path:
+            logic.release_raw(raw_path)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return result
+
+
+def find_images(root):
+    """{path: (mtime_ns, size)} for every disk image under root."""
+    images = {}
+    for folder, _, names in os.walk(root):
+        for name in names:
+            if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            path = os.path.abspath(os.path.join(folder, name))
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            images[path] = (st.st_mtime_ns, st.st_size)
+    return images
+
+
+# ----------------------------
+# Catalog
+# ----------------------------
+def _glob(pattern):
+    """Filename pattern to an SQLite GLOB: names are stored upper case, no wildcards means substring."""
+    pattern = pattern.strip().upper()
+    if not any(c in pattern for c in "*?["):
+        pattern = f"*{pattern}*"
+    return pattern
+
+
+class Catalog:
+    """
+    The SQLite catalog. Use one Catalog per thread; it is cheap to open.
+    Search methods return lists of dicts, at most MAX_RESULTS rows.
+    """
+
+    def __init__(self, path=CATALOG_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- Updating ---
+    def stamps(self, root=None):
+        """{path: (mtime_ns, size)} of indexed images, optionally only those under root."""
+        rows = self.conn.execute("SELECT path, mtime_ns, size FROM images")
+        prefix = os.path.join(os.path.abspath(root), "") if root else ""
+        return {row["path"]: (row["mtime_ns"], row["size"]) for row in rows if row["path"].startswith(prefix)}
+
+    def store(self, result):
+        """Replace the catalog entry of one image with an index_image() result."""
+        geometry = result["geometry"] or (None,) * 6
+        with self.conn:
+            self.conn.execute("DELETE FROM images WHERE path = ?", (result["path"],))
+            cur = self.conn.execute(
+                "INSERT INTO images (path, mtime_ns, size, format, seclen, sectrk, tracks, blocksize, maxdir,"
+                " boottrk, disk_size, free_bytes, error, indexed_at) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                (result["path"], result["mtime_ns"], result["size"], result["format"], *geometry,
+                 result["disk_size"], result["free_bytes"], result["error"], time.time()))
+            self.conn.executemany("INSERT INTO files (image_id, user, name, size, hash) VALUES (?,?,?,?,?)",
+                                  [(cur.lastrowid, *f) for f in result["files"]])
+
+    def remove(self, paths):
+        with self.conn:
+            self.conn.executemany("DELETE FROM images WHERE path = ?", [(p,) for p in paths])
+
+    # --- Searching ---
+    def _files(self, where, params, order="images.path, files.user, files.name"):
+        sql = ("SELECT images.path AS image, images.format AS format, files.user AS user, files.name AS name,"
+               " files.size AS size, files.hash AS hash FROM files JOIN images ON images.id = files.image_id"
+               f" WHERE {where} ORDER BY {order} LIMIT {MAX_RESULTS}")
+        return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def find(self, pattern):
+        """Files whose name matches pattern ("ws.com", "*.com", "ws?.*"), case-insensitive."""
+        return self._files("files.name GLOB ?", (_glob(pattern),))
+
+    def find_hash(self, digest):
+        """Files with the given content hash, or hash prefix."""
+        digest = digest.strip().lower()
+        return self._files("files.hash >= ? AND files.hash < ?", (digest, digest + "g"))
+
+    def duplicates(self, min_images=2):
+        """Files whose content appears on at least min_images images, grouped by hash."""
+        return self._files(
+            "files.hash IN (SELECT hash FROM files WHERE hash IS NOT NULL AND size > 0"
+            " GROUP BY hash HAVING COUNT(DISTINCT image_id) >= ?)",
+            (min_images,), order="files.size DESC, files.hash, images.path")
+
+    def search(self, text):
+        """
+        One query box for the UI: "hash:<hex>" searches by content hash,
+        "dupes" lists duplicated files, anything else matches filenames.
+        """
+        text = text.strip()
+        if text.lower().startswith("hash:"):
+            return self.find_hash(text[5:])
+        if text.lower() == "dupes":
+            return self.duplicates()
+        return self.find(text)
+
+    def stats(self):
+        images, failed = self.conn.execute(
+            "SELECT COUNT(*), COUNT(error) FROM images").fetchone()
+        files = self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        return {"images": images, "failed": failed, "files": files}
+
+
+# ----------------------------
+# Indexing
+# ----------------------------
+def index_tree(root, catalog_path=CATALOG_FILE, options=None, jobs=None, force=False, log=None):
+    """
+    Bring the catalog up to date with the images under root: new and
+    changed images are read in parallel, unchanged ones are skipped and
+    images that no longer exist are dropped. Returns a summary dict.
+    """
+    options = dict(options or {})
+    options.setdefault("format", None)
+    for key in ("samdisk_path", "cpmtools_path", "diskdefs_path"):
+        options[key] = options.get(key) or prefs.get_pref(key, "")
+    start = time.perf_counter()
+    found = find_images(root)
+    with Catalog(catalog_path) as catalog:
+        known = catalog.stamps(root)
+        gone = [path for path in known if path not in found]
+        catalog.remove(gone)
+        todo = [(path, stamp, options) for path, stamp in sorted(found.items())
+                if force or known.get(path) != stamp]
+
+        counts = {"indexed": 0, "failed": 0, "files": 0}
+
+        def collect(results):
+            for result in results:
+                catalog.store(result)
+                counts["indexed"] += 1
+                counts["files"] += len(result["files"])
+                if result["error"]:
+                    counts["failed"] += 1
+                if log:
+                    log(f"[{counts['indexed']}/{len(todo)}] {result['path']}: "
+                        + (result["error"] or f"{result['format']}, {len(result['files'])} files"))
+
+        workers = max(1, min(jobs or os.cpu_count() or 1, len(todo)))
+        if workers == 1:
+            collect(map(index_image, todo))
+        else:
+            with Pool(workers) as pool:
+                collect(pool.imap_unordered(index_image, todo, chunksize=4))
+        totals = catalog.stats()
+    return {
+        "root": os.path.abspath(root),
+        "images": len(found),
+        **counts,
+        "skipped": len(found) - len(todo),
+        "removed": len(gone),
+        "seconds": round(time.perf_counter() - start, 3),
+        "catalog": totals,
+    }
+
+
+# ----------------------------
+# Command line
+# ----------------------------
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python viewcpm_index.py",
+                                     description="Index CP/M disk images into a searchable catalog.")
+    parser.add_argument("--catalog", default=prefs.get_pref("catalog_path", CATALOG_FILE), help="SQLite catalog file")
+    sub = parser.add_subparsers(dest="command", required=True)
+    scan = sub.add_parser("scan", help="index the images under a folder")
+    scan.add_argument("root")
+    scan.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    scan.add_argument("-f", "--format", help="diskdef name (default: detect per image)")
+    scan.add_argument("--force", action="store_true", help="re-read images even if unchanged")
+    scan.add_argument("--diskdefs", default=prefs.get_pref("diskdefs_path", ""), help="diskdefs file")
+    scan.add_argument("--cpmtools", default=prefs.get_pref("cpmtools_path", ""), help="cpmtools directory")
+    scan.add_argument("--samdisk", default=prefs.get_pref("samdisk_path", ""), help="SAMdisk executable")
+    sub.add_parser("find", help="files by name pattern").add_argument("pattern")
+    sub.add_parser("hash", help="files by content hash (or prefix)").add_argument("digest")
+    sub.add_parser("dupes", help="files stored on more than one image")
+    sub.add_parser("stats", help="catalog totals")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "scan":
+        options = {"format": args.format, "diskdefs_path": args.diskdefs,
+                   "cpmtools_path": args.cpmtools, "samdisk_path": args.samdisk}
+        log = lambda text: print(text, file=sys.stderr)
+        summary = index_tree(args.root, args.catalog, options, jobs=args.jobs, force=args.force, log=log)
+        print(json.dumps(summary))
+        return 1 if summary["failed"] else 0
+
+    with Catalog(args.catalog) as catalog:
+        if args.command == "stats":
+            print(json.dumps(catalog.stats()))
+            return 0
+        if args.command == "find":
+            rows = catalog.find(args.pattern)
+        elif args.command == "hash":
+            rows = catalog.find_hash(args.digest)
+        else:
+            rows = catalog.duplicates()
+    try:
+        for row in rows:
+            sys.stdout.write(json.dumps(row) + "\n")
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # Reader went away (e.g. piped into head); stop quietly
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+    return 0 if rows else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+# viewcpm_jobs.py
+import itertools
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+class JobCancelled(Exception):
+    """Raised inside a job once it has been cancelled."""
+
+
+# ----------------------------
+# Jobs
+# ----------------------------
+class Job:
+    """
+    One unit of background work. fn(job) runs on a worker thread and may
+    call job.progress() (or pass job.report as a viewcpm_logic progress
+    callback) to report and to honour cancellation.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, label, fn, key=None, on_done=None):
+        self.id = next(self._ids)
+        self.label = label
+        self.fn = fn
+        self.key = key            # jobs with the same key never run concurrently
+        self.on_done = on_done    # called on the UI thread with the finished job
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        self.done = 0
+        self.total = 0
+        self.bytes = 0
+        self.metrics = None       # latest viewcpm_metrics.Progress reported
+        self._cancel = threading.Event()
+        self._scheduler = None
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise JobCancelled(f"{self.label} cancelled.")
+
+    def progress(self, done, total=None, nbytes=0):
+        """Record done/total items and bytes so far, then check for cancellation."""
+        self.done = done
+        if total is not None:
+            self.total = total
+        self.bytes = nbytes
+        if self._scheduler:
+            self._scheduler.post("progress", self)
+        self.check()
+
+    def report(self, progress):
+        """Callback for viewcpm_logic operations: takes a metrics.Progress."""
+        self.metrics = progress
+        self.done, self.total, self.bytes = progress.files, progress.total_files, progress.bytes
+        if self._scheduler:
+            self._scheduler.post("progress", self)
+        if not progress.finished:
+            self.check()
+
+    def status(self, message):
+        if self._scheduler:
+            self._scheduler.post("status", self, message)
+
+    def describe(self):
+        """Status-bar text for the current progress."""
+        if self.metrics is not None:
+            return self.metrics.describe()
+        text = self.label
+        if self.total:
+            text += f": {self.done}/{self.total}"
+        if self.bytes:
+            text += f" ({self.bytes:,} bytes)"
+        return text
+
+
+# ----------------------------
+# Scheduler
+# ----------------------------
+class JobScheduler:
+    """
+    Bounded thread pool with per-key serialization: jobs sharing a key
+    (e.g. the image path) run one at a time in submission order, other
+    keys run in parallel. A job can hold several keys (a tuple, e.g. a
+    copy between two images); it waits until all of them are free.
+    Workers never touch the UI; they post events to a queue that the UI
+    thread drains (see drain()).
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="viewcpm-job")
+        self._lock = threading.Lock()
+        self._waiting = deque()   # queued jobs, in submission order
+        self._busy = set()        # keys held by a running job
+        self.jobs = {}            # id -> unfinished job
+        self.events = queue.Queue()
+
+    @staticmethod
+    def _keys(job):
+        if job.key is None:
+            return ()
+        return tuple(job.key) if isinstance(job.key, tuple) else (job.key,)
+
+    def submit(self, label, fn, key=None, on_done=None):
+        job = Job(label, fn, key, on_done)
+        job._scheduler = self
+        keys = self._keys(job)
+        with self._lock:
+            self.jobs[job.id] = job
+            queued = {k for waiting in self._waiting for k in self._keys(waiting)}
+            if any(k in self._busy or k in queued for k in keys):
+                self._waiting.append(job)
+                return job
+            self._busy.update(keys)
+        self._executor.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        try:
+            job.check()
+            job.state = "running"
+            self.post("started", job)
+            job.result = job.fn(job)
+            job.state = "done"
+        except JobCancelled:
+            job.state = "cancelled"
+        except Exception as e:
+            job.state = "failed"
+            job.error = e
+        finally:
+            self._finished(job)
+            self.post("finished", job)
+
+    def _finished(self, job):
+        ready = []
+        with self._lock:
+            self.jobs.pop(job.id, None)
+            self._busy.difference_update(self._keys(job))
+            # Start queued jobs whose keys are all free, without passing an
+            # earlier queued job that shares a key with them
+            blocked = set(self._busy)
+            for waiting in list(self._waiting):
+                keys = self._keys(waiting)
+                if not any(k in blocked for k in keys):
+                    self._waiting.remove(waiting)
+                    self._busy.update(keys)
+                    ready.append(waiting)
+                blocked.update(keys)
+        for nxt in ready:
+            self._executor.submit(self._run, nxt)
+
+    def post(self, kind, job, message=None):
+        """Queue an event for drain(). Other producers (e.g. watchers) post with job=None."""
+        self.events.put((kind, job, message))
+
+    def cancel_all(self):
+        with self._lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            job.cancel()
+
+    def pending(self):
+        with self._lock:
+            return len(self.jobs)
+
+    def drain(self, handler, limit=200):
+        """
+        Call handler(kind, job, message) for queued events, at most limit
+        per call. Must be called from the UI thread (e.g. from after()).
+        Finished jobs get their on_done callback here, before the handler.
+        """
+        for _ in range(limit):
+            try:
+                kind, job, message = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "finished" and job.on_done:
+                job.on_done(job)
+            handler(kind, job, message)
+
+    def shutdown(self, wait=False):
+        self.cancel_all()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
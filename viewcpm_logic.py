@@ -1,95 +1,673 @@
 # viewcpm_logic.py
+import asyncio
+import contextlib
 import os
+import hashlib
+import queue
+import signal
 import subprocess
 import shutil
+import tempfile
+import threading
 import viewcpm_prefs as prefs
+import viewcpm_cpmfs as cpmfs
+import viewcpm_detect as detect
+import viewcpm_imd as imd
+import viewcpm_dsk as dsk
+import viewcpm_metrics as metrics
+import viewcpm_fsck as fsck
+import viewcpm_rawstore as rawstore
+from viewcpm_store import ref_key as store_key
+from viewcpm_diskdefs import load_diskdef, get_manager
+
+POLL_INTERVAL = 0.2  # seconds between on_output polls of a quiet command
+CACHE_DIR = "cache"  # content-addressed SAMdisk conversions, inside tmp/
+# How SAMdisk conversions are kept (prefs['raw_storage']): plain files,
+# files with zero filler as sparse holes, or chunk-compressed cache
+# entries opened as lazily decompressed in-memory working copies
+RAW_STORAGE = ("full", "sparse", "compressed")
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_sources = {}  # working RAW path -> image it was converted from
+_dirty = {}    # working RAW path -> DirtySectors changed since load
+_buffers = {}  # in-memory RAW handle ("mem:<image path>") -> bytearray
+_sides = {}    # natively decoded RAW handle -> side order its tracks were laid out in
+_stores = {}   # in-memory RAW handle -> rawstore.CompressedRaw it decompresses from
 
 # ----------------------------
 # Utilities
 # ----------------------------
-def run_command(cmd, use_diskdefs=False, prefs=None):
+def run_command(cmd, use_diskdefs=False, prefs=None, on_output=None):
     """
     Run shell command and return (success, output).
 
     Parameters:
         cmd (str): Command to run.
-        cwd (str|None): Optional working directory.
         use_diskdefs (bool): If True, set CPMTOOLS to prefs['diskdefs_path'].
         prefs (dict|None): Preferences dict containing diskdefs_path.
+        on_output (callable|None): Called with each line of stdout/stderr as
+            it arrives, and with None every POLL_INTERVAL while the command
+            is quiet. If it raises (e.g. the job was cancelled) the command
+            is killed and the exception propagates.
+    """
+    env = os.environ.copy()
+    if use_diskdefs and prefs:
+        env['CPMTOOLS'] = prefs
+
+    if use_diskdefs:
+        cwd = os.path.dirname(prefs)  # get directory
+    else:
+        cwd = None
+
+    proc = subprocess.Popen(
+        cmd,
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        cwd=cwd,
+        env=env,
+        start_new_session=(os.name == "posix"),
+    )
+    lines = queue.Queue()
+    stdout, stderr = [], []
+
+    def pump(stream, sink):
+        # Universal newlines: SAMdisk-style "\r" progress updates arrive as lines too
+        for line in iter(stream.readline, ""):
+            sink.append(line)
+            lines.put(line)
+        stream.close()
+
+    pumps = [threading.Thread(target=pump, args=(proc.stdout, stdout), daemon=True),
+             threading.Thread(target=pump, args=(proc.stderr, stderr), daemon=True)]
+    for t in pumps:
+        t.start()
+    try:
+        while True:
+            try:
+                line = lines.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                line = None
+            if on_output:
+                on_output(line)
+            if line is None and proc.poll() is not None and not any(t.is_alive() for t in pumps) and lines.empty():
+                break
+    except BaseException:
+        _kill(proc)
+        raise
+    for t in pumps:
+        t.join()
+    if proc.wait() == 0:
+        return True, "".join(stdout)
+    return False, "".join(stderr)
+
+def _kill(proc, wait=True):
+    """Stop a shell=True command, including the tool it started."""
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except OSError:
+        pass
+    if wait:
+        proc.wait()
+
+async def run_command_async(cmd, on_output=None):
+    """
+    run_command as a coroutine on an asyncio subprocess: returns
+    (success, output), calling on_output with each line as it arrives.
+    Cancelling the task kills the command.
     """
+    proc = await asyncio.create_subprocess_shell(
+        cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=(os.name == "posix"),
+    )
+    stdout, stderr = [], []
+
+    async def pump(stream, sink):
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            text = line.decode(errors="replace")
+            sink.append(text)
+            if on_output:
+                # SAMdisk-style "\r" progress updates count as lines too
+                for part in text.split("\r"):
+                    on_output(part)
+
     try:
-        env = os.environ.copy()
-        if use_diskdefs and prefs:
-            env['CPMTOOLS'] = prefs
-            
-        if use_diskdefs:
-            cwd = os.path.dirname(prefs)  # get directory
+        await asyncio.gather(pump(proc.stdout, stdout), pump(proc.stderr, stderr))
+        returncode = await proc.wait()
+    except BaseException:
+        _kill(proc, wait=False)   # asyncio reaps the process
+        raise
+    if returncode == 0:
+        return True, "".join(stdout)
+    return False, "".join(stderr)
+
+def image_hash(path, chunk_size=1 << 20):
+    """
+    Fast content hash (BLAKE2b, 128-bit) of a file, as hex. In-memory RAW
+    handles hash their source image while they match it, so lazily
+    decoded buffers stay lazy; once edited, the buffer itself is hashed.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    buffer = _buffers.get(path)
+    if buffer is not None:
+        if not is_dirty(path):
+            path = _sources[path]
         else:
-            cwd = None
-
-        result = subprocess.run(
-            cmd,
-            shell=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            cwd=cwd,
-            env=env
-        )
-        return True, result.stdout
-    except subprocess.CalledProcessError as e:
-        return False, e.stderr
+            if isinstance(buffer, cpmfs.LazyBuffer):
+                buffer.ensure_all()
+            h.update(buffer)
+            return h.hexdigest()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
 
 def get_tmp_folder():
     """Return path to tmp folder, create if missing."""
     tmp_dir = os.path.join(os.getcwd(), "tmp")
     os.makedirs(tmp_dir, exist_ok=True)
-    cleanup_tmp(tmp_dir)
     return tmp_dir
 
-def cleanup_tmp(tmp_dir):
-    """Delete oldest files if more than prefs['max_tmp_files'] exist."""
-    max_files = prefs.get_pref("max_tmp_files", 20)
-    files = [os.path.join(tmp_dir, f) for f in os.listdir(tmp_dir) if os.path.isfile(os.path.join(tmp_dir, f))]
-    if len(files) <= max_files:
+def open_raw_files():
+    """Files on disk that open working RAWs depend on."""
+    return ([path for path in list(_sources) if not path.startswith("mem:")]
+            + [store.path for store in list(_stores.values())])
+
+def cleanup_tmp(tmp_dir, keep=()):
+    """
+    Evict least recently used files (tmp and its conversion cache) until the
+    total is within prefs['max_tmp_mb']. Paths in keep and the working RAWs
+    of every open image are never evicted.
+    """
+    max_bytes = prefs.get_pref("max_tmp_mb", 256) * 1024 * 1024
+    entries = []
+    total = 0
+    for folder in (tmp_dir, os.path.join(tmp_dir, CACHE_DIR)):
+        if not os.path.isdir(folder):
+            continue
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.is_file():
+                    st = entry.stat()
+                    size = rawstore.disk_usage(st)
+                    entries.append((st.st_mtime, size, entry.path))
+                    total += size
+    if total <= max_bytes:
         return
-    # sort by modification time
-    files.sort(key=os.path.getmtime)
-    for f in files[:len(files)-max_files]:
-        os.remove(f)
+    keep = {os.path.abspath(p) for p in (*keep, *open_raw_files())}
+    entries.sort()  # oldest (least recently used) first
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        _cache_stats["evictions"] += 1
 
 # ----------------------------
 # Conversion
 # ----------------------------
 
-def convert_dsk_to_raw(samdisk_path, image_path):
+def samdisk_version(samdisk_path):
+    """Cheap SAMdisk version fingerprint (binary size + mtime), no process launch."""
+    st = os.stat(samdisk_path)
+    return f"{st.st_size}-{st.st_mtime_ns}"
+
+def conversion_key(samdisk_path, image_path, options=()):
+    """Cache key: source content hash + SAMdisk version + conversion options."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(image_hash(image_path).encode())
+    h.update(samdisk_version(samdisk_path).encode())
+    h.update(repr(tuple(options)).encode())
+    return h.hexdigest()
+
+def conversion_cache_stats():
+    """Hit/miss/eviction counters plus the current size of the conversion cache."""
+    stats = dict(_cache_stats)
+    cache_dir = os.path.join(get_tmp_folder(), CACHE_DIR)
+    files = [e for e in os.scandir(cache_dir) if e.is_file()] if os.path.isdir(cache_dir) else []
+    stats["files"] = len(files)
+    stats["bytes"] = sum(rawstore.disk_usage(e.stat()) for e in files)
+    return stats
+
+def imd_to_raw(image_path, sides="alt"):
+    return imd.read_imd(image_path).to_raw(sides)
+
+def dsk_to_raw(image_path, sides="alt"):
+    return dsk.DskImage(image_path, sides).lazy_raw()
+
+# Container extension -> reader(image_path, sides) returning a RAW bytearray
+NATIVE_READERS = {
+    ".imd": imd_to_raw,
+    ".dsk": dsk_to_raw,
+}
+
+def load_native(image_path, reader, sides=None):
     """
-    Convert a .DSK/.IMD file to RAW in tmp folder.
-    Returns path to RAW file.
+    Decode image_path in-process into an in-memory RAW, its tracks in the
+    diskdef side order sides ("alt" when None); returns its handle.
     """
+    sides = sides or "alt"
+    try:
+        buffer = reader(image_path, sides)
+    except (imd.ImdError, dsk.DskError) as e:
+        raise RuntimeError(f"Could not read {os.path.basename(image_path)}:\n{e}")
+    raw_path = "mem:" + os.path.abspath(image_path)
+    _buffers[raw_path] = buffer
+    _sources[raw_path] = os.path.abspath(image_path)
+    _sides[raw_path] = sides
+    _dirty.pop(raw_path, None)
+    return raw_path
+
+def match_sides(raw_path, sides):
+    """
+    Lay a natively decoded RAW out again in side order sides if it was
+    decoded in another one (its format was not known yet). Edited copies
+    are left alone.
+    """
+    sides = sides or "alt"
+    current = _sides.get(raw_path)
+    if current is None or current == sides or is_dirty(raw_path):
+        return
+    image_path = _sources[raw_path]
+    load_native(image_path, NATIVE_READERS[os.path.splitext(image_path)[1].lower()], sides)
+
+def diskdef_sides(disk_format, diskdefs_path=None):
+    """Side order of a diskdef by name, or None if it has none (or is unknown)."""
+    if not disk_format:
+        return None
+    diskdef = load_diskdef(diskdefs_path or prefs.get_pref("diskdefs_path"), disk_format)
+    return diskdef.sides if diskdef else None
+
+def convert_dsk_to_raw(samdisk_path, image_path, tmp_dir=None, options=(), progress=None, sides=None):
+    """
+    Convert a .DSK/.IMD file to RAW in tmp folder (or tmp_dir if given).
+    Formats with a native reader are decoded in memory instead, with no
+    subprocess or temp file, their tracks in the diskdef side order sides. SAMdisk conversions are cached by content, so
+    an identical image is only converted once; callers get their own
+    working copy to modify. progress(metrics.Progress) is called as the
+    conversion runs (SAMdisk output is shown as it arrives).
+    Returns path (or in-memory handle) of the RAW image.
+    """
+    with metrics.operation(f"Converting {os.path.basename(image_path)}",
+                           total_bytes=os.path.getsize(image_path), callback=progress) as p:
+        with p.stage("convert"):
+            raw_path = _convert(samdisk_path, image_path, tmp_dir, options, p, sides)
+        p.advance(p.total_bytes, files=1, stage="convert")
+    return raw_path
+
+def _convert(samdisk_path, image_path, tmp_dir, options, p, sides=None):
+    raw_path, pending = _prepare_conversion(samdisk_path, image_path, tmp_dir, options, p, sides)
+    if pending:
+        success, output = run_command(pending["cmd"], on_output=p.set_note)
+        raw_path = _finish_conversion(pending, success, output)
+    return raw_path
+
+def _prepare_conversion(samdisk_path, image_path, tmp_dir, options, p, sides=None):
+    """
+    Everything up to the SAMdisk run. Returns (raw_path, None) when the
+    image was decoded natively or found in the cache, else (None, pending)
+    where pending["cmd"] is the command to run before _finish_conversion.
+    """
+    reader = NATIVE_READERS.get(os.path.splitext(image_path)[1].lower())
+    if reader:
+        return load_native(image_path, reader, sides), None
+
     if not samdisk_path or not os.path.isfile(samdisk_path):
         raise FileNotFoundError("SAMdisk executable not found.")
 
-    tmp_dir = get_tmp_folder()
-    raw_filename = os.path.splitext(os.path.basename(image_path))[0] + ".RAW"
+    cache_root = get_tmp_folder()
+    cache_dir = os.path.join(cache_root, CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    key = conversion_key(samdisk_path, image_path, options)
+    storage = raw_storage()
+    cached_path = os.path.join(cache_dir, key + (".RAWZ" if storage == "compressed" else ".RAW"))
+
+    tmp_dir = tmp_dir or cache_root
+    raw_filename = f"{os.path.splitext(os.path.basename(image_path))[0]}-{key[:8]}.RAW"
     raw_path = os.path.join(tmp_dir, raw_filename)
+    pending = {"image_path": image_path, "cache_root": cache_root, "cached_path": cached_path,
+               "raw_path": raw_path, "storage": storage}
 
-    cmd = f'"{samdisk_path}" "{image_path}" "{raw_path}"'
-    success, output = run_command(cmd)
+    try:
+        _working_copy(pending)
+        os.utime(cached_path)  # mark as recently used
+        _cache_stats["hits"] += 1
+        p.set_note("cached")
+        return _register_conversion(pending), None
+    except (FileNotFoundError, rawstore.RawStoreError):
+        _cache_stats["misses"] += 1
+    # SAMdisk picks the output type from the extension, so keep .RAW
+    # (pid and thread id keep concurrent conversions of one image apart)
+    part_path = os.path.join(cache_dir, f"{key}.{os.getpid()}-{threading.get_ident()}.part.RAW")
+    pending["part_path"] = part_path
+    pending["cmd"] = f'"{samdisk_path}" "{image_path}" "{part_path}"'
+    return None, pending
+
+def _finish_conversion(pending, success, output):
+    part_path = pending["part_path"]
     if not success:
+        if os.path.exists(part_path):
+            os.remove(part_path)
         raise RuntimeError(f"SAMdisk conversion failed:\n{output}")
+    if pending["storage"] == "full":
+        os.replace(part_path, pending["cached_path"])
+    else:
+        packed_path = part_path + ".pack"
+        pack = rawstore.compress_file if pending["storage"] == "compressed" else rawstore.sparse_copy
+        try:
+            pack(part_path, packed_path)
+            os.replace(packed_path, pending["cached_path"])
+        finally:
+            for path in (part_path, packed_path):
+                if os.path.exists(path):
+                    os.remove(path)
+    _working_copy(pending)
+    return _register_conversion(pending)
+
+def raw_storage():
+    storage = prefs.get_pref("raw_storage", "sparse")
+    return storage if storage in RAW_STORAGE else "sparse"
+
+def _working_copy(pending):
+    """
+    Give the caller a working copy of the cache entry: a plain or sparse
+    copy in tmp/, or for compressed entries an in-memory RAW that only
+    decompresses the chunks that are used.
+    """
+    cached_path = pending["cached_path"]
+    if pending["storage"] == "compressed":
+        raw_path = "mem:" + os.path.abspath(pending["image_path"])
+        store = rawstore.CompressedRaw(cached_path)
+        _close_store(raw_path)
+        _stores[raw_path] = store
+        _buffers[raw_path] = store.lazy_buffer()
+        pending["raw_path"] = raw_path
+    elif pending["storage"] == "sparse":
+        rawstore.sparse_copy(cached_path, pending["raw_path"])
+    else:
+        shutil.copyfile(cached_path, pending["raw_path"])
+
+def _register_conversion(pending):
+    raw_path = pending["raw_path"]
+    cleanup_tmp(pending["cache_root"], keep=(pending["cached_path"], raw_path))
+    _sources[raw_path] = os.path.abspath(pending["image_path"])
+    _dirty.pop(raw_path, None)
+    return raw_path
+
+async def convert_dsk_to_raw_async(samdisk_path, image_path, tmp_dir=None, options=(), progress=None,
+                                   limit=None, sides=None):
+    """
+    convert_dsk_to_raw for asyncio: hashing, cache copies and native
+    decoding run in the default executor, and SAMdisk runs as an asyncio
+    subprocess, holding limit (an asyncio.Semaphore) while it runs.
+    """
+    loop = asyncio.get_running_loop()
+    with metrics.operation(f"Converting {os.path.basename(image_path)}",
+                           total_bytes=os.path.getsize(image_path), callback=progress) as p:
+        with p.stage("convert"):
+            raw_path, pending = await loop.run_in_executor(
+                None, _prepare_conversion, samdisk_path, image_path, tmp_dir, options, p, sides)
+            if pending:
+                try:
+                    async with limit or contextlib.nullcontext():
+                        success, output = await run_command_async(pending["cmd"], on_output=p.set_note)
+                except BaseException:
+                    if os.path.exists(pending["part_path"]):
+                        os.remove(pending["part_path"])
+                    raise
+                raw_path = await loop.run_in_executor(None, _finish_conversion, pending, success, output)
+        p.advance(p.total_bytes, files=1, stage="convert")
     return raw_path
 
+def raw_size(raw_path):
+    buffer = _buffers.get(raw_path)
+    return len(buffer) if buffer is not None else os.path.getsize(raw_path)
+
+def raw_file(raw_path):
+    """
+    Real file for raw_path. In-memory images are written to tmp/ so the
+    cpmtools binaries can operate on them.
+    """
+    buffer = _buffers.get(raw_path)
+    if buffer is None:
+        return raw_path
+    if isinstance(buffer, cpmfs.LazyBuffer):
+        buffer.ensure_all()
+    name = hashlib.blake2b(raw_path.encode(), digest_size=8).hexdigest() + ".RAW"
+    path = os.path.join(get_tmp_folder(), name)
+    with open(path, "wb") as f:
+        f.write(buffer)
+    return path
+
+def reload_raw_file(raw_path, file_path):
+    """Pick up changes cpmtools made to the tmp/ copy of an in-memory image."""
+    if raw_path in _buffers and file_path != raw_path:
+        with open(file_path, "rb") as f:
+            _buffers[raw_path][:] = f.read()
+
+def _close_store(raw_path):
+    store = _stores.pop(raw_path, None)
+    if store is not None:
+        store.close()
+
+def release_raw(raw_path):
+    """Forget a working RAW (drops in-memory buffers and dirty state)."""
+    _close_store(raw_path)
+    _buffers.pop(raw_path, None)
+    _sources.pop(raw_path, None)
+    _sides.pop(raw_path, None)
+    _dirty.pop(raw_path, None)
+
+# ----------------------------
+# Write-back
+# ----------------------------
+
+def record_dirty(raw_path, dirty):
+    """Merge sectors changed by one operation into the RAW file's dirty map."""
+    if not dirty.count():
+        return
+    current = _dirty.get(raw_path)
+    if current is None or len(current.flags) != len(dirty.flags) or current.seclen != dirty.seclen:
+        if current is not None:
+            # Mixed geometries (e.g. cpmtools fallback): rewrite everything
+            dirty = cpmfs.DirtySectors.whole_file(raw_size(raw_path))
+        _dirty[raw_path] = dirty
+    else:
+        current.merge(dirty)
+
+def is_dirty(raw_path):
+    dirty = _dirty.get(raw_path)
+    return bool(dirty and dirty.count())
+
+def source_image(raw_path):
+    """Original image a working RAW was converted from, or None."""
+    return _sources.get(raw_path)
+
+def patch_raw_container(samdisk_path, raw_path, image_path, out_path, dirty):
+    """
+    Plain RAW images (.img/.raw): copy the original and overwrite only the
+    dirty sectors. Falls back to a full copy if the sizes differ.
+    """
+    if os.path.getsize(image_path) != raw_size(raw_path):
+        shutil.copyfile(raw_file(raw_path), out_path)
+        return
+    shutil.copyfile(image_path, out_path)
+    buffer = _buffers.get(raw_path)
+    src = open(raw_path, "rb") if buffer is None else None
+    try:
+        with open(out_path, "r+b") as dst:
+            for offset, length in dirty.byte_ranges():
+                if src is not None:
+                    src.seek(offset)
+                    data = src.read(length)
+                else:
+                    if isinstance(buffer, cpmfs.LazyBuffer):
+                        buffer.ensure(offset, length)
+                    data = buffer[offset:offset + length]
+                dst.seek(offset)
+                dst.write(data)
+    finally:
+        if src is not None:
+            src.close()
+
+def write_with_samdisk(samdisk_path, raw_path, image_path, out_path, dirty):
+    """Rebuild the whole container from RAW with SAMdisk (format from out_path's extension)."""
+    if not samdisk_path or not os.path.isfile(samdisk_path):
+        raise FileNotFoundError("SAMdisk executable not found.")
+    cmd = f'"{samdisk_path}" "{raw_file(raw_path)}" "{out_path}"'
+    success, output = run_command(cmd)
+    if not success:
+        raise RuntimeError(f"SAMdisk write-back failed:\n{output}")
+
+def write_imd_container(samdisk_path, raw_path, image_path, out_path, dirty):
+    """
+    Native IMD write-back: re-encode only the tracks holding dirty sectors,
+    copying every other track record from the original file unchanged.
+    """
+    container = imd.read_imd(image_path)
+    buffer = _buffers.get(raw_path)
+    if buffer is None:
+        with open(raw_path, "rb") as f:
+            buffer = f.read()
+    sides = _sides.get(raw_path, "alt")
+    tracks = container.tracks_in_ranges(dirty.byte_ranges(), sides)
+    changed = container.update_from_raw(buffer, tracks=tracks, sides=sides)
+    imd.write_imd(container, out_path, source_path=image_path, changed=changed)
+
+def write_dsk_container(samdisk_path, raw_path, image_path, out_path, dirty):
+    """Native DSK write-back: patch the sector data of dirty tracks in a copy of the original."""
+    buffer = _buffers.get(raw_path)
+    if buffer is None:
+        with open(raw_path, "rb") as f:
+            buffer = f.read()
+    dsk.patch_dsk(dsk.DskImage(image_path, _sides.get(raw_path, "alt")), buffer, dirty.byte_ranges(), out_path)
+
+# Container extension -> writer(samdisk_path, raw_path, image_path, out_path, dirty)
+CONTAINER_WRITERS = {
+    ".img": patch_raw_container,
+    ".raw": patch_raw_container,
+    ".imd": write_imd_container,
+    ".dsk": write_dsk_container,
+}
+
+def commit_image(samdisk_path, raw_path, image_path=None, progress=None):
+    """
+    Write the working RAW back to the image it was converted from.
+    The new container is written to a temp file beside the original and
+    renamed over it, so a failed commit leaves the original untouched.
+    Returns the number of changed sectors written (0 if nothing changed).
+    """
+    image_path = image_path or _sources.get(raw_path)
+    if not image_path:
+        raise RuntimeError("No source image known for this RAW file.")
+    dirty = _dirty.get(raw_path)
+    if dirty is None or not dirty.count():
+        return 0
+
+    root, ext = os.path.splitext(image_path)
+    writer = CONTAINER_WRITERS.get(ext.lower(), write_with_samdisk)
+    # Keep the extension: SAMdisk chooses the output format from it
+    tmp_path = f"{root}.{os.getpid()}.saving{ext}"
+    with metrics.operation(f"Saving {os.path.basename(image_path)}",
+                           total_bytes=dirty.count() * dirty.seclen, callback=progress) as p:
+        try:
+            with p.stage("write"):
+                writer(samdisk_path, raw_path, image_path, tmp_path, dirty)
+                shutil.copymode(image_path, tmp_path)
+                os.replace(tmp_path, image_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        p.advance(p.total_bytes, files=1, stage="write")
+    count = dirty.count()
+    dirty.clear()
+    return count
+
+# ----------------------------
+# Native CP/M engine
+# ----------------------------
+
+def open_native_image(raw_path, disk_format, writable=False, diskdefs_path=None):
+    """
+    Open raw_path with the in-process CP/M engine.
+    diskdefs_path overrides prefs['diskdefs_path']. A natively decoded
+    RAW is first laid out in the diskdef's side order (match_sides).
+    Returns a CpmImage, or None when the diskdef is unknown so callers
+    fall back to the cpmtools binaries.
+    """
+    if not disk_format:
+        return None
+    diskdef = load_diskdef(diskdefs_path or prefs.get_pref("diskdefs_path"), disk_format)
+    if diskdef is None:
+        return None
+    match_sides(raw_path, diskdef.sides)
+    try:
+        return cpmfs.CpmImage(raw_path, diskdef, writable=writable, buffer=_buffers.get(raw_path))
+    except (cpmfs.CpmFsError, OSError):
+        return None
+
+def detect_disk_format(raw_path, limit=5, diskdefs_path=None):
+    """
+    Rank diskdefs by how well they fit the RAW image.
+    Returns [(format_name, score), ...] best first; empty if no diskdefs.
+    """
+    manager = get_manager(diskdefs_path or prefs.get_pref("diskdefs_path"))
+    if manager is None:
+        return []
+    return detect.detect_formats(raw_path, manager, limit=limit, image_hash=image_hash(raw_path),
+                                 buffer=_buffers.get(raw_path))
+
+def display_name(cpm_file):
+    """Name as shown in the image list (cpmls style, user prefix if not 0)."""
+    name = cpm_file.filename.lower()
+    return f"{cpm_file.user}:{name}" if cpm_file.user else name
+
 # ----------------------------
 # CP/M Image Operations
 # ----------------------------
 
-def list_image_files(cpmtools_path, raw_path, disk_format="kpii"):
+def scan_image(raw_path, disk_format, diskdefs_path=None, progress=None):
+    """
+    One pass over the directory: returns a cpmfs.DirectoryScan with every
+    file (user, name, ext, attributes, records, blocks, size) and the
+    allocation map, or None when the native engine cannot read the image.
+    """
+    with metrics.operation("Scan", callback=progress) as p:
+        with p.stage("scan"):
+            image = open_native_image(raw_path, disk_format, diskdefs_path=diskdefs_path)
+            if image is None:
+                return None
+            with image:
+                scan = image.scan()
+        p.advance(files=len(scan.files))
+    return scan
+
+def list_image_files(cpmtools_path, raw_path, disk_format="kpii", diskdefs_path=None):
     """
     Use cpmls -l -f disk_format to list files in RAW image.
     Returns list of (filename, size) tuples.
     """
+    scan = scan_image(raw_path, disk_format, diskdefs_path)
+    if scan is not None:
+        return [(display_name(f), f"{f.size:,}") for f in scan.files]
+
     if not cpmtools_path or not os.path.isdir(cpmtools_path):
         raise FileNotFoundError("CP/M tools directory not found.")
 
@@ -97,8 +675,8 @@ def list_image_files(cpmtools_path, raw_path, disk_format="kpii"):
     if not os.path.isfile(cpmls):
         raise FileNotFoundError(f"cpmls not found in {cpmtools_path}")
 
-    cmd = f'"{cpmls}" -f {disk_format} -l "{raw_path}"'
-    success, output = run_command(cmd, True, prefs.get_pref("diskdefs_path"))
+    cmd = f'"{cpmls}" -f {disk_format} -l "{raw_file(raw_path)}"'
+    success, output = run_command(cmd, True, diskdefs_path or prefs.get_pref("diskdefs_path"))
     files = []
     if success:
         for line in output.splitlines():
@@ -117,48 +695,349 @@ def list_image_files(cpmtools_path, raw_path, disk_format="kpii"):
             files.append((filename, f"{size:,}"))  # format with commas
     return files
 
-def insert_file(cpmtools_path, raw_path, filename):
+def format_option(disk_format):
+    """cpmtools -f argument, empty when no format is known."""
+    return f"-f {disk_format} " if disk_format else ""
+
+def insert_file(cpmtools_path, raw_path, filename, disk_format=None, diskdefs_path=None):
     """
-    Insert file from host folder into RAW image using cpmtools.
-    Assumes current directory contains the source file.
+    Insert file from host folder into RAW image.
+    filename is the host path; the CP/M name is its basename.
     """
+    image = open_native_image(raw_path, disk_format, writable=True, diskdefs_path=diskdefs_path)
+    if image is not None:
+        with image:
+            with open(filename, "rb") as f:
+                data = f.read()
+            try:
+                image.write_file(os.path.basename(filename), data)
+            except cpmfs.CpmFsError as e:
+                raise RuntimeError(f"Insert failed:\n{e}")
+            finally:
+                record_dirty(raw_path, image.dirty)
+        return
+
     cpmcp = os.path.join(cpmtools_path, "cpmcp")
     if not os.path.isfile(cpmcp):
         raise FileNotFoundError(f"cpmcp not found in {cpmtools_path}")
-    cmd = f'"{cpmcp}" "{filename}" "{raw_path}"'
+    file_path = raw_file(raw_path)
+    cmd = f'"{cpmcp}" {format_option(disk_format)}"{file_path}" "{filename}" 0:'
     success, output = run_command(cmd)
+    reload_raw_file(raw_path, file_path)
+    record_dirty(raw_path, cpmfs.DirtySectors.whole_file(raw_size(raw_path)))
     if not success:
         raise RuntimeError(f"Insert failed:\n{output}")
 
-def extract_file(cpmtools_path, raw_path, filename, dest_folder):
+def cpm_path(filename):
+    """cpmtools image path for a listed name ("pip.com" -> "0:pip.com")."""
+    return filename if ":" in filename else f"0:{filename}"
+
+def host_name(filename):
+    """Host filename for a listed name, without any user prefix."""
+    return filename.split(":", 1)[-1]
+
+def extract_file(cpmtools_path, raw_path, filename, dest_folder, disk_format=None, diskdefs_path=None):
     """
-    Extract file from RAW image to dest_folder.
+    Extract file from RAW image to dest_folder. The name is looked up
+    before the host file is created, so a missing one leaves it untouched.
     """
+    dest_path = os.path.join(dest_folder, host_name(filename))
+    image = open_native_image(raw_path, disk_format, diskdefs_path=diskdefs_path)
+    if image is not None:
+        with image:
+            try:
+                chunks = image.iter_file(filename)
+                with open(dest_path, "wb") as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+            except cpmfs.CpmFsError as e:
+                raise RuntimeError(f"Extract failed:\n{e}")
+        return
+
     cpmcp = os.path.join(cpmtools_path, "cpmcp")
     if not os.path.isfile(cpmcp):
         raise FileNotFoundError(f"cpmcp not found in {cpmtools_path}")
-    dest_path = os.path.join(dest_folder, filename)
-    cmd = f'"{cpmcp}" "{raw_path}" "{dest_path}"'
+    cmd = f'"{cpmcp}" {format_option(disk_format)}"{raw_file(raw_path)}" "{cpm_path(filename)}" "{dest_path}"'
     success, output = run_command(cmd)
     if not success:
         raise RuntimeError(f"Extract failed:\n{output}")
 
-def delete_file(cpmtools_path, raw_path, filename):
+def delete_file(cpmtools_path, raw_path, filename, disk_format=None, diskdefs_path=None):
     """
-    Delete file from RAW image using cpmtools.
+    Delete file from RAW image.
     """
+    image = open_native_image(raw_path, disk_format, writable=True, diskdefs_path=diskdefs_path)
+    if image is not None:
+        with image:
+            try:
+                image.delete_file(filename)
+            except cpmfs.CpmFsError as e:
+                raise RuntimeError(f"Delete failed:\n{e}")
+            finally:
+                record_dirty(raw_path, image.dirty)
+        return
+
     cpmrm = os.path.join(cpmtools_path, "cpmrm")
     if not os.path.isfile(cpmrm):
         raise FileNotFoundError(f"cpmrm not found in {cpmtools_path}")
-    cmd = f'"{cpmrm}" "{raw_path}" "{filename}"'
+    file_path = raw_file(raw_path)
+    cmd = f'"{cpmrm}" {format_option(disk_format)}"{file_path}" "{cpm_path(filename)}"'
     success, output = run_command(cmd)
+    reload_raw_file(raw_path, file_path)
+    record_dirty(raw_path, cpmfs.DirtySectors.whole_file(raw_size(raw_path)))
     if not success:
         raise RuntimeError(f"Delete failed:\n{output}")
     
-def get_disk_info(cpmtools_path, raw_path, disk_format="kpii"):
+# ----------------------------
+# Batched operations
+# ----------------------------
+
+def _run_batch(raw_path, cmd, label, on_output=None):
+    """
+    Run one cpmtools command over a batch. For a RAW file on disk, a copy
+    is restored if the command fails, so the batch is all-or-nothing.
+    """
+    file_path = raw_file(raw_path)
+    backup = None
+    if file_path == raw_path:
+        backup = raw_path + ".bak"
+        shutil.copyfile(raw_path, backup)
+    try:
+        success, output = run_command(cmd, on_output=on_output)
+        if not success:
+            if backup:
+                shutil.copyfile(backup, raw_path)
+            raise RuntimeError(f"{label} failed:\n{output}")
+        reload_raw_file(raw_path, file_path)
+        record_dirty(raw_path, cpmfs.DirtySectors.whole_file(raw_size(raw_path)))
+    finally:
+        if backup:
+            os.remove(backup)
+
+def insert_files(cpmtools_path, raw_path, filenames, disk_format=None, diskdefs_path=None, progress=None):
+    """
+    Insert several host files in one transaction: the image is opened and
+    its directory read once, and nothing is written unless every file fits.
+    progress(metrics.Progress) is called as files are added; an exception
+    raised from it (e.g. cancellation) rolls the batch back.
+    """
+    if not filenames:
+        return
+    total = sum(os.path.getsize(f) for f in filenames)
+    with metrics.operation("Insert", len(filenames), total, callback=progress) as p:
+        image = open_native_image(raw_path, disk_format, writable=True, diskdefs_path=diskdefs_path)
+        if image is not None:
+            with image:
+                image.begin()
+                try:
+                    for filename in filenames:
+                        with p.stage("read"), open(filename, "rb") as f:
+                            data = f.read()
+                        with p.stage("write"):
+                            image.write_file(os.path.basename(filename), data)
+                        p.advance(len(data), files=1, stage="write")
+                    with p.stage("write"):
+                        image.commit()
+                except cpmfs.CpmFsError as e:
+                    image.rollback()
+                    raise RuntimeError(f"Insert failed (nothing written):\n{e}")
+                except BaseException:
+                    image.rollback()
+                    raise
+                finally:
+                    record_dirty(raw_path, image.dirty)
+            return
+
+        cpmcp = os.path.join(cpmtools_path, "cpmcp")
+        if not os.path.isfile(cpmcp):
+            raise FileNotFoundError(f"cpmcp not found in {cpmtools_path}")
+        sources = " ".join(f'"{f}"' for f in filenames)
+        cmd = f'"{cpmcp}" {format_option(disk_format)}"{raw_file(raw_path)}" {sources} 0:'
+        with p.stage("write"):
+            _run_batch(raw_path, cmd, "Insert", on_output=p.set_note)
+        p.advance(total, files=len(filenames), stage="write")
+
+def extract_files(cpmtools_path, raw_path, filenames, dest_folder, disk_format=None, diskdefs_path=None,
+                  progress=None, store=None):
+    """
+    Extract several files with one open of the image. Every name is looked
+    up before anything is written to dest_folder.
+    With a viewcpm_store.ContentStore, files go through the store and are
+    linked into dest_folder; files already extracted from this image
+    before are linked without being read again.
+    """
+    if not filenames:
+        return
+    with metrics.operation("Extract", len(filenames), callback=progress) as p:
+        image = open_native_image(raw_path, disk_format, diskdefs_path=diskdefs_path)
+        if image is not None:
+            source = image_hash(raw_path) if store is not None else None
+            with image:
+                try:
+                    # iter_file raises for a missing name before any file is created
+                    sources = [(image.iter_file(filename), filename) for filename in filenames]
+                    p.total_bytes = sum(image.find(filename).size for filename in filenames)
+
+                    def counted(chunks):
+                        while True:
+                            with p.stage("read"):
+                                chunk = next(chunks, None)
+                            if chunk is None:
+                                return
+                            yield chunk
+                            p.advance(len(chunk), stage="read")
+
+                    for chunks, filename in sources:
+                        dest_path = os.path.join(dest_folder, host_name(filename))
+                        if store is not None:
+                            with p.stage("store"):
+                                store.checkout(store_key(source, filename), counted(chunks),
+                                               image.find(filename).size, dest_path)
+                        else:
+                            with open(dest_path, "wb") as out:
+                                for chunk in counted(chunks):
+                                    with p.stage("write"):
+                                        out.write(chunk)
+                        p.advance(files=1)
+                except cpmfs.CpmFsError as e:
+                    raise RuntimeError(f"Extract failed:\n{e}")
+            if store is not None:
+                p.set_note(store.describe())
+            return
+
+        cpmcp = os.path.join(cpmtools_path, "cpmcp")
+        if not os.path.isfile(cpmcp):
+            raise FileNotFoundError(f"cpmcp not found in {cpmtools_path}")
+        sources = " ".join(f'"{cpm_path(f)}"' for f in filenames)
+        cmd = f'"{cpmcp}" {format_option(disk_format)}"{raw_file(raw_path)}" {sources} "{dest_folder}"'
+        with p.stage("read"):
+            success, output = run_command(cmd, on_output=p.set_note)
+        if not success:
+            raise RuntimeError(f"Extract failed:\n{output}")
+        if store is not None:
+            source = image_hash(raw_path)
+            with p.stage("store"):
+                for filename in filenames:
+                    store.adopt(os.path.join(dest_folder, host_name(filename)), store_key(source, filename))
+        p.advance(files=len(filenames))
+
+def delete_files(cpmtools_path, raw_path, filenames, disk_format=None, diskdefs_path=None, progress=None):
+    """Delete several files in one transaction (all or nothing)."""
+    if not filenames:
+        return
+    with metrics.operation("Delete", len(filenames), callback=progress) as p:
+        image = open_native_image(raw_path, disk_format, writable=True, diskdefs_path=diskdefs_path)
+        if image is not None:
+            with image:
+                try:
+                    with p.stage("write"), image.transaction():
+                        for filename in filenames:
+                            image.delete_file(filename)
+                            p.advance(files=1)
+                except cpmfs.CpmFsError as e:
+                    raise RuntimeError(f"Delete failed (nothing deleted):\n{e}")
+                finally:
+                    record_dirty(raw_path, image.dirty)
+            return
+
+        cpmrm = os.path.join(cpmtools_path, "cpmrm")
+        if not os.path.isfile(cpmrm):
+            raise FileNotFoundError(f"cpmrm not found in {cpmtools_path}")
+        names = " ".join(f'"{cpm_path(f)}"' for f in filenames)
+        cmd = f'"{cpmrm}" {format_option(disk_format)}"{raw_file(raw_path)}" {names}'
+        with p.stage("write"):
+            _run_batch(raw_path, cmd, "Delete", on_output=p.set_note)
+        p.advance(files=len(filenames))
+
+def copy_files(cpmtools_path, src_raw, src_format, dst_raw, dst_format, filenames, move=False,
+               diskdefs_path=None, progress=None):
     """
-    Returns (disk_size_bytes, free_bytes) of RAW image using cpmls -s or cpmtools.
+    Copy (or move) files from one RAW image to another without going
+    through the host filesystem. Each file is streamed block by block into
+    blocks allocated on the destination, which may have a different
+    geometry; user numbers are kept. Space for the whole batch is checked
+    before anything is written, and the batch is one transaction on each
+    image, so a failure leaves both images untouched.
     """
+    if not filenames:
+        return
+    if os.path.abspath(src_raw) == os.path.abspath(dst_raw):
+        raise RuntimeError("Source and destination are the same image.")
+    label = "Move" if move else "Copy"
+    with metrics.operation(label, len(filenames), callback=progress) as p:
+        src = open_native_image(src_raw, src_format, writable=move, diskdefs_path=diskdefs_path)
+        dst = open_native_image(dst_raw, dst_format, writable=True, diskdefs_path=diskdefs_path)
+        if src is not None and dst is not None:
+            with src, dst:
+                try:
+                    files = []
+                    for filename in filenames:
+                        f = src.find(filename)
+                        if f is None:
+                            raise cpmfs.CpmFsError(f"File not found on image: {filename}")
+                        files.append(f)
+                    p.total_bytes = sum(f.size for f in files)
+                    dst.plan_files([(f"{f.user}:{f.filename}", f.size) for f in files])
+
+                    def counted(chunks):
+                        while True:
+                            with p.stage("read"):
+                                chunk = next(chunks, None)
+                            if chunk is None:
+                                return
+                            yield chunk
+                            p.advance(len(chunk), stage="read")
+
+                    dst.begin()
+                    try:
+                        for f in files:
+                            with p.stage("write"):
+                                dst.write_stream(f"{f.user}:{f.filename}", f.size,
+                                                 counted(src.iter_file(f"{f.user}:{f.filename}")))
+                            p.advance(files=1)
+                        with p.stage("write"):
+                            dst.commit()
+                    except BaseException:
+                        dst.rollback()
+                        raise
+                    finally:
+                        record_dirty(dst_raw, dst.dirty)
+                    if move:
+                        try:
+                            with p.stage("delete"), src.transaction():
+                                for f in files:
+                                    src.delete_file(f"{f.user}:{f.filename}")
+                        finally:
+                            record_dirty(src_raw, src.dirty)
+                except cpmfs.CpmFsError as e:
+                    raise RuntimeError(f"{label} failed (nothing copied):\n{e}")
+            return
+        for image in (src, dst):
+            if image is not None:
+                image.close()
+
+        # No native engine for one side: go through a temporary folder with cpmtools
+        tmp_dir = tempfile.mkdtemp(prefix="viewcpm-copy-")
+        try:
+            extract_files(cpmtools_path, src_raw, filenames, tmp_dir, src_format, diskdefs_path)
+            with p.stage("write"):
+                insert_files(cpmtools_path, dst_raw, [os.path.join(tmp_dir, host_name(f)) for f in filenames],
+                             dst_format, diskdefs_path)
+            if move:
+                with p.stage("delete"):
+                    delete_files(cpmtools_path, src_raw, filenames, src_format, diskdefs_path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        p.advance(files=len(filenames))
+
+def get_disk_info(cpmtools_path, raw_path, disk_format="kpii", diskdefs_path=None):
+    """
+    Returns (disk_size_bytes, free_bytes) of RAW image.
+    """
+    scan = scan_image(raw_path, disk_format, diskdefs_path)
+    if scan is not None:
+        return scan.disk_size, scan.free_bytes
+
     if not cpmtools_path or not os.path.isdir(cpmtools_path):
         raise FileNotFoundError("CP/M tools directory not found.")
 
@@ -167,7 +1046,7 @@ def get_disk_info(cpmtools_path, raw_path, disk_format="kpii"):
         raise FileNotFoundError(f"cpmls not found in {cpmtools_path}")
 
     # cpmls -f format -s image  returns size info
-    cmd = f'"{cpmls}" -f {disk_format} -l "{raw_path}"'
+    cmd = f'"{cpmls}" -f {disk_format} -l "{raw_file(raw_path)}"'
     success, output = run_command(cmd)
     if not success:
         return 0, 0
@@ -182,3 +1061,33 @@ def get_disk_info(cpmtools_path, raw_path, disk_format="kpii"):
         free_size = int(match.group(2))
     return disk_size, free_size
 
+
+# ----------------------------
+# Integrity check
+# ----------------------------
+
+def check_image(raw_path, disk_format, diskdefs_path=None, repair=False, progress=None):
+    """
+    Check the directory and block allocation of a RAW image (see
+    viewcpm_fsck). With repair=True, fixable problems are repaired in one
+    transaction and the image is checked again.
+    Returns (report, repaired_count), or (None, 0) when the native engine
+    cannot read the image.
+    """
+    with metrics.operation("Check", callback=progress) as p:
+        image = open_native_image(raw_path, disk_format, writable=repair, diskdefs_path=diskdefs_path)
+        if image is None:
+            return None, 0
+        with image:
+            with p.stage("check"):
+                report = fsck.check(image)
+            repaired = 0
+            if repair and not report.ok:
+                try:
+                    with p.stage("repair"):
+                        repaired = fsck.repair(image, report)
+                        report = fsck.check(image)
+                finally:
+                    record_dirty(raw_path, image.dirty)
+            p.advance(files=report.files)
+    return report, repaired
@@ -0,0 +1,170 @@
+# viewcpm_metrics.py
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+REPORT_INTERVAL = 0.1   # seconds between throttled updates
+HISTORY_SIZE = 50
+
+_listeners = []
+_lock = threading.Lock()
+history = deque(maxlen=HISTORY_SIZE)   # snapshots of finished operations
+
+def add_listener(fn):
+    """
+    Register fn(progress) to be called on every reported update and when an
+    operation finishes (progress.finished is then True). Called on the
+    thread doing the work.
+    """
+    with _lock:
+        _listeners.append(fn)
+
+def remove_listener(fn):
+    with _lock:
+        if fn in _listeners:
+            _listeners.remove(fn)
+
+
+def format_bytes(n):
+    for unit in ("bytes", "KB", "MB"):
+        if n < 1024 or unit == "MB":
+            return f"{int(n):,} {unit}" if unit == "bytes" else f"{n:,.1f} {unit}"
+        n /= 1024
+
+
+# ----------------------------
+# Progress
+# ----------------------------
+class Progress:
+    """
+    Counters and per-stage timings (convert, scan, read, write, ...) for
+    one long operation. callback(progress) is called at most every
+    REPORT_INTERVAL seconds, and once more when the operation finishes;
+    exceptions it raises (e.g. cancellation) propagate to the operation.
+    """
+
+    def __init__(self, label, total_files=0, total_bytes=0, callback=None):
+        self.label = label
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = 0
+        self.bytes = 0
+        self.note = ""
+        self.stages = {}      # name -> [seconds, bytes]
+        self.started = time.perf_counter()
+        self.finished = False
+        self.ended = None
+        self.callback = callback
+        self._last_report = 0.0
+
+    # --- Counting ---
+    @contextmanager
+    def stage(self, name):
+        """Time a block of work under name; stages can be entered repeatedly."""
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.stages.setdefault(name, [0.0, 0])[0] += time.perf_counter() - start
+
+    def advance(self, nbytes=0, files=0, stage=None):
+        self.bytes += nbytes
+        self.files += files
+        if stage:
+            self.stages.setdefault(stage, [0.0, 0])[1] += nbytes
+        self.report()
+
+    def set_note(self, text):
+        """Latest free-form detail, e.g. a line of subprocess output."""
+        if text:
+            self.note = text.strip()
+        self.report()
+
+    def report(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self._last_report < REPORT_INTERVAL:
+            return
+        self._last_report = now
+        with _lock:
+            listeners = list(_listeners)
+        for fn in listeners:
+            fn(self)
+        if self.callback:
+            self.callback(self)
+
+    def finish(self):
+        self.finished = True
+        self.ended = time.perf_counter()
+        history.append(self.snapshot())
+        self.report(force=True)
+
+    # --- Derived figures ---
+    @property
+    def elapsed(self):
+        return (self.ended or time.perf_counter()) - self.started
+
+    @property
+    def bytes_per_sec(self):
+        elapsed = self.elapsed
+        return self.bytes / elapsed if elapsed else 0.0
+
+    @property
+    def files_per_sec(self):
+        elapsed = self.elapsed
+        return self.files / elapsed if elapsed else 0.0
+
+    @property
+    def eta(self):
+        """Seconds left, from bytes if the total is known, else from files; None if unknown."""
+        if self.total_bytes and self.bytes:
+            return max(0.0, (self.total_bytes - self.bytes) / self.bytes_per_sec)
+        if self.total_files and self.files:
+            return max(0.0, (self.total_files - self.files) / self.files_per_sec)
+        return None
+
+    def snapshot(self):
+        return {
+            "label": self.label,
+            "files": self.files,
+            "total_files": self.total_files,
+            "bytes": self.bytes,
+            "total_bytes": self.total_bytes,
+            "seconds": round(self.elapsed, 6),
+            "bytes_per_sec": round(self.bytes_per_sec),
+            "files_per_sec": round(self.files_per_sec, 2),
+            "eta": None if self.eta is None else round(self.eta, 1),
+            "stages": {name: {"seconds": round(sec, 6), "bytes": n} for name, (sec, n) in self.stages.items()},
+            "finished": self.finished,
+        }
+
+    def describe(self):
+        """One status-bar line."""
+        parts = [self.label]
+        if self.total_files:
+            parts.append(f"{self.files}/{self.total_files} files")
+        if self.bytes:
+            total = f" of {format_bytes(self.total_bytes)}" if self.total_bytes else ""
+            parts.append(f"{format_bytes(self.bytes)}{total}")
+            parts.append(f"{format_bytes(self.bytes_per_sec)}/s")
+        if self.files and self.total_files:
+            parts.append(f"{self.files_per_sec:.1f} files/s")
+        if self.finished:
+            parts.append(f"done in {self.elapsed:.1f}s")
+        elif self.eta is not None:
+            parts.append(f"ETA {int(self.eta) // 60}:{int(self.eta) % 60:02d}")
+        else:
+            parts.append(f"{self.elapsed:.0f}s")
+        if self.note and not self.finished:
+            parts.append(self.note)
+        return " — ".join(parts)
+
+
+@contextmanager
+def operation(label, total_files=0, total_bytes=0, callback=None):
+    """with operation(...) as progress: ... — finishes the Progress on exit."""
+    progress = Progress(label, total_files, total_bytes, callback)
+    try:
+        yield progress
+    finally:
+        progress.finish()
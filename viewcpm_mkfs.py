@@ -0,0 +1,371 @@
+# viewcpm_mkfs.py
+"""Create formatted CP/M disk images from diskdefs, without mkfs.cpm."""
+import argparse
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+import viewcpm_cpmfs as cpmfs
+import viewcpm_dsk as dsk
+import viewcpm_imd as imd
+import viewcpm_prefs as prefs
+from viewcpm_diskdefs import load_diskdef
+
+FILL = cpmfs.DELETED        # formatted sectors and empty directory entries
+CONTAINERS = (".img", ".raw", ".imd", ".dsk")
+WRITE_CHUNK = 1 << 20
+READ_CHUNK = 1 << 16
+CREATOR = b"ViewCPM"
+# diskdefs "datarate" (a density) -> IMD mode; default by sector size
+IMD_MODES = {"SD": 2, "DD": 5, "HD": 3, "ED": 3}
+DSK_MAX_SECTORS = (dsk.INFO_SIZE - 0x18) // 8
+SIDE_ORDERS = ("alt", "outout", "outback")
+MAX_CYLINDERS = 84          # more tracks than this and no side order: a double-sided disk
+# read once at import: reading the umask means setting it, which would race with worker threads
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+# ----------------------------
+# Building the RAW
+# ----------------------------
+def blank_raw(diskdef, boot=None):
+    """Formatted RAW for diskdef as a bytearray; boot (bytes) goes on the boot tracks."""
+    geom = cpmfs.Geometry(diskdef)
+    raw = bytearray([FILL]) * geom.sector_offset(geom.tracks, 0)
+    if boot:
+        room = geom.boottrk * geom.sectrk * geom.seclen
+        if len(boot) > room:
+            raise RuntimeError(f"Boot file is {len(boot):,} bytes; {diskdef.name} has {room:,} bytes of boot tracks.")
+        raw[geom.offset:geom.offset + len(boot)] = boot
+    return raw
+
+
+def host_files(source):
+    """[(host path, CP/M name with user)] for a host folder or a list of host files."""
+    if isinstance(source, (list, tuple)):
+        return [(path, f"0:{os.path.basename(path)}") for path in source]
+    files = []
+    for name in sorted(os.listdir(source)):
+        path = os.path.join(source, name)
+        if os.path.isfile(path):
+            files.append((path, f"0:{name}"))
+        elif os.path.isdir(path) and name.isdigit() and int(name) <= cpmfs.MAX_USER:
+            files.extend((os.path.join(path, n), f"{int(name)}:{n}") for n in sorted(os.listdir(path))
+                         if os.path.isfile(os.path.join(path, n)))
+    return files
+
+
+def split_valid(files):
+    """
+    Split host files [(path, name)] into those with valid CP/M 8.3 names
+    and the host paths of the rest (dotfiles, long names and the like).
+    """
+    valid, skipped = [], []
+    for path, name in files:
+        try:
+            cpmfs.split_filename(name)
+        except cpmfs.CpmFsError:
+            skipped.append(path)
+        else:
+            valid.append((path, name))
+    return valid, skipped
+
+
+def populate(raw, diskdef, files):
+    """
+    Write host files [(path, name)] onto a formatted RAW in place, streamed
+    from disk. Space for all of them is checked first. Returns bytes written.
+    """
+    image = cpmfs.CpmImage("mem:new", diskdef, writable=True, buffer=raw)
+    try:
+        sizes = [os.path.getsize(path) for path, _ in files]
+        image.plan_files([(name, size) for (_, name), size in zip(files, sizes)])
+        for (path, name), size in zip(files, sizes):
+            with open(path, "rb") as f:
+                image.write_stream(name, size, iter(lambda: f.read(READ_CHUNK), b""))
+    except cpmfs.CpmFsError as e:
+        raise RuntimeError(str(e))
+    finally:
+        image.close()
+    return sum(sizes)
+
+
+# ----------------------------
+# Containers
+# ----------------------------
+def side_order(diskdef, sides=None):
+    """
+    Side order of the container, or None for single sided. sides is 1, 2
+    or a side order and overrides the diskdef; otherwise the diskdef's own
+    order is used, and a diskdef without one is taken as double sided
+    ("alt", as the readers assume) when it has more tracks than a drive
+    has cylinders.
+    """
+    sides = str(sides or diskdef.sides or "").lower()
+    if not sides:
+        sides = "2" if diskdef.tracks > MAX_CYLINDERS else "1"
+    if sides == "1":
+        return None
+    order = "alt" if sides == "2" else sides
+    if order not in SIDE_ORDERS:
+        raise RuntimeError(f"Unknown sides {sides}; use 1, 2 or one of {', '.join(SIDE_ORDERS)}.")
+    if diskdef.tracks % 2:
+        raise RuntimeError(f"{diskdef.name} has an odd number of tracks ({diskdef.tracks}), "
+                           "so it cannot be double sided; use sides 1.")
+    return order
+
+
+def track_addresses(diskdef, sides=None):
+    """
+    (cylinder, head) of every RAW track, laid out in side_order() the
+    way the IMD and DSK readers order sides.
+    """
+    tracks = diskdef.tracks
+    order = side_order(diskdef, sides)
+    if order is None:
+        return [(t, 0) for t in range(tracks)]
+    cyls = tracks // 2
+    if order == "outout":
+        return [(t % cyls, t // cyls) for t in range(tracks)]
+    if order == "outback":
+        return [(t, 0) if t < cyls else (tracks - 1 - t, 1) for t in range(tracks)]
+    return [(t // 2, t % 2) for t in range(tracks)]
+
+
+def _tracks(raw, diskdef, sides=None):
+    """Yield (cylinder, head, track bytes) in RAW order."""
+    if diskdef.offset:
+        raise RuntimeError(f"{diskdef.name} starts at an offset in the image; only RAW images can be created.")
+    addresses = track_addresses(diskdef, sides)
+    if diskdef.sectrk > 255 or max(cyl for cyl, _ in addresses) > 255:
+        raise RuntimeError(f"{diskdef.name} has too many tracks or sectors for a floppy container; "
+                           "create a RAW image instead.")
+    size = diskdef.sectrk * diskdef.seclen
+    view = memoryview(raw)
+    for t, (cyl, head) in enumerate(addresses):
+        yield cyl, head, view[t * size:(t + 1) * size]
+
+
+def write_raw(raw, out):
+    view = memoryview(raw)
+    for i in range(0, len(view), WRITE_CHUNK):
+        out.write(view[i:i + WRITE_CHUNK])
+
+
+def write_imd(raw, diskdef, out, sides=None):
+    """ImageDisk tracks, with sector IDs 1..n and uniform (e.g. formatted) sectors compressed."""
+    mode = IMD_MODES.get(str(diskdef.datarate).upper(), 0 if diskdef.seclen == 128 else 5)
+    seclen = diskdef.seclen
+    out.write(time.strftime("IMD 1.18: %d/%m/%Y %H:%M:%S").encode("ascii") + b"\r\n"
+              + CREATOR + b" " + diskdef.name.encode("ascii", "replace") + b"\x1a")
+    for cyl, head, data in _tracks(raw, diskdef, sides):
+        track = imd.ImdTrack(mode, cyl, head, seclen, list(range(1, diskdef.sectrk + 1)))
+        track.sector_types = [1] * diskdef.sectrk
+        track.sectors = [bytes(data[i:i + seclen]) for i in range(0, len(data), seclen)]
+        out.write(imd.encode_track(track))
+
+
+def write_dsk(raw, diskdef, out, sides=None):
+    """Extended CPCEMU DSK, sector IDs 1..n."""
+    seclen = diskdef.seclen
+    if seclen not in imd.SECTOR_SIZES or diskdef.sectrk > DSK_MAX_SECTORS:
+        raise RuntimeError(f"{diskdef.name} does not fit in a DSK track ({diskdef.sectrk} x {seclen} bytes).")
+    addresses = track_addresses(diskdef, sides)
+    cyls = max(cyl for cyl, _ in addresses) + 1
+    heads = max(head for _, head in addresses) + 1
+    block = dsk.INFO_SIZE + -(-diskdef.sectrk * seclen // 256) * 256
+    if block // 256 > 255:
+        raise RuntimeError(f"{diskdef.name} tracks are too large for a DSK file.")
+    tracks = list(_tracks(raw, diskdef, sides))
+    info = bytearray(dsk.INFO_SIZE)
+    info[0:0x22] = dsk.EXTENDED_SIG + b" File\r\nDisk-Info\r\n"
+    info[0x22:0x30] = CREATOR.ljust(14)
+    info[0x30], info[0x31] = cyls, heads
+    # DSK files store tracks cylinder by cylinder, head 0 then head 1
+    order = sorted(range(len(addresses)), key=lambda t: addresses[t])
+    info[0x34:0x34 + len(order)] = bytes([block // 256]) * len(order)
+    out.write(info)
+    n = imd.SECTOR_SIZES.index(seclen)
+    for t in order:
+        cyl, head, data = tracks[t]
+        header = bytearray(dsk.INFO_SIZE)
+        header[0:12] = dsk.TRACK_SIG + b"\r\n"
+        header[0x10], header[0x11] = cyl, head
+        header[0x14], header[0x15], header[0x16], header[0x17] = n, diskdef.sectrk, 0x4E, FILL
+        for i in range(diskdef.sectrk):
+            struct.pack_into("<6BH", header, 0x18 + i * 8, cyl, head, i + 1, n, 0, 0, seclen)
+        out.write(header)
+        out.write(bytes(data).ljust(block - dsk.INFO_SIZE, b"\0"))
+
+
+def create_image(out_path, diskdef, files=None, boot=None, force=False, sides=None):
+    """
+    Create a formatted image at out_path, its container chosen by the
+    extension. files: host folder or list of host files to copy on; files
+    without a valid CP/M name are left off and listed under "skipped".
+    sides (1, 2 or a side order) overrides the side layout of IMD and DSK
+    containers.
+    Written to a temp file and renamed, so a failure leaves nothing behind.
+    Returns a summary dict.
+    """
+    ext = os.path.splitext(out_path)[1].lower()
+    if ext not in CONTAINERS:
+        raise RuntimeError(f"Unknown image type {ext or '(none)'}; use one of {', '.join(CONTAINERS)}.")
+    if os.path.exists(out_path) and not force:
+        raise FileExistsError(f"{out_path} already exists.")
+    boot_data = None
+    if boot:
+        with open(boot, "rb") as f:
+            boot_data = f.read()
+    raw = blank_raw(diskdef, boot_data)
+    sources, skipped = split_valid(host_files(files)) if files else ([], [])
+    written = populate(raw, diskdef, sources) if sources else 0
+
+    folder = os.path.dirname(os.path.abspath(out_path))
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".viewcpm-new-")
+    try:
+        with os.fdopen(fd, "wb", buffering=WRITE_CHUNK) as out:
+            if ext == ".imd":
+                write_imd(raw, diskdef, out, sides)
+            elif ext == ".dsk":
+                write_dsk(raw, diskdef, out, sides)
+            else:
+                write_raw(raw, out)
+        # mkstemp creates the file 0600; give it the replaced file's mode, or the umask default
+        try:
+            mode = os.stat(out_path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~UMASK
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return {"path": os.path.abspath(out_path), "format": diskdef.name, "files": len(sources),
+            "skipped": skipped, "bytes": written, "size": os.path.getsize(out_path)}
+
+
+# ----------------------------
+# Batch
+# ----------------------------
+def read_manifest(manifest_path):
+    """Image specs from a manifest, with defaults applied and paths made absolute."""
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    defaults = {}
+    if isinstance(manifest, dict):
+        defaults = manifest.get("defaults", {})
+        manifest = manifest.get("images", [])
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    resolve = lambda path: os.path.join(base, os.path.expanduser(path))
+    specs = []
+    for i, item in enumerate(manifest):
+        spec = {**defaults, **item}
+        if not spec.get("output") or not spec.get("format"):
+            raise RuntimeError(f"Manifest image {i + 1} needs an output and a format.")
+        spec["output"] = resolve(spec["output"])
+        files = spec.get("files")
+        if isinstance(files, str):
+            spec["files"] = resolve(files)
+        elif files:
+            spec["files"] = [resolve(path) for path in files]
+        if spec.get("boot"):
+            spec["boot"] = resolve(spec["boot"])
+        specs.append(spec)
+    return specs
+
+
+def create_task(task):
+    """Batch worker: create one image. Takes and returns plain data only."""
+    spec, diskdefs_path, force = task
+    try:
+        diskdef = load_diskdef(diskdefs_path, spec["format"])
+        if diskdef is None:
+            raise RuntimeError(f"Unknown disk format: {spec['format']}")
+        result = create_image(spec["output"], diskdef, spec.get("files"), spec.get("boot"), force,
+                              spec.get("sides"))
+        result["error"] = None
+    except Exception as e:
+        result = {"path": spec["output"], "format": spec["format"], "error": str(e)}
+    return result
+
+
+def create_batch(manifest_path, diskdefs_path=None, jobs=None, force=False, log=None):
+    """Create every image in a manifest with a process pool. Returns a summary dict."""
+    diskdefs_path = diskdefs_path or prefs.get_pref("diskdefs_path", "")
+    specs = read_manifest(manifest_path)
+    start = time.perf_counter()
+    counts = {"created": 0, "failed": 0, "bytes": 0}
+    tasks = [(spec, diskdefs_path, force) for spec in specs]
+
+    def collect(results):
+        for result in results:
+            if result["error"]:
+                counts["failed"] += 1
+            else:
+                counts["created"] += 1
+                counts["bytes"] += result["size"]
+            if log:
+                done = counts["created"] + counts["failed"]
+                skipped = result.get("skipped")
+                log(f"[{done}/{len(tasks)}] {result['path']}: "
+                    + (result["error"] or f"{result['format']}, {result['files']} files"
+                       + (f", {len(skipped)} skipped" if skipped else "")))
+
+    workers = max(1, min(jobs or os.cpu_count() or 1, len(tasks)))
+    if workers == 1:
+        collect(map(create_task, tasks))
+    else:
+        with Pool(workers) as pool:
+            collect(pool.imap_unordered(create_task, tasks, chunksize=4))
+    return {"images": len(tasks), **counts, "seconds": round(time.perf_counter() - start, 3)}
+
+
+# ----------------------------
+# Command line
+# ----------------------------
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python viewcpm_mkfs.py",
+                                     description="Create formatted CP/M disk images from diskdefs.")
+    parser.add_argument("--diskdefs", default=prefs.get_pref("diskdefs_path", ""), help="diskdefs file")
+    parser.add_argument("--force", action="store_true", help="overwrite existing images")
+    sub = parser.add_subparsers(dest="command", required=True)
+    new = sub.add_parser("new", help="create one image")
+    new.add_argument("output", help=f"image to create ({', '.join(CONTAINERS)})")
+    new.add_argument("-f", "--format", required=True, help="diskdef name")
+    new.add_argument("-F", "--files", help="host folder to copy onto the image")
+    new.add_argument("--boot", help="file to write on the boot tracks")
+    new.add_argument("--sides", choices=("1", "2") + SIDE_ORDERS,
+                     help="side layout of an IMD or DSK image (default: from the diskdef)")
+    batch = sub.add_parser("batch", help="create the images listed in a JSON manifest")
+    batch.add_argument("manifest")
+    batch.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "batch":
+        log = lambda text: print(text, file=sys.stderr)
+        try:
+            summary = create_batch(args.manifest, args.diskdefs, jobs=args.jobs, force=args.force, log=log)
+        except (OSError, ValueError, RuntimeError) as e:
+            print(f"viewcpm_mkfs: {e}", file=sys.stderr)
+            return 2
+        print(json.dumps(summary))
+        return 1 if summary["failed"] else 0
+
+    spec = {"output": args.output, "format": args.format, "files": args.files, "boot": args.boot,
+            "sides": args.sides}
+    result = create_task((spec, args.diskdefs, args.force))
+    print(json.dumps(result))
+    return 1 if result["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
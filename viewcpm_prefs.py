@@ -1,25 +1,110 @@
+import atexit
 import json
 import os
+import threading
 
 PREF_FILE = "viewcpm_prefs.json"
+FLUSH_DELAY = 0.5   # seconds to coalesce set_pref calls before writing
 
-def load_prefs():
-    """Load preferences from JSON file."""
+# ----------------------------
+# In-process store
+# ----------------------------
+_lock = threading.RLock()
+_prefs = None        # cached dict, loaded on first use
+_stamp = None        # (mtime_ns, size) of PREF_FILE when last read or written
+_pending = {}        # keys set since the last flush
+_timer = None
+
+def _file_stamp():
+    try:
+        st = os.stat(PREF_FILE)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _read_file():
     if os.path.exists(PREF_FILE):
-        with open(PREF_FILE, "r") as f:
-            return json.load(f)
+        try:
+            with open(PREF_FILE, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
     return {}
 
+def _current():
+    """Cached prefs, reloaded if the file was changed outside this process."""
+    global _prefs, _stamp
+    stamp = _file_stamp()
+    if _prefs is None or stamp != _stamp:
+        _prefs = _read_file()
+        _prefs.update(_pending)   # unsaved changes win over the file
+        _stamp = stamp
+    return _prefs
+
+def _write_file(data):
+    global _stamp
+    tmp_path = PREF_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, PREF_FILE)
+    _stamp = _file_stamp()
+
+# ----------------------------
+# Public API
+# ----------------------------
+def load_prefs():
+    """Return a copy of the current preferences."""
+    with _lock:
+        return dict(_current())
+
 def save_prefs(prefs):
-    """Save preferences to JSON file."""
-    with open(PREF_FILE, "w") as f:
-        json.dump(prefs, f, indent=2)
+    """Replace all preferences and write them now."""
+    global _prefs
+    with _lock:
+        _cancel_timer()
+        _pending.clear()
+        _prefs = dict(prefs)
+        _write_file(_prefs)
 
 def get_pref(key, default=None):
-    prefs = load_prefs()
-    return prefs.get(key, default)
+    with _lock:
+        return _current().get(key, default)
 
 def set_pref(key, value):
-    prefs = load_prefs()
-    prefs[key] = value
-    save_prefs(prefs)
+    """Set a preference. The file write is deferred and coalesced (see flush)."""
+    global _timer
+    with _lock:
+        prefs = _current()
+        if key in prefs and prefs[key] == value and key not in _pending:
+            return
+        prefs[key] = value
+        _pending[key] = value
+        if _timer is None:
+            _timer = threading.Timer(FLUSH_DELAY, flush)
+            _timer.daemon = True
+            _timer.start()
+
+def flush():
+    """Write pending changes, merged over the file's current contents, in one atomic replace."""
+    global _prefs
+    with _lock:
+        _cancel_timer()
+        if not _pending:
+            return
+        merged = _read_file()
+        merged.update(_pending)
+        try:
+            _write_file(merged)
+        except OSError as e:
+            print(f"Could not save preferences: {e}")
+            return
+        _pending.clear()
+        _prefs = merged
+
+def _cancel_timer():
+    global _timer
+    if _timer is not None:
+        _timer.cancel()
+        _timer = None
+
+atexit.register(flush)
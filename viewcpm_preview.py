@@ -0,0 +1,112 @@
+# viewcpm_preview.py
+import viewcpm_cpmfs as cpmfs
+import viewcpm_logic as logic
+
+PAGE_SIZE = 4096       # bytes rendered per page
+SAMPLE_SIZE = 1024     # bytes looked at to tell text from binary
+EOF_MARK = 0x1A        # CP/M text files end at ^Z
+HEX_WIDTH = 16
+TEXT_CONTROLS = {0x09, 0x0A, 0x0C, 0x0D, EOF_MARK}
+# High bit stripped, CR dropped, other control characters shown as "."
+TEXT_TABLE = bytes(c & 0x7F if 32 <= c & 0x7F < 127 or c & 0x7F in (0x09, 0x0A, 0x0C) else 0x2E
+                   for c in range(256))
+
+def is_text(sample):
+    """
+    Guess whether sample (the start of a file) is text. High bits are
+    ignored, since WordStar marks word ends with them.
+    """
+    end = sample.find(EOF_MARK)
+    if end >= 0:
+        sample = sample[:end]
+    if not sample:
+        return True
+    printable = sum(1 for c in sample if 32 <= (c & 0x7F) < 127 or c in TEXT_CONTROLS)
+    return b"\0" not in sample and printable >= len(sample) * 0.95
+
+
+def text_page(data):
+    """Render text bytes; returns (text, True if the ^Z end of file was reached)."""
+    end = data.find(EOF_MARK)
+    if end >= 0:
+        data = data[:end]
+    return data.translate(TEXT_TABLE, b"\r").decode("ascii"), end >= 0
+
+
+def hex_dump(data, offset=0):
+    """Classic offset / hex / ASCII dump, HEX_WIDTH bytes a line."""
+    lines = []
+    for i in range(0, len(data), HEX_WIDTH):
+        row = data[i:i + HEX_WIDTH]
+        hexes = " ".join(f"{c:02x}" for c in row).ljust(HEX_WIDTH * 3 - 1)
+        chars = "".join(chr(c) if 32 <= c < 127 else "." for c in row)
+        lines.append(f"{offset + i:08x}  {hexes}  |{chars}|")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+class Preview:
+    """
+    One file being previewed, rendered a page at a time. Owns the open
+    image and a cpmfs.FileReader on it, so only the blocks of pages that
+    are actually shown get read. Not thread-safe: run its calls in jobs
+    keyed by the image, like any other access to it.
+    """
+
+    def __init__(self, image, filename, page_size=PAGE_SIZE):
+        self.image = image
+        self.filename = filename
+        self.page_size = page_size
+        self.reader = image.open_file(filename)
+        self.mode = "text" if is_text(self.reader.read_at(0, SAMPLE_SIZE)) else "hex"
+        self.offset = 0
+        self.done = False
+
+    @property
+    def size(self):
+        return self.reader.size
+
+    @property
+    def bytes_read(self):
+        return self.reader.blocks_read * self.reader.blocksize
+
+    def set_mode(self, mode):
+        """Switch between "text" and "hex"; rendering starts over."""
+        self.mode = mode
+        self.offset = 0
+        self.done = False
+
+    def next_page(self):
+        """Text of the next page, or "" once the whole file has been shown."""
+        if self.done:
+            return ""
+        data = self.reader.read_at(self.offset, self.page_size)
+        start = self.offset
+        self.offset += len(data)
+        self.done = self.offset >= self.size
+        if self.mode == "hex":
+            return hex_dump(data, start)
+        text, eof = text_page(data)
+        self.done = self.done or eof
+        return text
+
+    def describe(self):
+        return (f"{self.filename} — {self.mode}, {self.size:,} bytes "
+                f"({min(self.offset, self.size):,} shown, {self.bytes_read:,} read)")
+
+    def close(self):
+        self.image.close()
+
+
+def open_preview(raw_path, disk_format, filename, diskdefs_path=None, page_size=PAGE_SIZE):
+    """
+    Preview of filename on a RAW image, or None when the native engine
+    cannot read the image. Raises RuntimeError for a missing file.
+    """
+    image = logic.open_native_image(raw_path, disk_format, diskdefs_path=diskdefs_path)
+    if image is None:
+        return None
+    try:
+        return Preview(image, filename, page_size)
+    except cpmfs.CpmFsError as e:
+        image.close()
+        raise RuntimeError(str(e))
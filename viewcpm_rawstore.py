@@ -0,0 +1,137 @@
+# viewcpm_rawstore.py
+"""Sparse and chunk-compressed storage for RAW working copies and the conversion cache."""
+import os
+import struct
+import threading
+import zlib
+from viewcpm_cpmfs import LazyBuffer
+
+CHUNK_SIZE = 1 << 16
+COPY_CHUNK = 1 << 20
+MAGIC = b"VCPMRAWZ"
+HEADER = struct.Struct("<8sQI")      # magic, RAW size, chunk size
+INDEX_ENTRY = struct.Struct("<QIH")  # file offset, stored length, fill byte (or NOT_UNIFORM)
+NOT_UNIFORM = 0xFFFF
+ZLIB_LEVEL = 1
+
+class RawStoreError(Exception):
+    """Raised for malformed compressed RAW files."""
+
+
+def _uniform(chunk):
+    """The byte chunk is filled with, or None."""
+    return chunk[0] if chunk and chunk.count(chunk[0]) == len(chunk) else None
+
+
+# ----------------------------
+# Sparse files
+# ----------------------------
+def sparse_copy(src_path, dst_path, chunk_size=CHUNK_SIZE):
+    """
+    Copy src_path to dst_path, seeking over all-zero chunks so they become
+    holes on filesystems that support them. Returns the bytes written.
+    """
+    written = 0
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        size = 0
+        while True:
+            data = src.read(COPY_CHUNK)
+            if not data:
+                break
+            for i in range(0, len(data), chunk_size):
+                chunk = data[i:i + chunk_size]
+                if _uniform(chunk) == 0:
+                    dst.seek(len(chunk), os.SEEK_CUR)
+                else:
+                    dst.write(chunk)
+                    written += len(chunk)
+            size += len(data)
+        dst.truncate(size)
+    return written
+
+
+def disk_usage(st):
+    """Bytes a file actually occupies (holes excluded where the OS reports blocks)."""
+    blocks = getattr(st, "st_blocks", None)
+    return min(st.st_size, blocks * 512) if blocks is not None else st.st_size
+
+
+# ----------------------------
+# Chunk-compressed files
+# ----------------------------
+def compress_file(src_path, dst_path, chunk_size=CHUNK_SIZE):
+    """
+    Write src_path (a RAW) to dst_path in the chunk-compressed format:
+    header, chunk data, then the index of every chunk. Returns the RAW size.
+    """
+    index = []
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        dst.write(HEADER.pack(MAGIC, 0, chunk_size))
+        size = 0
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            fill = _uniform(chunk)
+            if fill is not None:
+                index.append((0, len(chunk), fill))
+            else:
+                data = zlib.compress(chunk, ZLIB_LEVEL)
+                index.append((dst.tell(), len(data), NOT_UNIFORM))
+                dst.write(data)
+            size += len(chunk)
+        index_offset = dst.tell()
+        dst.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in index))
+        dst.write(struct.pack("<QI", index_offset, len(index)))
+        dst.seek(0)
+        dst.write(HEADER.pack(MAGIC, size, chunk_size))
+    return size
+
+
+class CompressedRaw:
+    """
+    A chunk-compressed RAW file, decompressed one chunk at a time. The
+    file stays open, so chunks can still be read if the cache evicts it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, "rb")
+        self._lock = threading.Lock()
+        try:
+            magic, self.size, self.chunk_size = HEADER.unpack(self._f.read(HEADER.size))
+            if magic != MAGIC:
+                raise RawStoreError(f"{os.path.basename(path)} is not a compressed RAW file.")
+            self._f.seek(-12, os.SEEK_END)
+            index_offset, count = struct.unpack("<QI", self._f.read(12))
+            self._f.seek(index_offset)
+            data = self._f.read(count * INDEX_ENTRY.size)
+            if len(data) != count * INDEX_ENTRY.size or count != -(-self.size // self.chunk_size):
+                raise RawStoreError(f"{os.path.basename(path)} has a damaged chunk index.")
+        except (struct.error, OSError) as e:
+            self._f.close()
+            raise RawStoreError(f"{os.path.basename(path)} is damaged: {e}")
+        except RawStoreError:
+            self._f.close()
+            raise
+        self.index = list(INDEX_ENTRY.iter_unpack(data))
+
+    def chunk_length(self, i):
+        return min(self.chunk_size, self.size - i * self.chunk_size)
+
+    def read_chunk(self, i):
+        offset, length, fill = self.index[i]
+        if fill != NOT_UNIFORM:
+            return bytes([fill]) * self.chunk_length(i)
+        with self._lock:
+            self._f.seek(offset)
+            data = self._f.read(length)
+        return zlib.decompress(data)
+
+    def lazy_buffer(self):
+        """LazyBuffer over the RAW, decompressing each chunk on first access."""
+        spans = [(i * self.chunk_size, self.chunk_length(i)) for i in range(len(self.index))]
+        return LazyBuffer(self.size, spans, self.read_chunk)
+
+    def close(self):
+        self._f.close()
@@ -0,0 +1,180 @@
+# viewcpm_store.py
+"""Content-addressed store for extracted files."""
+import errno
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+FICLONE = 0x40049409     # Linux ioctl(2) to clone a file (btrfs, XFS)
+LINK_MODES = ("auto", "reflink", "hardlink", "copy")
+CHUNK_SIZE = 1 << 20
+
+def new_hash():
+    """BLAKE2b-128, the hash used for images (logic.image_hash) and the catalog."""
+    return hashlib.blake2b(digest_size=16)
+
+
+def ref_key(image_hash, filename):
+    """Key for one file on one image, as given by logic.image_hash."""
+    return f"{image_hash}:{filename.lower()}"
+
+
+def reflink(src, dst):
+    """Clone src to dst sharing extents; raises OSError where unsupported."""
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, "reflinks not supported")
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.unlink(dst)
+            raise
+
+
+class ContentStore:
+    """
+    Content-addressed file store rooted at root. Safe to share between
+    threads and processes: objects are written to a temp file and
+    renamed into place, and the ref table lives in SQLite.
+    link_mode: auto (reflink, else hardlink, else copy), reflink,
+    hardlink or copy. Objects are made read-only, since a hardlinked
+    extract shares its inode with the store.
+    """
+
+    def __init__(self, root, link_mode="auto"):
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"link_mode must be one of {', '.join(LINK_MODES)}")
+        self.root = os.path.abspath(root)
+        self.link_mode = link_mode
+        self.objects = os.path.join(self.root, "objects")
+        os.makedirs(self.objects, exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.stats = {"stored": 0, "deduplicated": 0, "skipped": 0, "bytes_stored": 0}
+
+    # --- Refs ---
+    @property
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(os.path.join(self.root, "refs.db"), timeout=30)
+            conn.execute("CREATE TABLE IF NOT EXISTS refs (key TEXT PRIMARY KEY, hash TEXT NOT NULL, size INTEGER)")
+        return conn
+
+    def lookup(self, key):
+        """Hash stored for key if its object is still present, else None."""
+        row = self._db.execute("SELECT hash FROM refs WHERE key = ?", (key,)).fetchone()
+        if row and os.path.exists(self.path(row[0])):
+            return row[0]
+        return None
+
+    def remember(self, key, digest, size):
+        with self._db as conn:
+            conn.execute("INSERT OR REPLACE INTO refs (key, hash, size) VALUES (?, ?, ?)", (key, digest, size))
+
+    # --- Objects ---
+    def path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def put(self, chunks):
+        """
+        Store the content of an iterable of byte chunks, hashing as it is
+        written. Returns the hash; content already present is not kept twice.
+        """
+        h = new_hash()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.objects, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = h.hexdigest()
+            path = self.path(digest)
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+                self._count("deduplicated")
+                return digest
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._count("stored")
+        self._count("bytes_stored", size)
+        return digest
+
+    def put_file(self, path):
+        """Store a host file, streamed from disk. Returns its hash."""
+        with open(path, "rb") as f:
+            return self.put(iter(lambda: f.read(CHUNK_SIZE), b""))
+
+    # --- Checkout ---
+    def link(self, digest, dest_path):
+        """
+        Make dest_path a reflink, hardlink or copy of object digest.
+        Does nothing if dest_path already is a hardlink to it.
+        """
+        src = self.path(digest)
+        if os.path.exists(dest_path):
+            if os.path.samefile(src, dest_path):
+                return
+            os.unlink(dest_path)
+        if self.link_mode in ("auto", "reflink"):
+            try:
+                reflink(src, dest_path)
+                return
+            except OSError:
+                if self.link_mode == "reflink":
+                    raise
+        if self.link_mode in ("auto", "hardlink"):
+            try:
+                os.link(src, dest_path)
+                return
+            except OSError as e:
+                if self.link_mode == "hardlink" or e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+        shutil.copyfile(src, dest_path)
+
+    def checkout(self, key, chunks, size, dest_path):
+        """
+        Extract one file through the store: content already stored under
+        key is linked without consuming chunks (pass a lazy iterator);
+        otherwise it is stored first. Returns the hash.
+        """
+        digest = self.lookup(key)
+        if digest is None:
+            digest = self.put(chunks)
+            self.remember(key, digest, size)
+        else:
+            self._count("skipped")
+        self.link(digest, dest_path)
+        return digest
+
+    def adopt(self, path, key=None):
+        """Move an already extracted host file into the store and link it back."""
+        digest = self.put_file(path)
+        if key:
+            self.remember(key, digest, os.path.getsize(path))
+        self.link(digest, path)
+        return digest
+
+    def describe(self):
+        s = self.stats
+        return (f"{s['stored']} stored, {s['deduplicated']} deduplicated, "
+                f"{s['skipped']} already extracted")
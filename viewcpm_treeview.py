@@ -0,0 +1,139 @@
+# viewcpm_treeview.py
+import itertools
+
+CHUNK_SIZE = 500   # rows inserted per after() tick
+ARROWS = {False: " ▲", True: " ▼"}
+
+def chunked(rows, size=CHUNK_SIZE):
+    """Split an iterable of rows into lists of at most size rows."""
+    it = iter(rows)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def size_key(value):
+    """Sort key for a size cell: 1024, "1,024" and "" all work."""
+    if isinstance(value, int):
+        return value
+    digits = str(value).replace(",", "")
+    return int(digits) if digits.isdigit() else -1
+
+
+class FileTree:
+    """
+    Keeps a (name, size) ttk.Treeview in sync with a listing without
+    freezing the UI: rows are merged in chunks from after(), a refresh
+    only inserts, updates or deletes the rows that changed, and clicking
+    a heading sorts by a precomputed key per row.
+    Row iids are the file names, so tree.selection() returns names.
+    """
+
+    def __init__(self, tree, columns=("name", "size")):
+        self.tree = tree
+        self.columns = columns
+        self.values = {}                               # iid -> displayed values
+        self.keys = {col: {} for col in columns}       # column -> {iid: sort key}
+        self.sort_column = None
+        self.reverse = False
+        self._titles = {col: tree.heading(col, "text") for col in columns}
+        self._generation = 0
+        for col in columns:
+            tree.heading(col, command=lambda c=col: self.sort_by(c))
+
+    # --- Filling ---
+    def load(self, chunks, done=None):
+        """
+        Merge rows from an iterable of chunks ([(name, size), ...] lists),
+        one chunk per after() tick, so a lazy lister (utils.iter_host_files)
+        streams straight into the tree. Rows not seen by the end are removed.
+        A new load() supersedes one still in progress.
+        """
+        self._generation += 1
+        generation = self._generation
+        chunks = iter(chunks)
+        seen = {}   # iids in listing order
+
+        def step():
+            if generation != self._generation:
+                return
+            chunk = next(chunks, None)
+            if chunk is None:
+                self._finish(seen)
+                if done:
+                    done(len(seen))
+                return
+            self._merge(chunk, seen)
+            self.tree.after(1, step)
+
+        step()
+
+    def set_rows(self, rows, done=None):
+        """load() for a complete list of rows."""
+        self.load(chunked(rows), done)
+
+    def apply(self, rows, removed=()):
+        """
+        Incremental update from a watcher: merge rows and delete removed
+        names, leaving every other row alone.
+        """
+        self._merge(rows, {})
+        self._delete([iid for iid in map(str, removed) if iid in self.values])
+        self._arrange()
+
+    def clear(self):
+        self._generation += 1
+        self._delete(list(self.values))
+
+    def _merge(self, chunk, seen):
+        tree = self.tree
+        for name, size in chunk:
+            iid = str(name)
+            seen[iid] = None
+            values = (iid, f"{size:,}" if isinstance(size, int) else size)
+            old = self.values.get(iid)
+            if old == values:
+                continue
+            self.values[iid] = values
+            self.keys[self.columns[0]][iid] = iid.lower()
+            self.keys[self.columns[1]][iid] = size_key(size)
+            if old is None:
+                tree.insert("", "end", iid=iid, values=values)
+            else:
+                tree.item(iid, values=values)
+
+    def _finish(self, seen):
+        gone = set(self.values).difference(seen)
+        self._delete(gone)
+        self._arrange(seen)
+
+    def _delete(self, iids):
+        for chunk in chunked(iids):
+            self.tree.delete(*chunk)
+            for iid in chunk:
+                del self.values[iid]
+                for keys in self.keys.values():
+                    keys.pop(iid, None)
+
+    def _arrange(self, order=None):
+        """Reorder every row with a single Tk call."""
+        if self.sort_column:
+            keys = self.keys[self.sort_column]
+            order = sorted(self.values, key=keys.__getitem__, reverse=self.reverse)
+        elif order is None:
+            return
+        self.tree.set_children("", *order)
+
+    # --- Sorting ---
+    def sort_by(self, column):
+        """Sort by column; clicking the same heading again reverses the order."""
+        if column == self.sort_column:
+            self.reverse = not self.reverse
+        else:
+            self.sort_column, self.reverse = column, False
+        for col in self.columns:
+            arrow = ARROWS[self.reverse] if col == column else ""
+            self.tree.heading(col, text=self._titles[col] + arrow)
+        self._arrange()
@@ -1,21 +1,37 @@
 import os
 from tkinter import messagebox
 
+def iter_host_files(folder_path, chunk_size=500):
+    """
+    Stream the files in the host folder with their sizes, in chunks of
+    up to chunk_size entries, using one os.scandir pass (no per-file
+    isfile/getsize calls).
+    Output: [(filename, size), ...] lists
+    """
+    chunk = []
+    try:
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                    chunk.append((entry.name, entry.stat().st_size))
+                except OSError:
+                    continue
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+    except OSError as e:
+        print(f"Error listing host files: {e}")
+    if chunk:
+        yield chunk
+
 def list_host_files(folder_path):
     """
     Returns a list of files in the host folder with their sizes.
     Output: [(filename, size), ...]
     """
-    file_list = []
-    try:
-        for f in os.listdir(folder_path):
-            full_path = os.path.join(folder_path, f)
-            if os.path.isfile(full_path):
-                size = os.path.getsize(full_path)
-                file_list.append((f, size))
-    except Exception as e:
-        print(f"Error listing host files: {e}")
-    return file_list
+    return [row for chunk in iter_host_files(folder_path) for row in chunk]
 
 def is_executable_file(path):
     """Check if path exists and is executable."""
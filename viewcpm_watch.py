@@ -0,0 +1,178 @@
+# viewcpm_watch.py
+import ctypes
+import ctypes.util
+import os
+import select
+import stat
+import struct
+import sys
+import threading
+import time
+
+POLL_INTERVAL = 2.0    # seconds between scans when polling
+SETTLE_DELAY = 0.25    # quiet time before a batch of changes is delivered
+MAX_DELAY = 1.0        # deliver at least this often while changes keep coming
+FULL_RESCAN = 5000     # more changed names than this: ask for a full reload
+
+# inotify(7) event bits
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct("iIII")
+
+def snapshot(folder):
+    """{name: (size, mtime_ns)} for the files in folder, from one scandir pass."""
+    files = {}
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        st = entry.stat()
+                        files[entry.name] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return files
+
+def stat_changes(folder, names):
+    """Turn changed names into (rows [(name, size)], removed [name])."""
+    rows, removed = [], []
+    for name in names:
+        try:
+            st = os.stat(os.path.join(folder, name))
+        except OSError:
+            removed.append(name)
+            continue
+        if stat.S_ISREG(st.st_mode):
+            rows.append((name, st.st_size))
+        else:
+            removed.append(name)
+    return rows, removed
+
+
+def _libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        libc.inotify_init1
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+# ----------------------------
+# Watcher
+# ----------------------------
+class FolderWatcher:
+    """
+    Watch one host folder on a background thread. Uses inotify on Linux
+    and falls back to polling with scandir every interval seconds.
+    Changes are coalesced and delivered as on_change((rows, removed)),
+    or on_change(None) when the folder needs a full reload (inotify
+    overflow, folder moved, or a very large batch). on_change runs on the
+    watcher thread.
+    """
+
+    def __init__(self, folder, on_change, interval=POLL_INTERVAL, use_inotify=True):
+        self.folder = folder
+        self.on_change = on_change
+        self.interval = interval
+        self._stop = threading.Event()
+        self._libc = _libc() if use_inotify else None
+        self.backend = "inotify" if self._libc else "poll"
+        self._thread = threading.Thread(target=self._run, name="viewcpm-watch", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _deliver(self, names):
+        if names is None or len(names) > FULL_RESCAN:
+            self.on_change(None)
+        elif names:
+            self.on_change(stat_changes(self.folder, sorted(names)))
+
+    def _run(self):
+        if self._libc:
+            try:
+                self._run_inotify()
+                return
+            except OSError:
+                self.backend = "poll"
+        self._run_poll()
+
+    # --- Polling ---
+    def _run_poll(self):
+        previous = snapshot(self.folder)
+        while not self._stop.wait(self.interval):
+            current = snapshot(self.folder)
+            changed = {name for name, stamp in current.items() if previous.get(name) != stamp}
+            changed.update(name for name in previous if name not in current)
+            previous = current
+            self._deliver(changed)
+
+    # --- inotify ---
+    def _run_inotify(self):
+        libc = self._libc
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        try:
+            if libc.inotify_add_watch(fd, os.fsencode(self.folder), WATCH_MASK) < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+            pending = set()
+            first = None
+            while not self._stop.is_set():
+                timeout = SETTLE_DELAY if pending else 0.5
+                ready, _, _ = select.select([fd], [], [], timeout)
+                if ready:
+                    reload_all = self._read_events(fd, pending)
+                    if reload_all:
+                        self._deliver(None)
+                        pending.clear()
+                        first = None
+                        continue
+                    first = first or time.monotonic()
+                    if time.monotonic() - first < MAX_DELAY:
+                        continue
+                if pending:
+                    self._deliver(pending)
+                    pending = set()
+                    first = None
+        finally:
+            os.close(fd)
+
+    def _read_events(self, fd, pending):
+        """Add changed names to pending; True if a full reload is needed."""
+        try:
+            data = os.read(fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        offset = 0
+        reload_all = False
+        while offset + EVENT_HEADER.size <= len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                reload_all = True
+            elif name:
+                pending.add(os.fsdecode(name))
+        return reload_all
@@ -0,0 +1,145 @@
+# viewcpm_workspace.py
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import viewcpm_logic as logic
+
+MAX_PROCESSES = 2   # SAMdisk conversions running at once
+MAX_SCANS = 4       # images being detected and listed at once
+
+class WorkspaceImage:
+    """One image in the workspace and how far the pipeline has got with it."""
+
+    def __init__(self, image_path, disk_format=None):
+        self.image_path = image_path
+        self.disk_format = disk_format   # chosen by the user, else detected by the lister
+        self.state = "queued"            # converting, scanning, ready, failed or cancelled
+        self.raw_path = None
+        self.listing = None              # what the lister returned
+        self.progress = None             # metrics.Progress of the conversion
+        self.error = None
+
+    @property
+    def name(self):
+        return os.path.basename(self.image_path)
+
+    @property
+    def busy(self):
+        return self.state in ("queued", "converting", "scanning")
+
+    def describe(self):
+        if self.state == "failed":
+            return f"failed: {self.error}"
+        if self.state == "converting" and self.progress is not None:
+            return self.progress.describe()
+        return self.state
+
+
+class Workspace:
+    """
+    Images open side by side. open() sends images through a two-stage
+    pipeline on an asyncio loop in a background thread: conversion, with
+    at most max_processes SAMdisk subprocesses at once, then
+    lister(entry) in a pool of max_scans threads. Stages overlap, so one
+    image is scanned while the next is still converting, and each image
+    is ready as soon as its own stages are done.
+    on_update(entry) is called, on a pipeline thread, after every state
+    change and conversion progress report.
+    """
+
+    def __init__(self, samdisk_path, lister, on_update, max_processes=MAX_PROCESSES, max_scans=MAX_SCANS):
+        self.samdisk_path = samdisk_path
+        self.lister = lister
+        self.on_update = on_update
+        self.images = OrderedDict()    # image path -> WorkspaceImage, in opening order
+        self._lock = threading.Lock()
+        self._tasks = {}               # image path -> asyncio.Task (loop thread only)
+        self._scans = ThreadPoolExecutor(max_scans, thread_name_prefix="viewcpm-scan")
+        self._loop = asyncio.new_event_loop()
+        self._processes = None
+        threading.Thread(target=self._loop.run_forever, name="viewcpm-workspace", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._setup(max_processes), self._loop).result()
+
+    async def _setup(self, max_processes):
+        self._processes = asyncio.Semaphore(max_processes)
+
+    # --- Opening ---
+    def open(self, paths, disk_format=None):
+        """
+        Queue images; returns their entries in order. Images already open
+        or on their way are returned as they are, failed ones are retried.
+        """
+        entries = []
+        with self._lock:
+            for path in paths:
+                path = os.path.abspath(path)
+                entry = self.images.get(path)
+                if entry is None or entry.state in ("failed", "cancelled"):
+                    entry = self.images[path] = WorkspaceImage(path, disk_format)
+                    self._loop.call_soon_threadsafe(self._start, entry)
+                entries.append(entry)
+        return entries
+
+    def _start(self, entry):
+        self._tasks[entry.image_path] = self._loop.create_task(self._open(entry))
+
+    def _set(self, entry, state):
+        entry.state = state
+        self.on_update(entry)
+
+    def _report(self, entry, progress):
+        entry.progress = progress
+        if not progress.finished:
+            self.on_update(entry)
+
+    async def _open(self, entry):
+        loop = asyncio.get_running_loop()
+        try:
+            self._set(entry, "converting")
+            entry.raw_path = await logic.convert_dsk_to_raw_async(
+                self.samdisk_path, entry.image_path, limit=self._processes,
+                progress=lambda p: self._report(entry, p), sides=logic.diskdef_sides(entry.disk_format))
+            self._set(entry, "scanning")
+            entry.listing = await loop.run_in_executor(self._scans, self.lister, entry)
+            self._set(entry, "ready")
+        except asyncio.CancelledError:
+            self._set(entry, "cancelled")
+        except Exception as e:
+            entry.error = str(e)
+            self._set(entry, "failed")
+        finally:
+            if self._tasks.get(entry.image_path) is asyncio.current_task():
+                del self._tasks[entry.image_path]
+
+    # --- Closing ---
+    def close(self, image_path):
+        """
+        Drop an image from the workspace, stopping its pipeline if it is
+        still running. Returns the entry; releasing its RAW (once nothing
+        else uses it) is up to the caller.
+        """
+        with self._lock:
+            entry = self.images.pop(os.path.abspath(image_path), None)
+        if entry is not None and entry.busy:
+            self._loop.call_soon_threadsafe(self._cancel, entry.image_path)
+        return entry
+
+    def _cancel(self, image_path=None):
+        for path, task in list(self._tasks.items()):
+            if image_path is None or path == image_path:
+                task.cancel()
+
+    def cancel_all(self):
+        """Stop every pipeline still running; running SAMdisk processes are killed."""
+        self._loop.call_soon_threadsafe(self._cancel)
+
+    def pending(self):
+        with self._lock:
+            return sum(1 for entry in self.images.values() if entry.busy)
+
+    def shutdown(self):
+        self.cancel_all()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._scans.shutdown(wait=False)